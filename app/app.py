@@ -1,19 +1,44 @@
 import mimetypes
-from flask import Flask, render_template, request, redirect, send_from_directory, url_for, flash, session, jsonify
+from flask import Flask, Response, render_template, request, redirect, send_file, send_from_directory, stream_with_context, url_for, flash, session, jsonify
 from flask_sqlalchemy import SQLAlchemy
-import torch
+from sqlalchemy import event, select, tuple_
+from sqlalchemy.orm import object_session
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 import os
+import socket
 import cv2
 import numpy as np
-from datetime import datetime
+from datetime import datetime, timedelta
 import requests
 import json
 import base64
 from PIL import Image
 import io
-from ultralytics import YOLO
+from pathlib import Path
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from batching import BatchScheduler
+from result_cache import InferenceCache, file_fingerprint, make_cache_key
+from engines import STATIC_BATCH_ENGINES
+from ingest import IngestedImage
+from worker_pool import InferencePool
+from model_registry import ModelRegistry
+from ollama_client import OllamaClient
+from job_queue import JobWorkers
+from llm_cache import LLMResponseCache, make_llm_cache_key
+from llm_scheduler import LLMOverloaded, LLMScheduler
+from llm_images import LLMImageCache
+from chat_context import ChatContext
+from llm_context import ConversationContexts
+from derivatives import DerivativeCache, source_stamp
+from migrations import migrate
+from history_summary import add_scan, dump_state, load_state, new_history_state, render_latest, render_summary
+from volume import VolumeTooLarge, estimate_volume, extract_slices, is_volume_upload
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = '5APrVdYTqt0QLgovSCvj0et7kCcl3rqw'
@@ -21,6 +46,70 @@ app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///aide_care.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'static/uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['YOLO_RUNS_DIR'] = 'runs/segment'
+app.config['YOLO_ENGINE'] = 'torch'  # torch, torchscript, onnx, openvino or openvino-int8 (see engines.py, quantization.py)
+app.config['YOLO_MAX_BATCH_SIZE'] = 8  # images per batched forward pass
+app.config['YOLO_MAX_WAIT_MS'] = 10  # how long a request waits for others to join its batch
+app.config['YOLO_WORKERS'] = 0  # > 0 runs inference in that many worker processes instead of in-process
+app.config['YOLO_WORKER_THREADS'] = None  # engine threads per worker (torch, ONNX Runtime, OpenVINO), None splits the CPUs evenly
+app.config['YOLO_ASYNC_PERSIST'] = True  # write overlays to disk off the request path
+app.config['YOLO_WARMUP'] = True  # load the model and run dummy inferences in the background at boot
+app.config['YOLO_WARMUP_RUNS'] = 2
+app.config['YOLO_WEIGHTS'] = 'yolov11-seg-brain.pt'  # file in models/, more versions can be loaded at runtime (see model_registry.py)
+app.config['YOLO_SMOKE_IMAGE'] = 'static/image/input/scan.jpg'  # a new model version must segment this before it takes traffic
+# Users who may load and swap model versions, by id; never derived from anything a user can set.
+app.config['MODEL_ADMIN_USER_IDS'] = {int(i) for i in os.environ.get('MODEL_ADMIN_USER_IDS', '').split(',') if i.strip().isdigit()}
+app.config['SIGNUP_ROLES'] = ('patient', 'doctor', 'organization')
+app.config['OLLAMA_URLS'] = ['http://localhost:11434']  # several servers share the LLM load, least busy first
+app.config['OLLAMA_POOL_SIZE'] = 10  # keep-alive connections per server
+app.config['OLLAMA_CONNECT_TIMEOUT'] = 3.05
+app.config['OLLAMA_READ_TIMEOUT'] = 300  # seconds without a byte from the model before giving up
+app.config['OLLAMA_RETRIES'] = 2  # extra attempts on connection errors and 429/502/503/504, with jittered backoff
+app.config['OLLAMA_RETRY_BACKOFF'] = 0.5
+app.config['LLM_MAX_CONCURRENCY'] = 4  # LLM calls running at once, match OLLAMA_NUM_PARALLEL of the servers
+# Per traffic class: lower priority runs first, limit caps its running calls, a full queue answers 429 with
+# Retry-After and timeout bounds the wait in seconds. reserved slots are kept free for their class alone, so
+# chat always has a slot reports and jobs cannot take (the scheduler rejects configs that reserve every slot).
+# The report and background limits together stay below LLM_MAX_CONCURRENCY for the same reason.
+app.config['LLM_CLASSES'] = {
+    'chat': {'priority': 0, 'limit': 4, 'max_queue': 32, 'timeout': 60, 'reserved': 1},
+    'report': {'priority': 1, 'limit': 2, 'max_queue': 8, 'timeout': 300},  # /scan/stream, /scan-volume, chat summaries
+    'background': {'priority': 2, 'limit': 1, 'max_queue': None, 'timeout': None}  # scan job workers and first chat messages wait their turn
+}
+app.config['LLM_FANOUT_WORKERS'] = 4  # threads running the independent generations of one request, e.g. the medical records
+app.config['LLM_IMAGE_SIZE'] = 896  # vision encoder resolution of the model, larger images are downscaled before sending
+app.config['LLM_IMAGE_FORMAT'] = 'JPEG'
+app.config['LLM_IMAGE_QUALITY'] = 90
+app.config['LLM_IMAGE_CACHE_DIR'] = 'cache/llm_images'
+app.config['LLM_IMAGE_CACHE_MAX_MB'] = 256
+app.config['LLM_CACHE_ENABLED'] = True  # identical prompts with identical images are answered from cache, bypass_cache=1 skips it
+app.config['LLM_CACHE_PATH'] = 'cache/llm_responses.sqlite'
+app.config['LLM_CACHE_TTL_HOURS'] = 24 * 7
+app.config['LLM_CACHE_MAX_MB'] = 64
+app.config['LLM_CACHE_MAX_ENTRIES'] = 10000
+app.config['HISTORY_SUMMARY_RECENT_SCANS'] = 10  # scans listed one by one in the prompt history, older ones are aggregated
+app.config['CHAT_CONTEXT_TOKENS'] = 3000  # history sent with a chat turn; older turns are replaced by a running summary
+app.config['CHAT_RECENT_TURNS'] = 2  # turns always sent verbatim
+app.config['CHAT_HISTORY_MAX_TURNS'] = 100  # stored turns looked at per chat turn, newest first
+app.config['CHAT_KV_CONTEXT'] = True  # chat turns continue the Ollama context of the scan's diagnosis instead of resending the transcript
+app.config['CHAT_KV_MAX_CONVERSATIONS'] = 256
+app.config['CHAT_KV_MAX_CONTEXT_TOKENS'] = 8192  # match num_ctx of the model, longer conversations fall back to the summarized transcript
+app.config['SCAN_JOB_WORKERS'] = 2  # background threads running queued /scan analyses
+app.config['SCAN_JOB_POLL_SECONDS'] = 2.0
+app.config['SCAN_JOB_MAX_ATTEMPTS'] = 3  # a job interrupted by restarts more often than this is failed
+app.config['SCAN_JOB_HEARTBEAT_SECONDS'] = 10.0
+app.config['SCAN_JOB_STALE_SECONDS'] = 60.0  # a running job without a heartbeat for this long lost its owner
+app.config['VOLUME_SLICE_THICKNESS_MM'] = 3.0  # used when a volume upload does not state its slice thickness
+app.config['VOLUME_MAX_SLICES'] = 1000
+app.config['VOLUME_MAX_EXTRACTED_MB'] = 1024  # uncompressed size of all slices of an archive
+app.config['DERIVATIVE_DIR'] = 'cache/derivatives'  # display images and thumbnails of every scan, made once at ingest
+app.config['DERIVATIVE_FORMAT'] = 'WEBP'  # lossless WEBP or PNG
+app.config['DERIVATIVE_THUMB_SIZE'] = 256
+app.config['IMAGE_MAX_AGE'] = 365 * 24 * 3600  # image URLs carry the file version, so browsers keep them until it changes
+# app.config['USE_X_SENDFILE'] = True  # behind a server that supports X-Sendfile, it sends the image files itself
+app.config['INFERENCE_CACHE_DIR'] = 'cache/inference'
+app.config['INFERENCE_CACHE_MEMORY_ITEMS'] = 128
+app.config['INFERENCE_CACHE_DISK_MAX_MB'] = 512
 
 db = SQLAlchemy(app)
 
@@ -75,6 +164,148 @@ class Scan(db.Model):
     
     user = db.relationship('User', backref=db.backref('scans', lazy=True))
 
+    # Serves the per-user history pages, newest first (see keyset_page).
+    __table_args__ = (db.Index('ix_scan_user_id_created_at', 'user_id', 'created_at'),)
+
+    @property
+    def tumor_volume(self):
+        """Estimated tumor volume in cm3 for volume scans, None for single slice scans"""
+        if not self.slices:
+            return None
+        return estimate_volume([s.tumor_area for s in self.slices], self.slices[0].slice_thickness)['tumor_volume_cm3']
+
+class ScanSlice(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    scan_id = db.Column(db.Integer, db.ForeignKey('scan.id'), nullable=False)
+    slice_index = db.Column(db.Integer, nullable=False)
+    image_path = db.Column(db.String(255), nullable=False)
+    processed_image_path = db.Column(db.String(255))
+    yolo_result = db.Column(db.Text)
+    tumor_area = db.Column(db.Float)
+    slice_thickness = db.Column(db.Float)
+
+    scan = db.relationship('Scan', backref=db.backref('slices', lazy=True, order_by='ScanSlice.slice_index'))
+
+class ScanJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True, default=lambda: uuid.uuid4().hex)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    status = db.Column(db.String(12), nullable=False, default='queued', index=True)  # queued, segmenting, reporting, done, failed
+    payload = db.Column(db.Text, nullable=False)  # scan_info as JSON
+    scan_id = db.Column(db.Integer, db.ForeignKey('scan.id'), nullable=True)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)
+    owner = db.Column(db.String(64))  # SCAN_JOB_WORKER_ID of the process running the job
+    heartbeat_at = db.Column(db.DateTime)  # refreshed by the owner while the job runs
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PatientHistorySummary(db.Model):
+    """Rolling scan history of one patient, kept up to date as scans are inserted (see history_summary.py)."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    state = db.Column(db.Text, nullable=False)
+    summary = db.Column(db.Text, nullable=False)  # whole history as prompt text
+    latest = db.Column(db.Text, nullable=False)  # most recent scan as prompt text
+    scan_count = db.Column(db.Integer, default=0)
+    last_scan_id = db.Column(db.Integer)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship('User', backref=db.backref('history_summary', uselist=False, lazy=True))
+
+def history_summary_values(state, last_scan_id):
+    return {
+        'state': dump_state(state),
+        'summary': render_summary(state),
+        'latest': render_latest(state),
+        'scan_count': state['scan_count'],
+        'last_scan_id': last_scan_id,
+        'updated_at': datetime.utcnow()
+    }
+
+def build_history_state(connection, user_id, exclude_scan_id=None):
+    """Walks a patient's stored scans once, for patients whose scans predate the summaries."""
+    scans = Scan.__table__
+    query = select(scans).where(scans.c.user_id == user_id).order_by(scans.c.created_at, scans.c.id)
+    if exclude_scan_id is not None:
+        query = query.where(scans.c.id != exclude_scan_id)
+    state = new_history_state()
+    for scan in connection.execute(query):
+        add_scan(state, scan.id, scan.scan_date, scan.scan_type, scan.symptoms_notes, scan.yolo_diagnosis,
+                 app.config['HISTORY_SUMMARY_RECENT_SCANS'])
+    return state
+
+@event.listens_for(Scan, 'after_insert')
+def update_patient_history_summary(mapper, connection, scan):
+    """Folds a new scan into its patient's summary, in the transaction that inserts the scan."""
+    table = PatientHistorySummary.__table__
+    row = connection.execute(select(table.c.state).where(table.c.user_id == scan.user_id)).first()
+    state = load_state(row.state) if row else build_history_state(connection, scan.user_id, exclude_scan_id=scan.id)
+    add_scan(state, scan.id, scan.scan_date, scan.scan_type, scan.symptoms_notes, scan.yolo_diagnosis,
+             app.config['HISTORY_SUMMARY_RECENT_SCANS'])
+    values = history_summary_values(state, scan.id)
+    if row:
+        connection.execute(table.update().where(table.c.user_id == scan.user_id).values(**values))
+    else:
+        connection.execute(table.insert().values(user_id=scan.user_id, **values))
+
+def scan_overlay_path(scan):
+    """The segmented image of a scan, the overlay of its (key) slice in the processed directory."""
+    processed_dir_path = scan.processed_image_path
+    if not processed_dir_path or not os.path.isdir(processed_dir_path):
+        return None
+    overlay_path = os.path.join(processed_dir_path, Path(scan.image_path).stem + '.jpg')
+    if os.path.exists(overlay_path):
+        return overlay_path
+    files_in_dir = sorted(os.listdir(processed_dir_path))
+    return os.path.join(processed_dir_path, files_in_dir[0]) if files_in_dir else None
+
+def scan_image_sources(scan):
+    return {'original': scan.image_path, 'processed': scan_overlay_path(scan)}
+
+@event.listens_for(Scan, 'after_insert')
+def queue_scan_derivatives(mapper, connection, scan):
+    """Remembers a new scan on its session; its images are only derived once the insert is committed."""
+    object_session(scan).info.setdefault('derive_scans', []).append((scan.id, scan_image_sources(scan)))
+
+@event.listens_for(db.session, 'after_commit')
+def derive_scan_images(session):
+    """Starts making the display images of the committed scans; an overlay still being written is derived on first read."""
+    for scan_id, sources in session.info.pop('derive_scans', []):
+        scan_derivatives.generate_async(scan_id, sources)
+
+@event.listens_for(db.session, 'after_rollback')
+def forget_scan_derivatives(session):
+    session.info.pop('derive_scans', None)
+
+def file_version(path):
+    """Short token that changes whenever the file is rewritten, for cache busting image URLs."""
+    stamp = source_stamp(path)
+    return f"{stamp[1]:x}-{stamp[2]:x}" if stamp else None
+
+def scan_image_url(scan, kind, variant='full'):
+    """URL of a derived scan image, kind is 'original' or 'processed'; None without a source."""
+    version = file_version(scan_image_sources(scan)[kind])
+    return url_for('scan_image', scan_id=scan.id, kind=kind, variant=variant, v=version) if version else None
+
+def user_photo_url(user):
+    version = file_version(user.profile_photo) if user.profile_photo else None
+    return url_for('user_photo', user_id=user.id, v=version) if version else None
+
+def data_url(data: bytes, mime_type):
+    """Inline image for pictures that have no stored scan to be served from yet."""
+    return f"data:{mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+def patient_history_summary(user_id):
+    """Returns (whole history, latest scan) prompt texts of a patient from the stored summary."""
+    summary = PatientHistorySummary.query.get(user_id)
+    if summary is None:
+        state = build_history_state(db.session.connection(), user_id)
+        if not state['scan_count']:
+            return render_summary(state), render_latest(state)
+        summary = PatientHistorySummary(user_id=user_id, **history_summary_values(state, None))
+        db.session.add(summary)
+        db.session.commit()
+    return summary.summary, summary.latest
+
 class ChatHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -86,149 +317,373 @@ class ChatHistory(db.Model):
     user = db.relationship('User', backref=db.backref('chat_history', lazy=True))
     scan = db.relationship('Scan', backref=db.backref('chat_messages', lazy=True))
 
+    __table_args__ = (db.Index('ix_chat_history_user_id_timestamp', 'user_id', 'timestamp'),
+                      db.Index('ix_chat_history_scan_id_timestamp', 'scan_id', 'timestamp'))
+
+class ChatSummary(db.Model):
+    """Running summary of the older turns of a scan's chat (see chat_context.py)."""
+    scan_id = db.Column(db.Integer, db.ForeignKey('scan.id'), primary_key=True)
+    summary = db.Column(db.Text, nullable=False)
+    last_chat_id = db.Column(db.Integer, nullable=False)  # newest ChatHistory row folded into the summary
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+def chat_turns(scan_id):
+    """The most recent stored turns of a scan's chat, oldest first."""
+    turns = (ChatHistory.query.filter_by(scan_id=scan_id)
+             .order_by(ChatHistory.timestamp.desc(), ChatHistory.id.desc())
+             .limit(app.config['CHAT_HISTORY_MAX_TURNS']).all())
+    return turns[::-1]
+
+def load_chat_summary(scan_id):
+    summary = ChatSummary.query.get(scan_id)
+    return (summary.summary, summary.last_chat_id) if summary else (None, 0)
+
+def store_chat_summary(scan_id, summary_text, last_chat_id):
+    # Runs on the summary thread, outside any request.
+    with app.app_context():
+        summary = ChatSummary.query.get(scan_id) or ChatSummary(scan_id=scan_id)
+        summary.summary, summary.last_chat_id, summary.updated_at = summary_text, last_chat_id, datetime.utcnow()
+        db.session.add(summary)
+        db.session.commit()
+
 # YOLO Model Integration
 class YOLOProcessor:
     detections = []
-    def __init__(self, model_path):
+    def __init__(self, model_path, conf=0.5, iou=0.7, max_batch_size=8, max_wait_ms=10, runs_dir='runs/segment', cache=None, async_persist=True, engine='torch', workers=0, threads_per_worker=None):
+        # Nothing heavy happens here: torch and ultralytics are imported and the model is loaded
+        # by load(), on the first scan or by warm_up(), so importing the app stays fast.
         self.model_path = os.getcwd()+ '/models/' + model_path
-        self.model = YOLO(self.model_path)
-        
-    def process_image(self, user_id, image_path):
+        self.engine = engine
+        self.workers = workers
+        self.threads_per_worker = threads_per_worker
+        self.pool = None
+        self.model = None
+        self.model_id = None
+        self.batcher = None
+        self.ready = False
+        self.warm_up_error = None
+        self.load_lock = threading.Lock()
+        if engine in STATIC_BATCH_ENGINES:
+            max_batch_size = 1
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.conf = conf
+        self.iou = iou
+        self.runs_dir = runs_dir
+        self.cache = cache
+        self.async_persist = async_persist
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='yolo-writer')
+
+    def load(self):
+        """
+        Loads the model (or starts the worker processes) once. Safe to call from any thread.
+        Workers re-import this module when they spawn, so this must never run at import time.
         """
-        Process image with YOLO model and return results
+        if self.model_id is not None:
+            return self
+        with self.load_lock:
+            if self.model_id is not None:
+                return self
+            if self.workers:
+                from worker_pool import InferencePool
+                self.pool = InferencePool(
+                    self.model_path,
+                    engine=self.engine,
+                    workers=self.workers,
+                    threads_per_worker=self.threads_per_worker,
+                    predict_kwargs={'conf': self.conf, 'iou': self.iou, 'retina_masks': True, 'save': False}
+                )
+            else:
+                from ultralytics import YOLO
+                from engines import load_engine, model_imgsz
+                # Exported engines are cached next to the .pt and keep the Results output of the PyTorch path.
+                self.model = load_engine(self.model_path, self.engine)
+                self.imgsz = model_imgsz(self.model if self.engine == 'torch' else YOLO(self.model_path))
+                # All in-process predictions go through one scheduler thread, so concurrent /scan
+                # requests share a forward pass instead of running batch-size-1 back to back.
+                self.batcher = BatchScheduler(self.predict_batch, max_batch_size=self.max_batch_size, max_wait_ms=self.max_wait_ms, name='yolo-batcher')
+            self.model_id = f"{file_fingerprint(self.model_path)}:{self.engine}"
+        return self
+
+    def warm_up(self, runs=2, size=256):
+        """
+        Loads the model and runs dummy inferences so the first real scan does not pay
+        for lazy initialization, then marks the processor ready.
         """
         try:
-            detections = self.model.predict(
-                source=image_path,
-                show=True,
-                save=True,
-                conf=0.5,
-                iou=0.7,
-                name=str(user_id)
-            )
+            started = datetime.now()
+            self.load()
+            dummy = np.zeros((size, size, 3), dtype=np.uint8)
+            for _ in range(max(1, runs)):
+                # One dummy image per worker, so every process gets warmed.
+                futures = [self.pool.submit(dummy) for _ in range(self.workers)] if self.workers else [self.batcher.submit(dummy)]
+                for future in futures:
+                    future.result()
+            self.ready = True
+            print(f"YOLO model warmed up in {(datetime.now() - started).total_seconds():.1f}s.")
+        except Exception as e:
+            self.warm_up_error = str(e)
+            print(f"YOLO warm-up error: {str(e)}")
+
+    def start_warm_up(self, runs=2):
+        thread = threading.Thread(target=self.warm_up, kwargs={'runs': runs}, name='yolo-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def close(self):
+        """
+        Stops the batcher or the worker processes once the version no longer takes traffic
+        """
+        if self.batcher is not None:
+            self.batcher.stop()
+        if self.pool is not None:
+            self.pool.shutdown()
+        self.writer.shutdown(wait=True)
+
+    def health(self):
+        """
+        Returns the state of the inference workers, or of the in-process model
+        """
+        if not self.workers or self.pool is None:
+            return [{'worker_id': 'in-process' if not self.workers else 'pool', 'pid': os.getpid(), 'alive': True, 'ready': self.model is not None}]
+        return self.pool.health()
+
+    def predict_batch(self, images):
+        """
+        Runs one batched prediction on decoded BGR arrays and returns one Results object per image, in order
+        """
+        return self.model.predict(
+            source=list(images),
+            conf=self.conf,
+            iou=self.iou,
+            imgsz=self.imgsz,
+            batch=len(images),
+            retina_masks=True,  # masks at image resolution, so they can be measured in pixels of the scan
+            save=False,
+            verbose=False
+        )
+
+    def persist_overlay(self, user_id, overlay, image_path, save_dir=None):
+        """
+        Writes the overlay JPEG on the writer thread, into save_dir or a newly reserved
+        runs/segment/<user_id> directory. Returns the directory, the overlay path and the Future of the write.
+        """
+        if save_dir is None:
+            save_dir = self.new_save_dir(user_id)
+        overlay_path = Path(save_dir) / (Path(image_path).stem + '.jpg')
+
+        def write():
+            with open(overlay_path, 'wb') as f:
+                f.write(overlay)
+            return str(overlay_path)
+
+        return str(save_dir), str(overlay_path), self.writer.submit(write)
 
-            if not detections:
-                return None
+    def new_save_dir(self, user_id):
+        from ultralytics.utils.files import increment_path
+        return increment_path(Path(self.runs_dir) / str(user_id), mkdir=True)
 
-            self.detections = detections
-            detections_data_list = [json.loads(d.to_json()) for d in detections]
-            yolo_results_for_db = json.dumps(detections_data_list)
+    def cache_key_for(self, image: IngestedImage):
+        return make_cache_key(image.data, self.load().model_id, self.conf, self.iou)
+
+    def submit_inference(self, image: IngestedImage):
+        """
+        Queues one decoded image. Worker processes receive the array through shared memory,
+        the in-process path goes through the batcher. Pass the Future to collect_inference.
+        """
+        self.load()
+        if self.workers:
+            return self.pool.submit(image.bgr, image.pixel_spacing)
+        return self.batcher.submit(image.bgr)
+
+    def collect_inference(self, future, image: IngestedImage):
+        """
+        Waits for a queued image and returns its cacheable entry
+        """
+        value = future.result()
+        return value if self.workers else self.build_entry(value, image)
+
+    def run_inference(self, image: IngestedImage):
+        """
+        Runs the model on one image and returns a cacheable entry (detections, masks, overlay).
+        Nothing is shown or written, the overlay is rendered from the Results tensors in memory.
+        """
+        return self.collect_inference(self.submit_inference(image), image)
+
+    def build_entry(self, result, image: IngestedImage):
+        """
+        Turns one Results object into a cacheable entry (detections, masks, overlay, mask metrics)
+        """
+        from segmentation import result_to_entry
+        self.detections = [result]
+        return result_to_entry(result, image.pixel_spacing)
+
+    def process_image(self, user_id, image_path, image: IngestedImage = None):
+        """
+        Process image with YOLO model and return results.
+        Pass the already decoded upload as image to avoid reading the file again.
+        """
+        try:
+            if image is None:
+                image = IngestedImage.from_path(image_path)
+            cache_key = None
+            entry = None
+            if self.cache is not None:
+                cache_key = self.cache_key_for(image)
+                entry = self.cache.get(cache_key)
+
+            if entry is None:
+                entry = self.run_inference(image)
+                cached = False
+            else:
+                print('YOLO result served from cache.')
+                cached = True
+
+            # Repeats from the same user reuse the existing overlay directory instead of creating a new one.
+            processed_image_dir = entry.get('processed_image_dir')
+            if not (cached and entry.get('user_id') == user_id and processed_image_dir and os.path.isdir(processed_image_dir)):
+                processed_image_dir, _, written = self.persist_overlay(user_id, entry['overlay'], image_path)
+                if not self.async_persist:
+                    written.result()
+                if cache_key is not None:
+                    self.writer.submit(self.cache.put, cache_key, dict(entry, user_id=user_id, processed_image_dir=processed_image_dir))
 
-            processed_image_dir = detections[0].save_dir
-            # tumor_area = self.calculate_mask_area(detections)
-            tumor_area = 1.5
             return {
-                "yolo_results_json": yolo_results_for_db,
+                "yolo_results_json": entry['yolo_results_json'],
                 "processed_image_dir": processed_image_dir,
-                "tumor_pixel_area": tumor_area
+                "overlay": entry['overlay'],
+                "mask_metrics": entry['mask_metrics'],
+                "tumor_area_cm2": entry['tumor_area_cm2']
             }
 
         except Exception as e:
             print(f"YOLO processing error: {str(e)}")
             return None
-    
-    def calculate_mask_area(self, detections) -> float:
+
+    def process_volume(self, user_id, slice_paths):
         """
-        Returns area of tumor in pixel from JSON of YOLO results
+        Segments every slice of a volume and writes all overlays to one runs/segment/<user_id> directory.
+        Slices are decoded one at a time and queued as they are decoded, so decoding overlaps the
+        batches already running and only a window of decoded slices is held at once. The slices
+        returned carry no decoded image; decode the one needed again from its image_path.
         """
-        total_area = 0.0
         try:
-            # if not self.detections or self.detections[0].masks:
-            #     if not yolo_results_str:
-            #         return 0.0 
-            #     detections_list = json.loads(yolo_results_str)
-                
-            #     for detection_json in detections_list:
-            #         detection_data = json.loads(detection_json)
-
-            #         mask = detection_data.get('mask')
-            #         if not mask or not mask.get('segments'):
-            #             continue
-
-            #         for segment in mask['segments']:
-            #             x = segment[0::2]
-            #             y = segment[1::2]
-                        
-            #             if len(x) < 3: continue
-
-            #             area = 0.5 * abs(sum(x[i] * y[i-1] - x[i-1] * y[i] for i in range(len(x))))
-            #             total_area += area
-            # else:
-            if not detections or detections[0].masks:
-                return 0.0
-            else:
-                total_pixel_count = 0
-                all_masks_tensor = detections[0].masks.data
-                total_pixel_count = torch.sum(all_masks_tensor).item()
-
-                real_width_cm = 30.0
-                real_height_cm = 30.0
-
-                image_width_px = 256
-                image_height_px = 256
-
-                total_real_area_cm2 = real_width_cm * real_height_cm  # 900 cm^2
-                total_pixels = image_width_px * image_height_px  # 65536 pixels
-                area_per_pixel = total_real_area_cm2 / total_pixels
-                total_area = total_pixel_count * area_per_pixel
-                                
-        except (json.JSONDecodeError, TypeError, KeyError) as e:
-            app.logger.error(f"Could not parse YOLO results or calculate area: {e}")
-            return 0.0
-            
-        return total_area
+            entries = [None] * len(slice_paths)
+            pending = deque()  # (slice index, image, cache key, future), oldest first
+            window = 2 * max(self.max_batch_size, self.workers or 1)
+
+            def collect(i, image, cache_key, future):
+                entries[i] = self.collect_inference(future, image)
+                if cache_key is not None:
+                    self.writer.submit(self.cache.put, cache_key, entries[i])
+
+            for i, path in enumerate(slice_paths):
+                image = IngestedImage.from_path(path)
+                cache_key = self.cache_key_for(image) if self.cache is not None else None
+                entries[i] = self.cache.get(cache_key) if cache_key else None
+                if entries[i] is None:
+                    pending.append((i, image, cache_key, self.submit_inference(image)))
+                    if len(pending) > window:
+                        collect(*pending.popleft())
+            while pending:
+                collect(*pending.popleft())
+
+            save_dir = self.new_save_dir(user_id)
+            slices = []
+            writes = []
+            for i, (path, entry) in enumerate(zip(slice_paths, entries)):
+                _, overlay_path, written = self.persist_overlay(user_id, entry['overlay'], path, save_dir)
+                writes.append(written)
+                slices.append({
+                    "slice_index": i,
+                    "image_path": path,
+                    "processed_image_path": overlay_path,
+                    "yolo_results_json": entry['yolo_results_json'],
+                    "overlay": entry['overlay'],
+                    "mask_metrics": entry['mask_metrics'],
+                    "tumor_area_cm2": entry['tumor_area_cm2']
+                })
+            if not self.async_persist:
+                for written in writes:
+                    written.result()
+
+            return {
+                "processed_image_dir": str(save_dir),
+                "slices": slices
+            }
+
+        except Exception as e:
+            print(f"YOLO volume processing error: {str(e)}")
+            return None
 
 # Ollama LLM Integration
 class OllamaProcessor:
-    def __init__(self, model_name="amsaravi/medgemma-4b-it:q6"):
+    def __init__(self, model_name="amsaravi/medgemma-4b-it:q6", base_urls=("http://localhost:11434",), response_cache=None, scheduler=None, image_cache=None, chat_context=None, conversation_contexts=None, fanout_workers=4, **client_options):
         self.model_name = model_name
-        self.ollama_chat_url = "http://localhost:11434/api/chat"
-        self.ollama_gen_url = "http://localhost:11434/api/generate"
-
-    def parse_yolo_results_to_text(self, yolo_results_list_of_json_strings: str, tumor_area=0.0):
+        # Independent generations of one request run side by side here (see generate_many); the scheduler still limits them.
+        self.fanout_executor = ThreadPoolExecutor(max_workers=fanout_workers, thread_name_prefix='llm-fanout')
+        # The Ollama context of each scan conversation, so a turn does not prefill the transcript again (see llm_context.py).
+        self.conversation_contexts = conversation_contexts
+        # Long chats are sent as a summary plus the recent turns (see chat_context.py).
+        self.chat_context = chat_context
+        # Images are resized to the vision resolution and compactly encoded once per source (see llm_images.py).
+        self.image_cache = image_cache
+        # Every call to the model waits for a slot of its traffic class (see llm_scheduler.py).
+        self.scheduler = scheduler
+        # Identical prompts with identical images are answered from here (see llm_cache.py).
+        self.response_cache = response_cache
+        # One pooled keep-alive client for every call, spread over the configured Ollama servers.
+        self.client = OllamaClient(list(base_urls), **client_options)
+        self.ollama_chat_path = "/api/chat"
+        self.ollama_gen_path = "/api/generate"
+
+    def parse_yolo_results_to_text(self, yolo_results_json: str, mask_metrics=None):
         """
-        Parses a list of YOLO JSON strings and summarizes findings into a human-readable text.
+        Parses the YOLO results JSON and the mask metrics and summarizes findings into a human-readable text.
         """
         summary_lines = ["The YOLOv11 segmentation custom brain tumor model detected the following objects in the scan:"]
         found_any_detection = False
+        instances = (mask_metrics or {}).get('instances', [])
+        image_height, image_width = (mask_metrics or {}).get('image_shape') or [0, 0]
 
         try:
-            # 1. Iterate through the list of JSON strings passed from process_image
-            for json_str in yolo_results_list_of_json_strings:
-                
-                # 2. Each JSON string represents a list of detections for a single image.
-                # json.loads will convert it into a Python list of dictionaries.
-                list_of_detection_dicts = json.loads(json_str)
-
-                # 3. (The Fix) Now, iterate through this inner list to access each detection dictionary.
-                for detection_dict in list_of_detection_dicts:
+            # The JSON holds one list of detection dictionaries per image.
+            for list_of_detection_dicts in json.loads(yolo_results_json):
+                for index, detection_dict in enumerate(list_of_detection_dicts):
                     found_any_detection = True # Mark that we found at least one valid detection.
-                    
-                    # Now, detection_dict is a dictionary, and we can safely use .get()
+
                     box = detection_dict.get('box', {})
                     class_name = detection_dict.get('name', 'unknown')
                     confidence = detection_dict.get('confidence', 0.0)
-                    
-                    # The rest of your logic is correct and remains unchanged
-                    x_center = (box.get('x1', 0) + box.get('x2', 0)) / 2
-                    y_center = (box.get('y1', 0) + box.get('y2', 0)) / 2
-                    width = box.get('x2', 0) - box.get('x1', 0)
-                    height = box.get('y2', 0) - box.get('y1', 0)
-                    area = width * height
+                    # Masks are in the same order as the detections.
+                    instance = instances[index] if index < len(instances) else None
+
+                    if instance:
+                        x_center, y_center = instance['centroid_px']
+                        area = instance['area_px']
+                    else:
+                        x_center = (box.get('x1', 0) + box.get('x2', 0)) / 2
+                        y_center = (box.get('y1', 0) + box.get('y2', 0)) / 2
+                        area = (box.get('x2', 0) - box.get('x1', 0)) * (box.get('y2', 0) - box.get('y1', 0))
+                    width_px = image_width or detection_dict.get('width') or 1000
+                    height_px = image_height or detection_dict.get('height') or 1000
 
                     location = "the center"
-                    if x_center < 250: location = "the left side"
-                    elif x_center > 750: location = "the right side"
-                    if y_center < 250: location += " of the top"
-                    elif y_center > 750: location += " of the bottom"
+                    if x_center < width_px / 4: location = "the left side"
+                    elif x_center > width_px * 3 / 4: location = "the right side"
+                    if y_center < height_px / 4: location += " of the top"
+                    elif y_center > height_px * 3 / 4: location += " of the bottom"
 
                     size = "small"
-                    if area > 10000: size = "medium-sized"
-                    if area > 50000: size = "large"
-                    
-                    summary_lines.append(
-                        f"- A {size} {class_name} with {confidence*100:.2f}% confidence located on {location} and tumor size is {tumor_area}."
-                    )
+                    if area > 0.01 * width_px * height_px: size = "medium-sized"
+                    if area > 0.05 * width_px * height_px: size = "large"
+
+                    line = f"- A {size} {class_name} with {confidence*100:.2f}% confidence located on {location}"
+                    if instance:
+                        extent_w, extent_h = instance['extent_mm']
+                        line += (f", segmented area {instance['area_cm2']:.2f} cm2, extent {extent_w:.1f} x {extent_h:.1f} mm"
+                                 f" and perimeter {instance['perimeter_mm']:.1f} mm")
+                    summary_lines.append(line + ".")
 
         except (json.JSONDecodeError, TypeError):
             # This block handles both JSON errors and cases where the input is None
@@ -240,6 +695,9 @@ class OllamaProcessor:
             print("The YOLO model did not detect any objects in the scan.")
             return "The YOLO model did not detect any objects in the scan."
 
+        if mask_metrics:
+            summary_lines.append(f"Total segmented tumor area: {mask_metrics['total_area_cm2']:.2f} cm2.")
+
         print("Parsing YOLO results to text was successful.")
         return "\n".join(summary_lines)
 
@@ -259,148 +717,11 @@ class OllamaProcessor:
         print('Generate history summery was successful.')
         return "\n".join(summary_lines)
     
-    def analyze_scan_results(self, scan_info: dict):
+    def build_detect_prompt(self, user, scan_info: dict, yolo_text_summary, text_summary, history_text_summary):
         """
-        Generates a comprehensive prompt and gets a diagnosis from an LLM.
-
-        Args:
-            yolo_results_json (str): The YOLO results as a JSON string.
-            scan_info (dict): A dictionary with current scan details.
-            history (list[Scan]): A list of previous Scan objects for the patient.
-
-        Returns:
-            str: The AI-generated diagnosis text.
+        Builds the neuroradiology report prompt sent with the source and segmented images.
         """
-        try:
-            # Step 1: Parse and summarize the data into text.
-            user = User.query.filter_by(id=scan_info.get('user_id')).first()
-            yolo_results = yolo_processor.process_image(scan_info.get('user_id'), scan_info.get('image_path'))
-            scan_history = Scan.query.filter_by(user_id=scan_info.get('user_id'))
-            yolo_text_summary = self.parse_yolo_results_to_text(yolo_results['yolo_results_json'], yolo_results['tumor_pixel_area'])
-            history_text_summary = self.generate_history_summary(scan_history)
-            text_summary = self.generate_history_summary(Scan.query.filter_by(user_id=session['user_id']).order_by(Scan.created_at.desc()).limit(1))
-            if yolo_results['processed_image_dir'] and os.path.isdir(yolo_results['processed_image_dir']):
-                files_in_dir = os.listdir(yolo_results['processed_image_dir'])
-                if files_in_dir:
-                    first_file_name = files_in_dir[0]
-                    processed_image_full_path = os.path.join(yolo_results['processed_image_dir'], first_file_name)
-
-        except Exception as e:
-            print('Error analyze result, parse and summarize: ', str(e))
-            return
-            # Step 2: Construct the LLM prompt.
-            
-            # The prompt is a multi-line f-string. It instructs the LLM to act as a doctor,
-            # provides all necessary context, and includes a disclaimer.
-        try:
-            chat_prompt = str(f"""
-                AIDE-MEMOIRE FOR THE AI DOCTOR
-                YOUR ROLE: You are a highly specialized and deeply compassionate neurologist. Your primary goal is not just to report findings, but to act as a caring guide for your patient. Your tone must be exceptionally gentle, patient, and reassuring. Imagine you are sitting with a worried patient and their family, and your main objective is to provide clarity and support. Avoid complex medical jargon at all costs. Use simple analogies if they help explain a concept. You are deeply concerned about your patient's well-being and you want to walk through this journey together with them.
-                IMPORTANT DISCLAIMER: ALWAYS START YOUR MESSAGE WITH THIS EXACT DISCLAIMER. THIS IS A SIMULATION FOR ACADEMIC AND TESTING PURPOSES ONLY. THIS IS NOT REAL MEDICAL ADVICE. PLEASE CONSULT A QUALIFIED HUMAN DOCTOR FOR ANY HEALTH CONCERNS.
-                              
-                PATIENT INFORMATION PROVIDED:              
-                First Name: {user.first_name}
-                Last Name: {user.last_name}
-                Date of Birth: {user.date_of_birth.strftime('%Y-%m-%d')}
-                Age: {int(datetime.now().strftime('%y')) - int(user.date_of_birth.strftime('%y'))}
-                Gender: {user.gender}
-                Blood Type: {user.blood_type}
-                Height & Weight: {user.height} cm, {user.weight} kg
-                Allergies: {user.allergies}
-                Current Medications: {user.current_medications}
-                Pre-existing Medical Conditions: {user.medical_conditions}
-                Current Scan Date: {scan_info.get('scan_date')}
-                Scan Type: {scan_info.get('scan_type')}
-                Patient's Reported Symptoms/Notes: {scan_info.get('symptoms_notes')}
-
-                PROVIDED IMAGES FOR YOUR ANALYSIS:
-                I am providing you with two images:
-                Image 1 (Original Scan): This is the raw, original MRI scan of the patient's brain.
-                Image 2 (AI-Assisted Scan): This is the same scan, but our specialized AI (YOLOv11 model) has analyzed it. Any areas of potential interest or concern have been highlighted in blue and labeled with a preliminary classification.
-                SUMMARY OF FINDINGS (For your reference):
-                YOLOv11 Text Summary: {yolo_text_summary}
-                Patient's Medical History: {history_text_summary}
-                Today date: {datetime.now().strftime('%y-%m-%d')}
-
-                YOUR DETAILED TASK: WRITE A COMPREHENSIVE AND CARING MESSAGE TO THE PATIENT
-                Based on all the information above (Patient Info, Both Images, and Text Summaries), please write a detailed message to the patient. Structure your response into the following three distinct parts:
-                Part 1: A Warm and Empathetic Opening
-                Start by addressing the patient directly by their first name, {user.first_name}.
-                Immediately acknowledge that waiting for and receiving scan results can be a very anxious and stressful experience. Reassure them that you are there for them and will go through the results together, step by step.
-                Express your commitment to their health and well-being. Set a calm, supportive, and unhurried tone for the rest of the message.
-                Part 2: A Careful and Detailed Explanation of the Findings (Referencing the Images)
-                Transition smoothly by saying something like, "Now, let's gently look at the results from your recent scan together. I have two images in front of me that will help us understand what's going on."
-                Analyze Image 1 (Original Scan): Briefly describe what you see in the general, raw scan. For example, "Looking at your original scan, we can see the overall structure of your brain..."
-                Analyze Image 2 (AI-Assisted Scan): This is the most critical part. Guide the patient through it carefully. Say something like, "To get a closer look, our AI assistant has highlighted a specific area for us on the second image. You'll notice a small region marked in blue."
-                Connect to the YOLO Summary: Explain what the blue-highlighted area represents, using the {yolo_text_summary} as your guide. Translate the technical findings into simple, understandable language. For example, instead of "a 2.3cm meningioma," say "The highlighted area, which our initial analysis suggests might be a type of growth called a meningioma, is about 2.3 centimeters in size."
-                Ask Follow-up Questions: This is crucial for showing you care and for gathering more information. Based on the findings and the location of the highlighted area, ask specific, open-ended questions. For example: "Now that we see this, I'm curious to know more about how you've been feeling. Have you experienced any specific types of headaches, perhaps in the morning? Any changes in your vision or balance? Please tell me everything, no matter how small it seems."
-                Part 3: A Collaborative Plan for Wellness and Next Steps
-                Reassure the patient again. Emphasize that these are preliminary findings and that the next steps are about creating a complete and clear picture.
-                Provide General Wellness Advice: Offer some gentle, supportive lifestyle advice that is generally beneficial for brain health, such as staying hydrated, eating a balanced diet rich in antioxidants (like berries and leafy greens), and gentle movement or walking if they feel up to it. Frame this as "things we can do to support your overall health while we investigate further."
-                Outline Concrete Next Steps: Be very clear and specific about what happens next. Do not be vague. For example:
-                "My primary recommendation is for us to schedule a follow-up consultation within the next 2-3 days to discuss these findings in more detail and answer all of your questions."
-                "I also believe it would be wise to order a specific blood test to check for certain markers, which can give us more information."
-                "Depending on our conversation, we might also consider a different type of scan in the future to look at this area from another angle."
-                End with an Open Invitation: Conclude the message by reinforcing your support. Say something like, "Please know that my team and I are here for you. Do not hesitate to reach out with any questions that come to mind before our next appointment. We are in this together."
-                """)
-
-            # detect_prompt = (f"""
-            #     AI TASK DIRECTIVE: CONSULTATION REPORT FOR NEUROLOGIST
-            #     YOUR ROLE: You are a specialized Neuroradiology AI Assistant. Your function is to provide a detailed, objective, and technical analysis of medical imaging for a consulting neurologist. Your report must be comprehensive, evidence-based, and structured for professional review. All emotional language, patient reassurances, and simplifications must be omitted. The report should be written in standard medical terminology.
-            #     DISCLAIMER FOR THE REPORT: All reports must begin with: "FOR PROFESSIONAL MEDICAL USE AND ACADEMIC SIMULATION ONLY. Findings are generated by an AI assistant and require verification by a qualified human radiologist."
-
-            #     CASE FILE DATA:
-            #     1. PATIENT DEMOGRAPHICS & CLINICAL NOTES:
-            #     Patient ID: {user.id} (or other identifier)
-            #     Date of Birth: {user.date_of_birth.strftime('%Y-%m-%d')}
-            #     Age: {datetime.now().strftime('%y') - user.date_of_birth.strftime('%y')}
-            #     Gender: {user.gender}
-            #     Relevant Medical History: {user.medical_conditions}
-            #     Current Scan Date: {scan_info.get('scan_date')}
-            #     Imaging Modality/Sequence: {scan_info.get('scan_type')}
-            #     Referring Physician's Notes / Patient-Reported Symptoms: {scan_info.get('symptoms_notes')}
-
-            #     2. PROVIDED IMAGES FOR ANALYSIS:
-            #     Image 1 (Source Scan): Raw, unprocessed MRI scan.
-            #     Image 2 (AI-Segmented Scan): The same scan post-analysis by a YOLOv11 segmentation model. Areas of interest are highlighted, segmented, and classified.
-
-            #     3. PRE-PROCESSED DATA SUMMARY:
-            #     AI (YOLOv11) Segmentation Analysis: {yolo_text_summary}
-            #     Patient's Prior Imaging History Summary: {text_summary}
-            #     Today date: {datetime.now().strftime('%y-%m-%d')}
-            #     YOUR DETAILED TASK: GENERATE A COMPREHENSIVE NEURORADIOLOGY REPORT
-            #     Based on a thorough analysis of all provided data (Clinical Notes, Both Images, and Summaries), generate a formal consultation report. The report must be structured into the following five sections:
-
-            #     SECTION 1: CLINICAL INDICATION
-            #     Concisely summarize the reason for the examination, integrating the patient's age, gender, and key symptoms or clinical questions provided in the notes. (e.g., "34-year-old male presents with a two-month history of persistent morning headaches and recent-onset visual disturbances. MRI of the brain is performed to evaluate for intracranial pathology.")
-            #     SECTION 2: IMAGING ANALYSIS
-            #     This section must be detailed and descriptive.
-            #     Source Image Findings: Describe the findings from the raw, unprocessed scan (Image 1). Comment on overall brain volume, ventricular size, sulcal patterns, and any gross abnormalities visible without assistance.
-            #     AI-Assisted Segmentation Findings (Image 2): Provide a detailed analysis of the AI-highlighted regions.
-            #     Location: Be precise (e.g., "superior aspect of the right frontal lobe, adjacent to the falx cerebri").
-            #     Size: Provide measurements in three dimensions (e.g., "approximately 2.3 x 1.8 x 2.1 cm").
-            #     Characteristics: Describe the lesion's features (e.g., "well-defined, extra-axial, dural-based mass," "homogeneously enhancing," "presence or absence of surrounding vasogenic edema," "mass effect on the adjacent cortical sulci").
-            #     AI Classification: State the classification provided by the YOLO model and its confidence score.
-
-            #     SECTION 3: DIFFERENTIAL DIAGNOSIS
-            #     Based on the imaging characteristics, list the most likely differential diagnoses in order of probability.
-            #     For each diagnosis, provide a brief rationale. (e.g., "1. Meningioma: Most likely, given the extra-axial location, dural tail sign, and homogeneous enhancement pattern. 2. Hemangiopericytoma: A less likely alternative, which can have a similar appearance...")
-
-            #     SECTION 4: IMPRESSION
-            #     Synthesize all findings into a concise, definitive summary.
-            #     State the most probable diagnosis clearly.
-            #     Mention any secondary findings of importance (e.g., "mild mass effect without significant midline shift").
-            #     Correlate the findings with the patient's reported clinical symptoms if possible. (e.g., "The location of this frontal lobe mass is consistent with the patient's reported headaches.")
-
-            #     SECTION 5: RECOMMENDATIONS
-            #     Provide clear, actionable recommendations for the referring physician.
-            #     Suggest specific next steps for further characterization or management.
-            #     Further Imaging: "Consider MRI with and without contrast with specific sequences (e.g., perfusion-weighted imaging) to further assess vascularity."
-            #     Consultation: "Neurosurgical consultation is recommended for evaluation and discussion of management options (e.g., observation, surgical resection)."
-            #     Follow-up: "If a conservative approach is chosen, follow-up imaging in 3-6 months is advised to assess for stability or growth."
-            # """)
-
-            detect_prompt = str(f"""
+        return str(f"""
                 AI DIRECTIVE: NEURORADIOLOGY ANALYSIS & REPORT GENERATION
                 YOUR ROLE: You are a clinical AI system specializing in neuroradiology image analysis. Your task is to generate a formal, objective, and integrated consultation report intended for a specialist physician.
                 PRIMARY TASK: Your core function is to perform a direct and detailed visual analysis of the two provided images (Image 1: Source Scan, Image 2: AI-Segmented Scan). Synthesize your visual findings with the provided clinical context to produce a comprehensive diagnostic impression. The YOLO summary is supplementary; your own image interpretation is paramount.
@@ -427,54 +748,293 @@ class OllamaProcessor:
                 Conclude with a final paragraph presenting your diagnostic impression, differential diagnoses, and clear, actionable recommendations for the referring physician.
             """)
 
-            # Step 3: Call the AI generator with the constructed prompt.
-            # In a real scenario, this would be an API call to a model like MedGemma
-            # llm_response = self.chat_response(detect_prompt, 'system');
-            llm_response = self.generate_response(detect_prompt, [scan_info.get('image_path'), processed_image_full_path]);
+    def prepare_scan_analysis(self, scan_info: dict):
+        """
+        Segments the scan and builds the diagnosis prompt.
+        Returns a dict with the user, the decoded image, the YOLO results, their text summary,
+        the prompt and the images for the LLM, or None on error.
+        """
+        try:
+            # Step 1: Parse and summarize the data into text.
+            user = User.query.filter_by(id=scan_info.get('user_id')).first()
+            # The upload was decoded once in /scan; the model, the LLM and the response all use that array.
+            image = scan_info.get('image') or IngestedImage.from_path(scan_info.get('image_path'))
+            yolo_results = model_registry.process_image(scan_info.get('user_id'), scan_info.get('image_path'), image)
+            yolo_text_summary = self.parse_yolo_results_to_text(yolo_results['yolo_results_json'], yolo_results['mask_metrics'])
+            # One precomputed row instead of walking every previous scan of the patient.
+            history_text_summary, text_summary = patient_history_summary(scan_info.get('user_id'))
+            # The overlay is handed over in memory, it may still be on its way to disk.
+            processed_image = yolo_results['overlay']
+            return {
+                'user': user,
+                'image': image,
+                'yolo_results': yolo_results,
+                'yolo_text_summary': yolo_text_summary,
+                'history_text_summary': history_text_summary,
+                'detect_prompt': self.build_detect_prompt(user, scan_info, yolo_text_summary, text_summary, history_text_summary),
+                'images': [image.encode('PNG'), processed_image],
+                'processed_image': processed_image
+            }
+
+        except Exception as e:
+            print('Error analyze result, parse and summarize: ', str(e))
+            return None
+
+    def save_scan(self, scan_info: dict, prepared: dict, llm_response: str, context=None):
+        """
+        Stores a single image scan with its YOLO results and the LLM diagnosis.
+        The Ollama context of the diagnosis, if given, starts the scan's conversation.
+        """
+        yolo_results = prepared['yolo_results']
+        scan = Scan(
+                    user_id=scan_info.get('user_id'),
+                    scan_date=scan_info.get('scan_date'),
+                    scan_type=scan_info.get('scan_type'),
+                    facility=scan_info.get('facility'),
+                    symptoms_notes=scan_info.get('symptoms_notes'),
+                    image_path=scan_info.get('image_path'),
+                    yolo_result=yolo_results['yolo_results_json'],
+                    yolo_diagnosis=str(prepared['yolo_text_summary']),
+                    ai_diagnosis=llm_response,
+                    processed_image_path=yolo_results['processed_image_dir'],
+                    tumor_size=yolo_results['tumor_area_cm2']
+                )
+        db.session.add(scan)
+        db.session.commit()
+        self.remember_context(scan.id, None, context)
+        return scan
+
+    def first_chat_prompt(self, scan_info: dict, prepared: dict):
+        """
+        The prompt of the first chat message of a new scan, a caring explanation of the findings
+        written to the patient. prepared is the result of prepare_scan_analysis.
+        """
+        user = prepared['user']
+        yolo_text_summary = prepared['yolo_text_summary']
+        history_text_summary = prepared['history_text_summary']
+        return str(f"""
+            AIDE-MEMOIRE FOR THE AI DOCTOR
+            YOUR ROLE: You are a highly specialized and deeply compassionate neurologist. Your primary goal is not just to report findings, but to act as a caring guide for your patient. Your tone must be exceptionally gentle, patient, and reassuring. Imagine you are sitting with a worried patient and their family, and your main objective is to provide clarity and support. Avoid complex medical jargon at all costs. Use simple analogies if they help explain a concept. You are deeply concerned about your patient's well-being and you want to walk through this journey together with them.
+            IMPORTANT DISCLAIMER: ALWAYS START YOUR MESSAGE WITH THIS EXACT DISCLAIMER. THIS IS A SIMULATION FOR ACADEMIC AND TESTING PURPOSES ONLY. THIS IS NOT REAL MEDICAL ADVICE. PLEASE CONSULT A QUALIFIED HUMAN DOCTOR FOR ANY HEALTH CONCERNS.
+                          
+            PATIENT INFORMATION PROVIDED:              
+            First Name: {user.first_name}
+            Last Name: {user.last_name}
+            Date of Birth: {user.date_of_birth.strftime('%Y-%m-%d')}
+            Age: {int(datetime.now().strftime('%y')) - int(user.date_of_birth.strftime('%y'))}
+            Gender: {user.gender}
+            Blood Type: {user.blood_type}
+            Height & Weight: {user.height} cm, {user.weight} kg
+            Allergies: {user.allergies}
+            Current Medications: {user.current_medications}
+            Pre-existing Medical Conditions: {user.medical_conditions}
+            Current Scan Date: {scan_info.get('scan_date')}
+            Scan Type: {scan_info.get('scan_type')}
+            Patient's Reported Symptoms/Notes: {scan_info.get('symptoms_notes')}
+
+            PROVIDED IMAGES FOR YOUR ANALYSIS:
+            I am providing you with two images:
+            Image 1 (Original Scan): This is the raw, original MRI scan of the patient's brain.
+            Image 2 (AI-Assisted Scan): This is the same scan, but our specialized AI (YOLOv11 model) has analyzed it. Any areas of potential interest or concern have been highlighted in blue and labeled with a preliminary classification.
+            SUMMARY OF FINDINGS (For your reference):
+            YOLOv11 Text Summary: {yolo_text_summary}
+            Patient's Medical History: {history_text_summary}
+            Today date: {datetime.now().strftime('%y-%m-%d')}
+
+            YOUR DETAILED TASK: WRITE A COMPREHENSIVE AND CARING MESSAGE TO THE PATIENT
+            Based on all the information above (Patient Info, Both Images, and Text Summaries), please write a detailed message to the patient. Structure your response into the following three distinct parts:
+            Part 1: A Warm and Empathetic Opening
+            Start by addressing the patient directly by their first name, {user.first_name}.
+            Immediately acknowledge that waiting for and receiving scan results can be a very anxious and stressful experience. Reassure them that you are there for them and will go through the results together, step by step.
+            Express your commitment to their health and well-being. Set a calm, supportive, and unhurried tone for the rest of the message.
+            Part 2: A Careful and Detailed Explanation of the Findings (Referencing the Images)
+            Transition smoothly by saying something like, "Now, let's gently look at the results from your recent scan together. I have two images in front of me that will help us understand what's going on."
+            Analyze Image 1 (Original Scan): Briefly describe what you see in the general, raw scan. For example, "Looking at your original scan, we can see the overall structure of your brain..."
+            Analyze Image 2 (AI-Assisted Scan): This is the most critical part. Guide the patient through it carefully. Say something like, "To get a closer look, our AI assistant has highlighted a specific area for us on the second image. You'll notice a small region marked in blue."
+            Connect to the YOLO Summary: Explain what the blue-highlighted area represents, using the {yolo_text_summary} as your guide. Translate the technical findings into simple, understandable language. For example, instead of "a 2.3cm meningioma," say "The highlighted area, which our initial analysis suggests might be a type of growth called a meningioma, is about 2.3 centimeters in size."
+            Ask Follow-up Questions: This is crucial for showing you care and for gathering more information. Based on the findings and the location of the highlighted area, ask specific, open-ended questions. For example: "Now that we see this, I'm curious to know more about how you've been feeling. Have you experienced any specific types of headaches, perhaps in the morning? Any changes in your vision or balance? Please tell me everything, no matter how small it seems."
+            Part 3: A Collaborative Plan for Wellness and Next Steps
+            Reassure the patient again. Emphasize that these are preliminary findings and that the next steps are about creating a complete and clear picture.
+            Provide General Wellness Advice: Offer some gentle, supportive lifestyle advice that is generally beneficial for brain health, such as staying hydrated, eating a balanced diet rich in antioxidants (like berries and leafy greens), and gentle movement or walking if they feel up to it. Frame this as "things we can do to support your overall health while we investigate further."
+            Outline Concrete Next Steps: Be very clear and specific about what happens next. Do not be vague. For example:
+            "My primary recommendation is for us to schedule a follow-up consultation within the next 2-3 days to discuss these findings in more detail and answer all of your questions."
+            "I also believe it would be wise to order a specific blood test to check for certain markers, which can give us more information."
+            "Depending on our conversation, we might also consider a different type of scan in the future to look at this area from another angle."
+            End with an Open Invitation: Conclude the message by reinforcing your support. Say something like, "Please know that my team and I are here for you. Do not hesitate to reach out with any questions that come to mind before our next appointment. We are in this together."
+            """)
+
+    def start_first_chat(self, scan_info: dict, prepared: dict, llm_class='background'):
+        """
+        Starts the first chat message of a new scan on the fan-out pool, so it is generated while
+        the diagnosis streams instead of after it. It runs in the background class, within its own
+        limit, so it does not take a second report slot next to the diagnosis. Returns a Future of the text, None if it could
+        not be started; pass it to save_first_chat once the scan is stored.
+        """
+        def run(prompt):
+            result = {}
+            response = self.generate_response(prompt, prepared['images'], use_cache=not scan_info.get('bypass_cache'), llm_class=llm_class, result=result)
+            # generate_response answers failures with an error text and no context; that is not a chat message.
+            return response if 'context' in result else None
+
+        try:
+            return self.fanout_executor.submit(run, self.first_chat_prompt(scan_info, prepared))
+        except Exception as e:
+            print(f"Could not start the first chat message: {e}")
+            return None
+
+    def save_first_chat(self, scan, first_chat):
+        """Stores the first chat message of a scan once it is generated. Returns its ChatHistory id, None without one."""
+        try:
+            response = first_chat.result() if first_chat is not None else None
+        except Exception as e:
+            print(f"First chat message of scan {scan.id} failed: {e}")
+            response = None
+        if not response:
+            return None
+        chat_entry = ChatHistory(user_id=scan.user_id, scan_id=scan.id, user_message='', ai_response=response)
+        db.session.add(chat_entry)
+        db.session.commit()
+        # Follow-up turns look the context up by their newest stored turn, which is now this row.
+        if self.conversation_contexts is not None:
+            self.conversation_contexts.advance(scan.id, self.model_name, None, chat_entry.id)
+        return chat_entry.id
+
+    def analyze_volume_results(self, scan_info: dict, slice_paths: list, slice_thickness_mm: float):
+        """
+        Segments all slices of a volume in one batched pass, estimates the tumor volume and gets
+        one diagnosis from the LLM for the largest tumor cross-section.
+        The volume is stored as one Scan with a ScanSlice row per slice.
+        """
+        try:
+            user = User.query.filter_by(id=scan_info.get('user_id')).first()
+            volume_results = model_registry.process_volume(scan_info.get('user_id'), slice_paths)
+            slices = volume_results['slices']
+            volume = estimate_volume([s['tumor_area_cm2'] for s in slices], slice_thickness_mm)
+            key_slice = slices[volume['largest_slice_index']]
+            key_image = IngestedImage.from_path(key_slice['image_path'])
+
+            yolo_text_summary = self.parse_yolo_results_to_text(key_slice['yolo_results_json'], key_slice['mask_metrics'])
+            yolo_text_summary += (
+                f"\nVolume analysis over {volume['slice_count']} slices ({slice_thickness_mm} mm thick): "
+                f"tumor visible on {volume['tumor_slice_count']} slices spanning {volume['tumor_extent_mm']:.1f} mm, "
+                f"estimated tumor volume {volume['tumor_volume_cm3']:.2f} cm3. "
+                f"The provided images are slice {key_slice['slice_index'] + 1}, the largest tumor cross-section."
+            )
+            history_text_summary, text_summary = patient_history_summary(scan_info.get('user_id'))
+
+        except Exception as e:
+            print('Error analyze volume, parse and summarize: ', str(e))
+            return
+
+        try:
+            detect_prompt = self.build_detect_prompt(user, scan_info, yolo_text_summary, text_summary, history_text_summary)
+            result = {}
+            llm_response = self.generate_response(detect_prompt, [key_image.encode('PNG'), key_slice['overlay']], use_cache=not scan_info.get('bypass_cache'), result=result)
             scan = Scan(
                         user_id=scan_info.get('user_id'),
                         scan_date=scan_info.get('scan_date'),
                         scan_type=scan_info.get('scan_type'),
                         facility=scan_info.get('facility'),
                         symptoms_notes=scan_info.get('symptoms_notes'),
-                        image_path=scan_info.get('image_path'),
-                        yolo_result=yolo_results['yolo_results_json'],
+                        image_path=key_slice['image_path'],
+                        yolo_result=key_slice['yolo_results_json'],
                         yolo_diagnosis=str(yolo_text_summary),
                         ai_diagnosis=llm_response,
-                        processed_image_path=yolo_results['processed_image_dir'],
-                        tumor_size=yolo_results['tumor_pixel_area']
+                        processed_image_path=volume_results['processed_image_dir'],
+                        tumor_size=key_slice['tumor_area_cm2']
                     )
             db.session.add(scan)
+            for s in slices:
+                db.session.add(ScanSlice(
+                    scan=scan,
+                    slice_index=s['slice_index'],
+                    image_path=s['image_path'],
+                    processed_image_path=s['processed_image_path'],
+                    yolo_result=s['yolo_results_json'],
+                    tumor_area=s['tumor_area_cm2'],
+                    slice_thickness=slice_thickness_mm
+                ))
             db.session.commit()
+            self.remember_context(scan.id, None, result.get('context'))
 
-            # fisrt_chat = self.chat_response(chat_prompt, 'system', user.id, scan.id)
-            # fisrt_chat = self.generate_response(chat_prompt, [scan_info.get('image_path'), processed_image_full_path], user.id, scan.id)
-            fisrt_chat = 1
             return {
                         'user_id': user.id,
                         'scan_id': scan.id,
                         'content': llm_response,
-                        'chat_id': fisrt_chat
+                        'volume': volume,
+                        'image': key_image,
+                        'processed_image': key_slice['overlay']
                     }
+        except LLMOverloaded:
+            db.session.rollback()
+            raise
         except Exception as e:
-            print('Error analyze result, LLM response: ', str(e))
+            print('Error analyze volume, LLM response: ', str(e))
             return
     
-    def generate_response(self, prompt: str, images: list = None, user_id=None, scan_id=None):
+    def encode_images(self, images: list = None):
+        """
+        Base64 encodes images given as file paths or encoded bytes, skipping missing files.
+        With an image cache they are sent in their compact form.
+        """
+        base64_images = []
+        if images and isinstance(images, list):
+            for image_path in images:
+                if isinstance(image_path, (bytes, bytearray)):
+                    data = bytes(image_path)
+                elif image_path and os.path.exists(image_path):
+                    with open(image_path, "rb") as f:
+                        data = f.read()
+                else:
+                    print(f"Warning: Image path not found and will be skipped: {image_path}")
+                    continue
+                if self.image_cache is not None:
+                    try:
+                        data = self.image_cache.prepare(data)
+                    except Exception as e:
+                        print(f"Warning: Image could not be compacted and is sent as is: {e}")
+                base64_images.append(base64.b64encode(data).decode('utf-8'))
+        return base64_images
+
+    def admit(self, llm_class):
+        """Raises LLMOverloaded when the queue of the traffic class is full."""
+        if self.scheduler is not None:
+            self.scheduler.admit(llm_class)
+
+    def llm_slot(self, llm_class):
+        return self.scheduler.slot(llm_class) if self.scheduler is not None else nullcontext()
+
+    def cached_post(self, path, payload, use_cache=True, llm_class='chat'):
+        """
+        Posts a non-streaming request and returns the response JSON. Answers from the response
+        cache unless use_cache is False; a fresh answer is stored either way, with its Ollama
+        context so a cached /api/generate answer can still be continued.
+        Only calls that reach the model take a slot of llm_class.
+        """
+        key = make_llm_cache_key(payload) if self.response_cache is not None else None
+        if key and use_cache:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                print('LLM response served from cache.')
+                return json.loads(cached)
+        with self.llm_slot(llm_class), self.client.post(path, payload) as response:
+            # Raise an error for bad status codes (4xx or 5xx)
+            response.raise_for_status()
+            response_data = response.json()
+        if key and response_data.get('done'):
+            self.response_cache.put(key, json.dumps({k: response_data[k] for k in ('response', 'message', 'done', 'context') if k in response_data}))
+        return response_data
+
+    def generate_response(self, prompt: str, images: list = None, user_id=None, scan_id=None, use_cache=True, llm_class='report', result=None):
             """
-            Generates a response from the LLM, optionally with images,
+            Generates a response from the LLM, optionally with images (file paths or encoded bytes),
             and saves the interaction to the database if user and scan IDs are provided.
+            use_cache=False skips the response cache lookup. Raises LLMOverloaded when not admitted.
+            A fresh answer puts its Ollama context into the result dict, if given.
             """
             try:
-                base64_images = []
                 # 1. Encode images to Base64 if they are provided
-                if images and isinstance(images, list):
-                    for image_path in images:
-                        if image_path and os.path.exists(image_path):
-                            with open(image_path, "rb") as f:
-                                base64_images.append(base64.b64encode(f.read()).decode('utf-8'))
-                        else:
-                            print(f"Warning: Image path not found and will be skipped: {image_path}")
+                base64_images = self.encode_images(images)
 
                 # 2. (The Fix) Construct the payload correctly for the /api/generate endpoint
                 payload = {
@@ -489,16 +1049,12 @@ class OllamaProcessor:
                 # 3. Send the request to the Ollama API
                 # print(f"Sending payload to Ollama: { {k: (v if k != 'images' else f'{len(v)} images') for k, v in payload.items()} }")
                 print('Sending data to LLM for generate response, inputs:', 'prompt' if prompt else '', 'image' if images else '', 'saving to DB' if user_id else '')
-                response = requests.post(self.ollama_gen_url, json=payload)
-                
-                # Raise an error for bad status codes (4xx or 5xx)
-                # This will give a more detailed error message than just the status code
-                response.raise_for_status()
-                
-                response_data = response.json()
+                response_data = self.cached_post(self.ollama_gen_path, payload, use_cache, llm_class)
 
                 # The response from /api/generate for non-streaming is in the "response" key
                 content = response_data.get('response', 'No response generated.')
+                if result is not None:
+                    result['context'] = response_data.get('context')
                 
                 # 4. Conditional logic: Save to DB or return raw content
                 if user_id is not None and scan_id is not None:
@@ -514,6 +1070,8 @@ class OllamaProcessor:
                 else:
                     return content
 
+            except LLMOverloaded:
+                raise
             except requests.exceptions.HTTPError as http_err:
                 # This will catch the 500 error and print the response body from Ollama
                 print(f"Ollama API HTTP error: {http_err}")
@@ -527,29 +1085,48 @@ class OllamaProcessor:
                 return "Error: An unexpected error occurred."
 
 
-    def chat_response(self, prompt: str, role: str, user_id=None, scan_id=None, history=None):
-        """Generate response for chat functionality"""
+    def generate_many(self, prompts: dict, use_cache=True, llm_class='report'):
+        """
+        Runs independent generations at the same time on the fan-out pool.
+        prompts maps a name to a prompt or to a (prompt, images) tuple. Returns, once all are done,
+        {name: {'response': text, 'latency_ms': time of that generation, 'context': Ollama context}}.
+        Raises LLMOverloaded when any of them was not admitted; the finished ones are in the response cache.
+        """
+        def run(prompt, images):
+            started = time.perf_counter()
+            result = {}
+            response = self.generate_response(prompt, images, use_cache=use_cache, llm_class=llm_class, result=result)
+            return {'response': response, 'latency_ms': round((time.perf_counter() - started) * 1000, 1), 'context': result.get('context')}
+
+        futures = {}
+        for name, item in prompts.items():
+            prompt, images = item if isinstance(item, tuple) else (item, None)
+            futures[name] = self.fanout_executor.submit(run, prompt, images)
+        results = {}
+        overloaded = None
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except LLMOverloaded as e:
+                overloaded = overloaded or e
+        if overloaded is not None:
+            raise overloaded
+        print('Generated', ', '.join(f"{name} in {r['latency_ms']:.0f} ms" for name, r in results.items()))
+        return results
+
+    def chat_response(self, prompt: str, role: str, user_id=None, scan_id=None, history=None, use_cache=True, llm_class='chat'):
+        """Generate response for chat functionality, raises LLMOverloaded when not admitted"""
         try:
-            messages = self.generate_request(prompt, role, history)
-            
-            payload = {
-                "model": self.model_name,
-                "messages": messages,
-                "stream": False
-            }
+            path, payload = self.chat_request(prompt, role, history, scan_id)
+            payload["stream"] = False
             
             # Send the request to the correct chat endpoint
             print('LLM model is thinking for chat...')
-            response = requests.post(self.ollama_chat_url, json=payload)
-            # This is a good practice to raise an error for bad status codes (4xx or 5xx)
-            response.raise_for_status()
-
-            # Call .json() only ONCE and store it in a variable
-            response_data = response.json()
+            response_data = self.cached_post(path, payload, use_cache, llm_class)
             
             if response_data.get('done'):
                 # Safely get the content from the response dictionary
-                content = response_data.get('message', {}).get('content', 'No response generated')
+                content = answer_text(response_data) or 'No response generated'
                 
                 # Determine the user message based on the role
                 user_message = prompt if role == 'user' else ''
@@ -565,6 +1142,7 @@ class OllamaProcessor:
             
                     db.session.add(chat_entry)
                     db.session.commit()
+                    self.remember_context(scan_id, chat_entry.id, response_data.get('context'))
 
                     # Return the ID of the newly created chat record
                     return chat_entry.id
@@ -577,6 +1155,8 @@ class OllamaProcessor:
                 print(error_message)
                 return error_message
                 
+        except LLMOverloaded:
+            raise
         except requests.exceptions.RequestException as e:
             # Handle network-related errors (e.g., connection refused)
             print(f"Ollama API request error: {str(e)}")
@@ -586,8 +1166,121 @@ class OllamaProcessor:
             print(f"An unexpected error occurred in chat_response: {str(e)}")
             return "Error: An unexpected error occurred."
     
+    def stream_lines(self, path, payload):
+        """
+        Posts a streaming request and yields the decoded JSON lines Ollama sends back
+        """
+        with self.client.post(path, dict(payload, stream=True), stream=True) as response:
+            response.raise_for_status()
+            # chunk_size=None hands lines over as they arrive instead of waiting for 512 bytes.
+            for line in response.iter_lines(chunk_size=None):
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get('error'):
+                    raise RuntimeError(chunk['error'])
+                yield chunk
+                if chunk.get('done'):
+                    break
+
+    def stream_text(self, path, payload, extract, use_cache=True, llm_class='chat', result=None):
+        """
+        Yields the text of a streamed answer as it arrives, using extract(chunk) on every line.
+        A cached answer is yielded in one piece; a completed fresh answer is stored.
+        A fresh answer holds a slot of llm_class until the stream ends. The Ollama context of
+        the answer, fresh or cached, is put into the result dict, if given.
+        """
+        key = make_llm_cache_key(payload) if self.response_cache is not None else None
+        if key and use_cache:
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                print('LLM response served from cache.')
+                cached = json.loads(cached)
+                if result is not None:
+                    result['context'] = cached.get('context')
+                yield extract(cached)
+                return
+        parts = []
+        context = None
+        with self.llm_slot(llm_class):
+            for chunk in self.stream_lines(path, payload):
+                text = extract(chunk)
+                if text:
+                    parts.append(text)
+                    yield text
+                if chunk.get('done'):
+                    context = chunk.get('context')
+                    if result is not None:
+                        result['context'] = context
+        if key:
+            answer = ''.join(parts)
+            entry = {'response': answer, 'context': context} if path == self.ollama_gen_path else {'message': {'role': 'assistant', 'content': answer}}
+            self.response_cache.put(key, json.dumps(entry))
+
+    def stream_generate(self, prompt: str, images: list = None, use_cache=True, llm_class='report', result=None):
+        """
+        Yields the /api/generate response piece by piece as the model produces it
+        """
+        payload = {"model": self.model_name, "prompt": prompt}
+        base64_images = self.encode_images(images)
+        if base64_images:
+            payload["images"] = base64_images
+        print('Streaming LLM response, inputs:', 'prompt' if prompt else '', 'image' if base64_images else '')
+        yield from self.stream_text(self.ollama_gen_path, payload, lambda chunk: chunk.get('response'), use_cache, llm_class, result)
+
+    def stream_chat(self, prompt: str, role: str, history=None, use_cache=True, llm_class='chat', scan_id=None, result=None):
+        """
+        Yields the chat reply piece by piece as the model produces it
+        """
+        path, payload = self.chat_request(prompt, role, history, scan_id)
+        print('LLM model is streaming for chat...')
+        yield from self.stream_text(path, payload, answer_text, use_cache, llm_class, result)
+
+    def chat_request(self, prompt: str, role: str, history=None, scan_id=None):
+        """
+        (path, payload) of a chat turn. A scan conversation whose Ollama context is current
+        continues from it on /api/generate; otherwise the history is sent as /api/chat messages.
+        """
+        if scan_id is not None and role == 'user' and self.conversation_contexts is not None:
+            context = self.conversation_contexts.get(scan_id, self.model_name, history[-1].id if history else None)
+            if context:
+                return self.ollama_gen_path, {"model": self.model_name, "prompt": prompt, "context": context}
+        return self.ollama_chat_path, {"model": self.model_name, "messages": self.generate_request(prompt, role, history)}
+
+    def remember_context(self, scan_id, last_chat_id, context):
+        """Keeps the Ollama context of a scan conversation after its newest stored turn (None before the first)."""
+        if self.conversation_contexts is not None and context:
+            self.conversation_contexts.put(scan_id, self.model_name, last_chat_id, context)
+
+    def switch_model(self, model_name):
+        """Moves to another LLM; the stored contexts belong to the old one."""
+        self.model_name = model_name
+        if self.conversation_contexts is not None:
+            self.conversation_contexts.invalidate()
+
+    def summarize_chat(self, summary, turns):
+        """
+        Folds chat turns into the running summary of a conversation, raises when the model fails
+        """
+        transcript = "\n".join(f"Patient: {user_message}\nAssistant: {ai_response}" for user_message, ai_response in turns)
+        prompt = (f"""
+            You keep a short summary of a conversation between a patient and a medical AI assistant about a brain scan.
+            Current summary: {summary or 'None yet.'}
+            New part of the conversation:
+            {transcript}
+            Write the updated summary in at most 200 words. Keep symptoms, medications, findings, questions the patient asked and advice given. Answer with the summary only.
+        """)
+        # Under the report budget: the background class holds the scan jobs, a summary must not wait behind them.
+        content = self.generate_response(prompt, use_cache=True, llm_class='report')
+        if not content or content.startswith('Error:'):
+            raise RuntimeError(content or 'empty summary')
+        return content.strip()
+
     def generate_request(self, prompt: str, role: str, history):
         """Prepare the messages payload for the Ollama API"""
+        if history and self.chat_context is not None:
+            return self.chat_context.build(history[0].scan_id, history, prompt, role)
+
         messages = []
 
         if history:
@@ -611,8 +1304,11 @@ class OllamaProcessor:
         print('Generate requests was successful.')
         return messages
 
+def answer_text(response_data):
+    """Answer text of an /api/generate or /api/chat response or stream line."""
+    return response_data.get('response') or response_data.get('message', {}).get('content')
+
 def user_to_json(user: User):
-    profile_image_base64, profile_mime_type = file_to_base64(user.profile_photo, target_format='PNG') if user.profile_photo else (None, None)
     return {
         'id': user.id,
         'email': user.email,
@@ -638,8 +1334,8 @@ def user_to_json(user: User):
         'current_medications': user.current_medications,
         'medical_conditions': user.medical_conditions,
         'profile_photo': user.profile_photo,
-        'profile_base64': profile_image_base64,
-        'profile_mime_type': profile_mime_type,
+        'profile_url': user_photo_url(user),
+        'profile_mime_type': mimetypes.guess_type(user.profile_photo)[0] if user.profile_photo else None,
         'email_notifications': user.email_notifications,
         'sms_notifications': user.sms_notifications,
         'created_at': user.created_at
@@ -648,16 +1344,7 @@ def user_to_json(user: User):
 def scan_to_json(scans: Scan):
     payload = []
     for scan in scans:
-        original_image = scan.image_path
-        original_image_base64, original_mime_type = file_to_base64(original_image, target_format='PNG') if original_image else (None, None)
-        processed_image_base64 = None
-        processed_dir_path = scan.processed_image_path
-        if processed_dir_path and os.path.isdir(processed_dir_path):
-            files_in_dir = os.listdir(processed_dir_path)
-            if files_in_dir:
-                first_file_name = files_in_dir[0]
-                processed_image_full_path = os.path.join(processed_dir_path, first_file_name)
-                processed_image_base64, processed_mime_type = file_to_base64(processed_image_full_path, target_format='PNG')
+        # Images are fetched from /images, where browsers can cache them, not inlined.
         payload.append({
             'id': scan.id,
             'user_id': scan.user_id,
@@ -666,19 +1353,56 @@ def scan_to_json(scans: Scan):
             'facility': scan.facility,
             'symptoms_notes': scan.symptoms_notes,
             'image_path': scan.image_path,
-            'image_base64': original_image_base64,
-            'image_mime_type': original_mime_type,
+            'image_url': scan_image_url(scan, 'original'),
+            'image_mime_type': scan_derivatives.mime_type(),
+            'thumbnail_url': scan_image_url(scan, 'original', 'thumb'),
             'yolo_result': scan.yolo_result,
             'yolo_diagnosis': scan.yolo_diagnosis,
             'ai_diagnosis': scan.ai_diagnosis,
             'processed_image_path': scan.processed_image_path,
-            'processed_image_base64': processed_image_base64,
-            'processed_image_mime_type': processed_mime_type,
+            'processed_image_url': scan_image_url(scan, 'processed'),
+            'processed_image_mime_type': scan_derivatives.mime_type(),
+            'processed_thumbnail_url': scan_image_url(scan, 'processed', 'thumb'),
             'tumor_size': scan.tumor_size,
             'created_at': scan.created_at
         })
     return payload
 
+def encode_cursor(created, row_id):
+    """Opaque page cursor: the sort key of the last item of a page."""
+    return base64.urlsafe_b64encode(f"{created.isoformat()}|{row_id}".encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Raises ValueError on a cursor this server did not make."""
+    created, row_id = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8').split('|')
+    return datetime.fromisoformat(created), int(row_id)
+
+def page_arguments(default_limit, max_limit=100):
+    """limit, before (cursor) and since (id) of a history request, raises ValueError when malformed."""
+    limit = min(max(int(request.args.get('limit', default_limit)), 1), max_limit)
+    before = decode_cursor(request.args['before']) if request.args.get('before') else None
+    since = int(request.args['since']) if request.args.get('since') else None
+    return limit, before, since
+
+def keyset_page(query, created_column, id_column, limit, before=None, since=None):
+    """
+    One page of a history, without OFFSET: the newest items, or the ones older than the
+    before cursor, newest first. With since only the items with a higher id, oldest first,
+    so a polling client continues from the last id it got.
+    Returns (items, cursor of the next older page or None).
+    """
+    if since is not None:
+        # Seeking from the sort key of the last seen item keeps this a range scan of the index.
+        anchor = db.session.query(created_column).filter(id_column == since).scalar()
+        query = query.filter(tuple_(created_column, id_column) > tuple_(anchor, since)) if anchor else query.filter(id_column > since)
+        return query.order_by(created_column, id_column).limit(limit).all(), None
+    if before is not None:
+        query = query.filter(tuple_(created_column, id_column) < tuple_(*before))
+    items = query.order_by(created_column.desc(), id_column.desc()).limit(limit + 1).all()
+    has_more = len(items) > limit
+    items = items[:limit]
+    return items, encode_cursor(getattr(items[-1], created_column.key), items[-1].id) if has_more else None
+
 def chathistory_to_json(chats: ChatHistory):
     payload = []
     for chat in chats:
@@ -692,36 +1416,387 @@ def chathistory_to_json(chats: ChatHistory):
         })
     return payload
 
-def file_to_base64(file_path, target_format=None):
+def scan_result_to_json(scan: Scan):
+    """The /scan result of a finished scan: image URLs plus the YOLO and LLM diagnoses."""
+    return {
+        'scan_id': scan.id,
+        'scan_date': scan.scan_date.strftime('%Y-%m-%d'),
+        'scan_type': scan.scan_type,
+        'image_url': scan_image_url(scan, 'original'),
+        'image_mime_type': scan_derivatives.mime_type(),
+        'yolo_diagnosis': scan.yolo_diagnosis,
+        'ai_diagnosis': scan.ai_diagnosis,
+        'processed_image_url': scan_image_url(scan, 'processed'),
+        'processed_image_mime_type': scan_derivatives.mime_type()
+    }
+
+def segmentation_to_json(scan_info: dict, prepared: dict):
+    """The segmentation stage of a scan still being analyzed; its images are inline, the scan is not stored yet."""
+    return {
+        'scan_date': scan_info['scan_date'].strftime('%Y-%m-%d'),
+        'scan_type': scan_info['scan_type'],
+        'image_url': data_url(prepared['image'].encode('PNG'), 'image/png'),
+        'image_mime_type': 'image/png',
+        'yolo_diagnosis': prepared['yolo_text_summary'],
+        'processed_image_url': data_url(prepared['processed_image'], 'image/jpeg'),
+        'processed_image_mime_type': 'image/jpeg'
+    }
+
+def scan_job_to_json(job: ScanJob):
+    payload = {
+        'job_id': job.id,
+        'status': job.status,
+        'scan_id': job.scan_id,
+        'error': job.error,
+        'created_at': job.created_at,
+        'updated_at': job.updated_at
+    }
+    if job.status == 'done' and job.scan_id:
+        payload['result'] = scan_result_to_json(Scan.query.get(job.scan_id))
+    return payload
+
+# Initialize processors
+scan_derivatives = DerivativeCache(
+    app.config['DERIVATIVE_DIR'],
+    full_format=app.config['DERIVATIVE_FORMAT'],
+    thumb_size=app.config['DERIVATIVE_THUMB_SIZE']
+)
+inference_cache = InferenceCache(
+    app.config['INFERENCE_CACHE_DIR'],
+    memory_items=app.config['INFERENCE_CACHE_MEMORY_ITEMS'],
+    disk_max_bytes=app.config['INFERENCE_CACHE_DISK_MAX_MB'] * 1024 * 1024
+)
+
+def create_yolo_processor(weights, engine=None):
+    """Builds a processor for a weights file in models/ with the app's inference settings."""
+    return YOLOProcessor(
+        weights,
+        engine=engine or app.config['YOLO_ENGINE'],
+        workers=app.config['YOLO_WORKERS'],
+        threads_per_worker=app.config['YOLO_WORKER_THREADS'],
+        max_batch_size=app.config['YOLO_MAX_BATCH_SIZE'],
+        max_wait_ms=app.config['YOLO_MAX_WAIT_MS'],
+        runs_dir=app.config['YOLO_RUNS_DIR'],
+        async_persist=app.config['YOLO_ASYNC_PERSIST'],
+        cache=inference_cache  # keys include the weights fingerprint, so versions never share entries
+    )
+
+def smoke_test_yolo_processor(processor: YOLOProcessor):
+    """Segments the reference image with a freshly loaded version, raises if the output is unusable."""
+    entry = processor.run_inference(IngestedImage.from_path(app.config['YOLO_SMOKE_IMAGE']))
+    detections = json.loads(entry['yolo_results_json'])
+    if not isinstance(detections, list) or not entry['overlay'] or 'total_area_cm2' not in entry['mask_metrics']:
+        raise RuntimeError('smoke inference returned an incomplete result')
+
+model_registry = ModelRegistry(create_yolo_processor, smoke_test=smoke_test_yolo_processor)
+model_registry.register('default', create_yolo_processor(app.config['YOLO_WEIGHTS']))
+ollama_processor = OllamaProcessor(
+    base_urls=app.config['OLLAMA_URLS'],
+    pool_size=app.config['OLLAMA_POOL_SIZE'],
+    connect_timeout=app.config['OLLAMA_CONNECT_TIMEOUT'],
+    read_timeout=app.config['OLLAMA_READ_TIMEOUT'],
+    retries=app.config['OLLAMA_RETRIES'],
+    backoff=app.config['OLLAMA_RETRY_BACKOFF'],
+    scheduler=LLMScheduler(app.config['LLM_MAX_CONCURRENCY'], app.config['LLM_CLASSES']),
+    fanout_workers=app.config['LLM_FANOUT_WORKERS'],
+    chat_context=ChatContext(
+        lambda summary, turns: ollama_processor.summarize_chat(summary, turns),
+        load_chat_summary,
+        store_chat_summary,
+        token_budget=app.config['CHAT_CONTEXT_TOKENS'],
+        min_recent_turns=app.config['CHAT_RECENT_TURNS']
+    ),
+    conversation_contexts=ConversationContexts(
+        max_entries=app.config['CHAT_KV_MAX_CONVERSATIONS'],
+        max_context_tokens=app.config['CHAT_KV_MAX_CONTEXT_TOKENS']
+    ) if app.config['CHAT_KV_CONTEXT'] else None,
+    image_cache=LLMImageCache(
+        app.config['LLM_IMAGE_CACHE_DIR'],
+        size=app.config['LLM_IMAGE_SIZE'],
+        target_format=app.config['LLM_IMAGE_FORMAT'],
+        quality=app.config['LLM_IMAGE_QUALITY'],
+        max_bytes=app.config['LLM_IMAGE_CACHE_MAX_MB'] * 1024 * 1024
+    ),
+    response_cache=LLMResponseCache(
+        app.config['LLM_CACHE_PATH'],
+        ttl_seconds=app.config['LLM_CACHE_TTL_HOURS'] * 3600,
+        max_bytes=app.config['LLM_CACHE_MAX_MB'] * 1024 * 1024,
+        max_entries=app.config['LLM_CACHE_MAX_ENTRIES']
+    ) if app.config['LLM_CACHE_ENABLED'] else None
+)
+
+def cache_bypass_requested():
+    """True when the request asks for a fresh LLM answer with bypass_cache=1 in the query, form or JSON body."""
+    value = request.values.get('bypass_cache') or (request.get_json(silent=True) or {}).get('bypass_cache')
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+def sse_event(event, data, event_id=None):
+    """Formats one Server-Sent Event."""
+    return (f"id: {event_id}\n" if event_id is not None else "") + f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+def llm_overloaded_response(e: LLMOverloaded):
+    """429 with Retry-After for a call the LLM scheduler turned away, because its queue was full or its wait timed out."""
+    if e.timed_out:
+        message = 'The AI service did not get to your request in time. Please try again shortly.'
+    else:
+        message = 'The AI service is busy. Please try again shortly.'
+    response = jsonify({'success': False, 'message': message, 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 429
+
+app.register_error_handler(LLMOverloaded, llm_overloaded_response)
+
+def sse_response(events):
+    """Streams a generator of sse_event strings; proxies must not buffer it."""
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def enqueue_scan_job(scan_info: dict):
     """
-    Reads any image and video file supported by Pillow, converts it to a target format
-    in memory, and returns its Base64 encoded string and new MIME type.
+    Stores the scan as a queued job and wakes a worker. Returns the job. A decoded upload in
+    scan_info['image'] is handed to the worker in memory, the payload keeps its path.
     """
-    try:
-        if target_format:
-            img = Image.open(file_path)
-            in_mem_file = io.BytesIO()
-            img.save(in_mem_file, format=target_format)
-            in_mem_file.seek(0)
-            img_bytes = in_mem_file.read()
-            base64_encoded_result = base64.b64encode(img_bytes).decode('utf-8')
-            mime_type = f"image/{target_format.lower()}"
-        else:
-            with open(file_path, "rb") as image_file:
-                base64_encoded_result = base64.b64encode(image_file.read()).decode('utf-8')
-                mime_type, _ = mimetypes.guess_type(file_path) if file_path else (None, None)
-            
-        return base64_encoded_result, mime_type
+    payload = {key: value for key, value in scan_info.items() if key != 'image'}
+    job = ScanJob(
+        id=uuid.uuid4().hex,
+        user_id=scan_info['user_id'],
+        payload=json.dumps(dict(payload, scan_date=scan_info['scan_date'].isoformat()))
+    )
+    if scan_info.get('image') is not None:
+        scan_job_workers.attach(job.id, scan_info['image'])
+    db.session.add(job)
+    db.session.commit()
+    scan_job_workers.notify()
+    return job
+
+# Identifies the jobs this process runs; live progress is only available in the process that owns a job.
+SCAN_JOB_WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+def set_scan_job_status(job_id, status, **values):
+    now = datetime.utcnow()
+    ScanJob.query.filter_by(id=job_id).update(dict(values, status=status, updated_at=now, heartbeat_at=now))
+    db.session.commit()
+
+def scan_job_heartbeat(job_ids):
+    ScanJob.query.filter(ScanJob.id.in_(job_ids), ScanJob.owner == SCAN_JOB_WORKER_ID).update(
+        {'heartbeat_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+
+def claim_scan_job():
+    """Marks the oldest queued job as started and returns its id, None if nothing is queued."""
+    while True:
+        job = ScanJob.query.filter_by(status='queued').order_by(ScanJob.created_at).first()
+        if job is None:
+            return None
+        # The status check makes the claim atomic between worker threads.
+        now = datetime.utcnow()
+        claimed = ScanJob.query.filter_by(id=job.id, status='queued').update(
+            {'status': 'segmenting', 'attempts': ScanJob.attempts + 1, 'owner': SCAN_JOB_WORKER_ID,
+             'updated_at': now, 'heartbeat_at': now}
+        )
+        db.session.commit()
+        if claimed:
+            return job.id
 
+def run_scan_job(job_id):
+    """
+    Segmentation, then the diagnosis and the first chat message, with the stages recorded on the job.
+    Both run in the background class; with its limit of one the first chat follows the diagnosis.
+    """
+    job = ScanJob.query.get(job_id)
+    try:
+        scan_info = json.loads(job.payload)
+        scan_info['scan_date'] = datetime.fromisoformat(scan_info['scan_date'])
+        # Decoded by /scan when it queued the job here; after a restart or in another process, again from disk.
+        scan_info['image'] = scan_job_workers.take(job_id) or IngestedImage.from_path(scan_info['image_path'])
+        prepared = ollama_processor.prepare_scan_analysis(scan_info)
+        if prepared is None:
+            raise RuntimeError('segmentation failed')
+
+        scan_job_workers.set_progress(job_id, segmentation=segmentation_to_json(scan_info, prepared))
+        set_scan_job_status(job_id, 'reporting')
+
+        first_chat = ollama_processor.start_first_chat(scan_info, prepared)
+        parts = []
+        result = {}
+        for token in ollama_processor.stream_generate(prepared['detect_prompt'], prepared['images'], use_cache=not scan_info.get('bypass_cache'), llm_class='background', result=result):
+            parts.append(token)
+            scan_job_workers.add_token(job_id, token)
+        scan = ollama_processor.save_scan(scan_info, prepared, ''.join(parts), result.get('context'))
+        ollama_processor.save_first_chat(scan, first_chat)
+        set_scan_job_status(job_id, 'done', scan_id=scan.id)
+        print(f"Scan job {job_id} done, scan {scan.id}.")
     except Exception as e:
-        print(f"Could not process file {file_path}: {e}")
-        return None, None
+        print(f"Scan job {job_id} failed: {e}")
+        db.session.rollback()
+        set_scan_job_status(job_id, 'failed', error=str(e))
 
-# Initialize processors
-yolo_processor = YOLOProcessor("yolov11-seg-brain.pt")  # Update with your model path
-ollama_processor = OllamaProcessor()
+def recover_scan_jobs():
+    """
+    Requeues jobs whose process stopped while running them. Jobs with a recent heartbeat still
+    have a live owner, possibly another process, and are left alone.
+    """
+    stale_before = datetime.utcnow() - timedelta(seconds=app.config['SCAN_JOB_STALE_SECONDS'])
+    interrupted = ScanJob.query.filter(
+        ScanJob.status.in_(['segmenting', 'reporting']),
+        db.or_(ScanJob.heartbeat_at.is_(None), ScanJob.heartbeat_at < stale_before)
+    ).all()
+    for job in interrupted:
+        if (job.attempts or 0) >= app.config['SCAN_JOB_MAX_ATTEMPTS']:
+            job.status, job.error = 'failed', 'interrupted too often'
+        else:
+            job.status = 'queued'
+        job.owner = None
+        job.updated_at = datetime.utcnow()
+    db.session.commit()
+    if interrupted:
+        print(f"Recovered {len(interrupted)} interrupted scan jobs.")
+
+scan_job_workers = JobWorkers(
+    claim_scan_job,
+    run_scan_job,
+    workers=app.config['SCAN_JOB_WORKERS'],
+    poll_interval=app.config['SCAN_JOB_POLL_SECONDS'],
+    context=app.app_context,
+    name='scan-job',
+    heartbeat=scan_job_heartbeat,
+    heartbeat_interval=app.config['SCAN_JOB_HEARTBEAT_SECONDS']
+)
 
 # Routes
+def send_image(path, mimetype, version):
+    """
+    Sends an image file with a strong ETag, answering If-None-Match with 304 and Range with 206.
+    A URL carrying the current version may be cached for good; any other is revalidated.
+    """
+    versioned = version is not None and request.args.get('v') == version
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=True, max_age=app.config['IMAGE_MAX_AGE'] if versioned else None)
+    # The images belong to one patient, shared caches must not keep them.
+    response.cache_control.public = False
+    response.cache_control.private = True
+    if versioned:
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response
+
+@app.route('/images/scans/<int:scan_id>/<kind>', methods=['GET'])
+def scan_image(scan_id, kind):
+    """Display image of a scan ('original' or 'processed'), ?variant=thumb for the thumbnail."""
+    if 'user_id' not in session:
+        return jsonify({'success':False, 'message': "Not logged in.", 'redirect_url': url_for('login')}), 401
+    variant = request.args.get('variant', 'full')
+    if kind not in ('original', 'processed') or variant not in ('full', 'thumb'):
+        return jsonify({'success': False, 'message': 'Image not found.'}), 404
+    scan = Scan.query.get(scan_id)
+    if not scan or scan.user_id != session['user_id']:
+        return jsonify({'success': False, 'message': 'Image not found.'}), 404
+    source_path = scan_image_sources(scan)[kind]
+    if not scan_derivatives.ensure(scan.id, kind, source_path):
+        return jsonify({'success': False, 'message': 'Image not found.'}), 404
+    return send_image(scan_derivatives.path(scan.id, kind, variant), scan_derivatives.mime_type(variant), file_version(source_path))
+
+@app.route('/images/users/<int:user_id>/photo', methods=['GET'])
+def user_photo(user_id):
+    if 'user_id' not in session:
+        return jsonify({'success':False, 'message': "Not logged in.", 'redirect_url': url_for('login')}), 401
+    user = User.query.get(user_id)
+    if user_id != session['user_id'] or not user or not user.profile_photo or not os.path.exists(user.profile_photo):
+        return jsonify({'success': False, 'message': 'Image not found.'}), 404
+    return send_image(user.profile_photo, mimetypes.guess_type(user.profile_photo)[0], file_version(user.profile_photo))
+
+@app.route('/health/live')
+def health_live():
+    return jsonify({'success': True, 'status': 'alive'})
+
+@app.route('/health/ready')
+def health_ready():
+    """Readiness probe: 200 only once the model is loaded and warmed, so traffic goes to hot workers."""
+    processor = model_registry.current
+    workers = processor.health()
+    ready = processor.ready and all(w['alive'] and w['ready'] for w in workers)
+    return jsonify({
+        'success': ready,
+        'status': 'ready' if ready else 'warming',
+        'model_version': model_registry.active,
+        'engine': processor.engine,
+        'workers': workers,
+        'llm_backends': ollama_processor.client.stats(),
+        'llm_scheduler': ollama_processor.scheduler.stats(),
+        'llm_images': ollama_processor.image_cache.stats(),
+        'chat_summaries': ollama_processor.chat_context.stats(),
+        'chat_contexts': ollama_processor.conversation_contexts.stats() if ollama_processor.conversation_contexts else None
+    }), 200 if ready else 503
+
+def model_admin_required():
+    """Returns an error response unless the session user may manage model versions."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in.', 'redirect_url': url_for('login')}), 401
+    if session['user_id'] not in app.config['MODEL_ADMIN_USER_IDS']:
+        return jsonify({'success': False, 'message': 'Not allowed.'}), 403
+    return None
+
+@app.route('/admin/models', methods=['GET'])
+def list_models():
+    """Versions, traffic split and per-version latency."""
+    denied = model_admin_required()
+    if denied:
+        return denied
+    return jsonify({'success': True, **model_registry.status()})
+
+@app.route('/admin/models', methods=['POST'])
+def load_model():
+    """Loads a weights file from models/ in the background; it only takes traffic once activated or split."""
+    denied = model_admin_required()
+    if denied:
+        return denied
+    name = request.json.get('name')
+    weights = secure_filename(request.json.get('weights') or '')
+    if not name or not weights:
+        return jsonify({'success': False, 'message': 'name and weights are required.'}), 400
+    if not os.path.exists(os.path.join(os.getcwd(), 'models', weights)):
+        return jsonify({'success': False, 'message': f'models/{weights} does not exist.'}), 404
+    if name in model_registry.versions or model_registry.loading.get(name, {}).get('status') == 'loading':
+        return jsonify({'success': False, 'message': f"Model version '{name}' already exists."}), 409
+    model_registry.load_in_background(name, weights, request.json.get('engine'), activate=bool(request.json.get('activate')))
+    return jsonify({'success': True, 'message': f"Loading model version '{name}'."}), 202
+
+@app.route('/admin/models/<name>/activate', methods=['POST'])
+def activate_model(name):
+    denied = model_admin_required()
+    if denied:
+        return denied
+    try:
+        model_registry.activate(name)
+    except KeyError:
+        return jsonify({'success': False, 'message': f"Unknown model version '{name}'."}), 404
+    return jsonify({'success': True, **model_registry.status()})
+
+@app.route('/admin/models/split', methods=['POST'])
+def split_model_traffic():
+    """Body: {"candidate": name, "fraction": 0.1}; fraction 0 ends the split."""
+    denied = model_admin_required()
+    if denied:
+        return denied
+    try:
+        model_registry.split(request.json.get('candidate'), float(request.json.get('fraction', 0)))
+    except KeyError:
+        return jsonify({'success': False, 'message': 'Unknown candidate model version.'}), 404
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'fraction must be a number.'}), 400
+    return jsonify({'success': True, **model_registry.status()})
+
+@app.route('/admin/models/<name>', methods=['DELETE'])
+def unload_model(name):
+    denied = model_admin_required()
+    if denied:
+        return denied
+    try:
+        model_registry.unload(name)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    return jsonify({'success': True, **model_registry.status()})
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -812,7 +1887,14 @@ def signup():
         full_name_parts = request.form.get('fullname').split()
         first_name = full_name_parts[0] if full_name_parts else ''
         last_name = ''.join(full_name_parts[1:]) if len(full_name_parts) > 1 else ''
-        role = request.form.get('role')
+        role = request.form.get('role') or 'patient'
+        if role not in app.config['SIGNUP_ROLES']:
+            error_message = 'Invalid role.'
+            if is_ajax:
+                return jsonify({'success':False, 'message':error_message}), 400
+            else:
+                flash(error_message)
+                return redirect(url_for('login_page'))
         
         # Check if user already exists
         existing_user = User.query.filter_by(email=email).first()
@@ -830,7 +1912,7 @@ def signup():
             password_hash=generate_password_hash(password),
             first_name=first_name,
             last_name=last_name,
-            role=role if role else 'patient'
+            role=role
         )
         
         db.session.add(user)
@@ -920,8 +2002,10 @@ def app_page():
             return redirect(url_for('login'))
     
     user = User.query.get(session['user_id'])
-    recent_scans = Scan.query.filter_by(user_id=session['user_id']).order_by(Scan.created_at.desc()).limit(5).all()
-    chat_history = ChatHistory.query.filter_by(user_id=session['user_id']).order_by(ChatHistory.timestamp).limit(50).all()
+    # The first pages of /get-scan-history and /get-chat-history.
+    recent_scans, _ = keyset_page(Scan.query.filter_by(user_id=session['user_id']), Scan.created_at, Scan.id, 5)
+    chat_history, _ = keyset_page(ChatHistory.query.filter_by(user_id=session['user_id']), ChatHistory.timestamp, ChatHistory.id, 50)
+    chat_history.reverse()  # shown in the order the messages were written
     
     
     return render_template('app.html', user=user_to_json(user), recent_scans=scan_to_json(recent_scans), chat_history=chathistory_to_json(chat_history))
@@ -942,6 +2026,178 @@ def app_scan():
         if not file or file.filename == '':
             return jsonify({'success': False, 'message': 'No file selected.'}), 400
         
+        filename = secure_filename(file.filename)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
+        unique_filename = timestamp + filename
+        user_path_full = os.path.join(app.config['UPLOAD_FOLDER'], str(session['user_id']))
+        os.makedirs(user_path_full, exist_ok=True)
+        file_path_full = os.path.join(user_path_full, unique_filename)
+        image = IngestedImage.from_upload(file, file_path_full)
+
+        scan_info = {
+            'user_id': session['user_id'],
+            'scan_date': datetime.strptime(request.form.get('scan_date'), '%Y-%m-%d'),
+            'scan_type': request.form.get('scan_type'),
+            'facility': request.form.get('facility'),
+            'symptoms_notes': request.form.get('symptoms_notes'),
+            'image_path': file_path_full,
+            'bypass_cache': cache_bypass_requested(),
+            'image': image
+        }
+
+        # Segmentation and the LLM report run on the scan job workers; the client follows the job.
+        job = enqueue_scan_job(scan_info)
+        return jsonify({
+            'success': True,
+            'job_id': job.id,
+            'status': job.status,
+            'status_url': url_for('scan_job_status', job_id=job.id),
+            'events_url': url_for('scan_job_events', job_id=job.id)
+        }), 202
+            
+    except Exception as e:
+        print(f"An error occurred in /scan: {e}")
+        db.session.rollback()
+        message = 'An internal error occurred. Please try again later.'
+        if is_ajax:
+            return jsonify({'success': False, 'message': message}), 500
+        else:
+            flash(message)
+            return redirect(url_for('app_page', _anchor='scans'))
+
+@app.route('/scan/jobs/<job_id>', methods=['GET'])
+def scan_job_status(job_id):
+    """Stage of a queued scan (queued, segmenting, reporting, done, failed); the scan result once done."""
+    if 'user_id' not in session:
+        return jsonify({'success':False, 'message': "Not logged in.", 'redirect_url': url_for('login')}), 401
+    job = ScanJob.query.get(job_id)
+    if not job or job.user_id != session['user_id']:
+        return jsonify({'success': False, 'message': 'Job not found.'}), 404
+    return jsonify({'success': True, **scan_job_to_json(job)})
+
+@app.route('/scan/jobs/<job_id>/events', methods=['GET'])
+def scan_job_events(job_id):
+    """
+    Server-Sent Events of a queued scan: 'status' on every stage change, 'segmentation' with
+    the images and YOLO findings, 'token' per piece of the report, then 'done' or 'error'.
+    Reconnecting clients send Last-Event-ID and only get the tokens they missed.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success':False, 'message': "Not logged in.", 'redirect_url': url_for('login')}), 401
+    job = ScanJob.query.get(job_id)
+    if not job or job.user_id != session['user_id']:
+        return jsonify({'success': False, 'message': 'Job not found.'}), 404
+    last_event_id = request.headers.get('Last-Event-ID', '')
+    tokens_sent = int(last_event_id) + 1 if last_event_id.isdigit() else 0
+
+    def events():
+        status = None
+        segmentation_sent = False
+        sent = tokens_sent
+        while True:
+            db.session.refresh(job)
+            if job.status != status:
+                status = job.status
+                yield sse_event('status', {'status': status})
+            progress = scan_job_workers.progress(job_id)
+            if progress.get('segmentation') and not segmentation_sent:
+                segmentation_sent = True
+                yield sse_event('segmentation', progress['segmentation'])
+            for token in progress['tokens'][sent:]:
+                yield sse_event('token', {'text': token}, event_id=sent)
+                sent += 1
+            if status == 'done':
+                yield sse_event('done', {'success': True, **scan_result_to_json(Scan.query.get(job.scan_id))})
+                return
+            if status == 'failed':
+                yield sse_event('error', {'message': 'The scan could not be analyzed: ' + str(job.error)})
+                return
+            time.sleep(0.25)
+
+    return sse_response(events())
+
+@app.route('/scan/stream', methods=['POST'])
+def app_scan_stream():
+    """
+    Same form as /scan, answered as Server-Sent Events: 'segmentation' with the images and
+    YOLO findings, a 'token' per piece of the diagnosis, then 'done' once the Scan and the
+    first chat message, generated alongside the diagnosis, are stored.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success':False, 'message': "Not logged in.", 'redirect_url': url_for('login')}), 401
+    # Turned away with 429 before the upload is stored when the report queue is full.
+    ollama_processor.admit('report')
+
+    file = request.files.get('scan_image')
+    if not file or file.filename == '':
+        return jsonify({'success': False, 'message': 'No file selected.'}), 400
+    try:
+        filename = secure_filename(file.filename)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
+        unique_filename = timestamp + filename
+        user_path_full = os.path.join(app.config['UPLOAD_FOLDER'], str(session['user_id']))
+        os.makedirs(user_path_full, exist_ok=True)
+        file_path_full = os.path.join(user_path_full, unique_filename)
+        image = IngestedImage.from_upload(file, file_path_full)
+        scan_info = {
+            'user_id': session['user_id'],
+            'scan_date': datetime.strptime(request.form.get('scan_date'), '%Y-%m-%d'),
+            'scan_type': request.form.get('scan_type'),
+            'facility': request.form.get('facility'),
+            'symptoms_notes': request.form.get('symptoms_notes'),
+            'image_path': file_path_full,
+            'bypass_cache': cache_bypass_requested(),
+            'image': image
+        }
+    except Exception as e:
+        print(f"An error occurred in /scan/stream: {e}")
+        return jsonify({'success': False, 'message': 'Could not read the uploaded scan.'}), 400
+
+    def events():
+        prepared = ollama_processor.prepare_scan_analysis(scan_info)
+        if prepared is None:
+            yield sse_event('error', {'message': 'An internal error occurred. Please try again later.'})
+            return
+        yield sse_event('segmentation', segmentation_to_json(scan_info, prepared))
+
+        first_chat = ollama_processor.start_first_chat(scan_info, prepared)
+        parts = []
+        result = {}
+        try:
+            for token in ollama_processor.stream_generate(prepared['detect_prompt'], prepared['images'], use_cache=not scan_info.get('bypass_cache'), result=result):
+                parts.append(token)
+                yield sse_event('token', {'text': token})
+            # The Scan row is only written once the whole diagnosis has arrived.
+            scan = ollama_processor.save_scan(scan_info, prepared, ''.join(parts), result.get('context'))
+            chat_id = ollama_processor.save_first_chat(scan, first_chat)
+        except LLMOverloaded as e:
+            yield sse_event('error', {'message': 'The AI service is busy. Please try again shortly.', 'retry_after': e.retry_after})
+            return
+        except Exception as e:
+            print(f"An error occurred in /scan/stream: {e}")
+            db.session.rollback()
+            yield sse_event('error', {'message': 'The AI service could not complete the diagnosis.'})
+            return
+        yield sse_event('done', {'success': True, 'scan_id': scan.id, 'ai_diagnosis': scan.ai_diagnosis, 'chat_id': chat_id})
+
+    return sse_response(events())
+
+@app.route('/scan-volume', methods=['POST'])
+def app_scan_volume():
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+    if 'user_id' not in session:
+        message = "Not logged in."
+        if is_ajax:
+            return jsonify({'success':False, 'message': message, 'redirect_url': url_for('login')}), 401
+        else:
+            flash(message)
+            return redirect(url_for('login'))
+
+    try:
+        file = request.files.get('scan_volume')
+        if not file or file.filename == '':
+            return jsonify({'success': False, 'message': 'No file selected.'}), 400
+
         filename = secure_filename(file.filename)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_')
         unique_filename = timestamp + filename
@@ -950,47 +2206,47 @@ def app_scan():
         file_path_full = os.path.join(user_path_full, unique_filename)
         file.save(file_path_full)
 
+        if not is_volume_upload(file_path_full):
+            return jsonify({'success': False, 'message': 'Upload a multi-page TIFF or a ZIP archive of slices.'}), 400
+        slice_paths = extract_slices(file_path_full, os.path.splitext(file_path_full)[0] + '_slices',
+                                     max_slices=app.config['VOLUME_MAX_SLICES'],
+                                     max_bytes=app.config['VOLUME_MAX_EXTRACTED_MB'] * 1024 * 1024)
+        if not slice_paths:
+            return jsonify({'success': False, 'message': 'No slices found in the uploaded volume.'}), 400
+
+        slice_thickness = float(request.form.get('slice_thickness') or app.config['VOLUME_SLICE_THICKNESS_MM'])
         scan_info = {
             'user_id': session['user_id'],
             'scan_date': datetime.strptime(request.form.get('scan_date'), '%Y-%m-%d'),
             'scan_type': request.form.get('scan_type'),
             'facility': request.form.get('facility'),
             'symptoms_notes': request.form.get('symptoms_notes'),
-            'image_path': file_path_full 
+            'image_path': file_path_full,
+            'bypass_cache': cache_bypass_requested()
         }
 
-        analyze_scan = ollama_processor.analyze_scan_results(scan_info)
-        scan_id = analyze_scan.get('scan_id')
-        scan = Scan.query.get(scan_id)
+        ollama_processor.admit('report')
+        analyze_scan = ollama_processor.analyze_volume_results(scan_info, slice_paths, slice_thickness)
+        if analyze_scan is None:
+            # Segmentation or the report failed, the cause is logged by analyze_volume_results.
+            return jsonify({'success': False, 'message': 'An internal error occurred. Please try again later.'}), 500
+        scan = Scan.query.get(analyze_scan.get('scan_id'))
         if not scan:
-            return jsonify({'success': False, 'message': f'Scan with ID {scan_id} not found after processing.'}), 404
-        original_image = scan.image_path
-        original_image_base64, original_mime_type = file_to_base64(original_image, target_format='PNG') if original_image else None
-        processed_image_base64 = None
-        processed_dir_path = scan.processed_image_path
-        if processed_dir_path and os.path.isdir(processed_dir_path):
-            files_in_dir = os.listdir(processed_dir_path)
-            if files_in_dir:
-                first_file_name = files_in_dir[0]
-                processed_image_full_path = os.path.join(processed_dir_path, first_file_name)
-                processed_image_base64, processed_mime_type = file_to_base64(processed_image_full_path)
-                
-            
+            return jsonify({'success': False, 'message': 'Scan not found after processing.'}), 404
+
         return jsonify({
             'success': True,
-            'scan_id': scan.id,
-            'scan_date': scan.scan_date.strftime('%Y-%m-%d'),
-            'scan_type': scan.scan_type,
-            'image_base64': original_image_base64,
-            'image_mime_type': original_mime_type,
-            'yolo_diagnosis': scan.yolo_diagnosis,
-            'ai_diagnosis': scan.ai_diagnosis,
-            'processed_image_base64': processed_image_base64,
-            'processed_image_mime_type': processed_mime_type
+            **scan_result_to_json(scan),
+            'tumor_volume_cm3': analyze_scan['volume']['tumor_volume_cm3'],
+            'slices': [{'slice_index': s.slice_index, 'tumor_area': s.tumor_area} for s in scan.slices]
         })
-            
+
+    except VolumeTooLarge as e:
+        return jsonify({'success': False, 'message': str(e)}), 413
+    except LLMOverloaded as e:
+        return llm_overloaded_response(e)
     except Exception as e:
-        print(f"An error occurred in /scan: {e}")
+        print(f"An error occurred in /scan-volume: {e}")
         db.session.rollback()
         message = 'An internal error occurred. Please try again later.'
         if is_ajax:
@@ -998,7 +2254,7 @@ def app_scan():
         else:
             flash(message)
             return redirect(url_for('app_page', _anchor='scans'))
-        
+
 @app.route('/chat', methods=['POST'])
 def app_chat():
     is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
@@ -1014,16 +2270,20 @@ def app_chat():
         scan_id = request.json.get('scan_id')
         
         # Get context from recent scan if provided
+        chat_id = None
         if scan_id:
             scan = Scan.query.get(scan_id)
-            chat_history = ChatHistory.query.filter_by(scan_id=scan_id).order_by(timestamp).limit(20)
+            # The turn continues the scan's stored conversation, which only its owner may see.
+            if not scan or scan.user_id != session['user_id']:
+                return jsonify({'success': False, 'message': 'Scan not found.'}), 404
+            chat_history = chat_turns(scan_id)
         # Generate AI response
-            chat_id = ollama_processor.chat_response(user_message, 'user', session['user_id'], scan_id, chat_history)
+            chat_id = ollama_processor.chat_response(user_message, 'user', session['user_id'], scan_id, chat_history, use_cache=not cache_bypass_requested())
             timestamp = ChatHistory.query.get(chat_id).timestamp
             ai_response = ChatHistory.query.get(chat_id).ai_response
         else:
             timestamp = datetime.utcnow
-            ai_response = ollama_processor.chat_response(user_message, 'user')
+            ai_response = ollama_processor.chat_response(user_message, 'user', use_cache=not cache_bypass_requested())
         
         return jsonify({
             'success':True,
@@ -1032,6 +2292,8 @@ def app_chat():
             'timestamp': timestamp
         })
     
+    except LLMOverloaded as e:
+        return llm_overloaded_response(e)
     except Exception as e:
         message = 'error: ' + str(e)
         if is_ajax:
@@ -1040,6 +2302,56 @@ def app_chat():
             flash(message)
             return redirect(url_for('app_page', _anchor='chat'))
 
+@app.route('/chat/stream', methods=['POST'])
+def app_chat_stream():
+    """
+    Same body as /chat, answered as Server-Sent Events: a 'token' per piece of the reply, then
+    'done' with the stored ChatHistory id once the reply is complete.
+    """
+    if 'user_id' not in session:
+        return jsonify({'success':False, 'message': "Not logged in.", 'redirect_url': url_for('login')}), 401
+    user_message = (request.json or {}).get('message')
+    if not user_message:
+        return jsonify({'success': False, 'message': 'Empty message.'}), 400
+    ollama_processor.admit('chat')
+    user_id = session['user_id']
+    scan_id = request.json.get('scan_id')
+    use_cache = not cache_bypass_requested()
+    history = None
+    if scan_id:
+        scan = Scan.query.get(scan_id)
+        if not scan or scan.user_id != user_id:
+            return jsonify({'success': False, 'message': 'Scan not found.'}), 404
+        history = chat_turns(scan_id)
+
+    def events():
+        parts = []
+        result = {}
+        try:
+            for token in ollama_processor.stream_chat(user_message, 'user', history, use_cache=use_cache, scan_id=scan_id, result=result):
+                parts.append(token)
+                yield sse_event('token', {'text': token})
+            content = ''.join(parts)
+            chat_id = None
+            timestamp = datetime.utcnow()
+            if scan_id:
+                chat_entry = ChatHistory(user_id=user_id, scan_id=scan_id, user_message=user_message, ai_response=content)
+                db.session.add(chat_entry)
+                db.session.commit()
+                chat_id, timestamp = chat_entry.id, chat_entry.timestamp
+                ollama_processor.remember_context(scan_id, chat_id, result.get('context'))
+        except LLMOverloaded as e:
+            yield sse_event('error', {'message': 'The AI service is busy. Please try again shortly.', 'retry_after': e.retry_after})
+            return
+        except Exception as e:
+            print(f"An error occurred in /chat/stream: {e}")
+            db.session.rollback()
+            yield sse_event('error', {'message': 'Error: Could not connect to the AI service.'})
+            return
+        yield sse_event('done', {'success': True, 'chat_id': chat_id, 'response': content, 'timestamp': timestamp})
+
+    return sse_response(events())
+
 @app.route('/update_profile', methods=['POST'])
 def update_profile():
     is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
@@ -1155,6 +2467,7 @@ def get_user_info():
 
 @app.route('/get-scan-history', methods=['GET'])
 def get_scan_history():
+    """Newest scans first; ?limit=, ?before=<next_cursor> for older ones, ?since=<latest_id> for new ones only."""
     is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
     
     if 'user_id' not in session:
@@ -1165,11 +2478,17 @@ def get_scan_history():
             flash(message)
             return redirect(url_for('login'))
     try:
-        recent_scans = Scan.query.filter_by(user_id=session['user_id']).order_by(Scan.created_at.desc()).limit(5).all()
+        try:
+            limit, before, since = page_arguments(default_limit=5)
+        except (ValueError, KeyError):
+            return jsonify({'success': False, 'message': 'Invalid limit, before or since.'}), 400
+        scans, next_cursor = keyset_page(Scan.query.filter_by(user_id=session['user_id']), Scan.created_at, Scan.id, limit, before, since)
         return jsonify({
             'success': True,
             'message': 'User scans retrieved successfully.',
-            'user_scan': scan_to_json(recent_scans)
+            'user_scan': scan_to_json(scans),
+            'next_cursor': next_cursor,
+            'latest_id': max([scan.id for scan in scans], default=since)
         })
 
     except Exception as e:
@@ -1182,6 +2501,7 @@ def get_scan_history():
 
 @app.route('/get-chat-history', methods=['GET'])
 def get_chat_history():
+    """Latest chat messages in written order; ?limit=, ?before=<next_cursor> for older ones, ?since=<latest_id> for new ones only."""
     is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
     
     if 'user_id' not in session:
@@ -1193,11 +2513,19 @@ def get_chat_history():
             return redirect(url_for('login'))
 
     try:
-        chat_history = ChatHistory.query.filter_by(user_id=session['user_id']).order_by(ChatHistory.timestamp).limit(50).all()
+        try:
+            limit, before, since = page_arguments(default_limit=50, max_limit=200)
+        except (ValueError, KeyError):
+            return jsonify({'success': False, 'message': 'Invalid limit, before or since.'}), 400
+        chats, next_cursor = keyset_page(ChatHistory.query.filter_by(user_id=session['user_id']), ChatHistory.timestamp, ChatHistory.id, limit, before, since)
+        if since is None:
+            chats.reverse()  # a page is shown in the order the messages were written
         return jsonify({
             'success': True,
             'message': 'User chats retrieved successfully.',
-            'user_chat': chathistory_to_json(chat_history)
+            'user_chat': chathistory_to_json(chats),
+            'next_cursor': next_cursor,
+            'latest_id': max([chat.id for chat in chats], default=since)
         })
 
     except Exception as e:
@@ -1208,109 +2536,140 @@ def get_chat_history():
             flash(message)
             return redirect(url_for('app'))
 
-# @app.route('/get-medical-records', methods=['GET'])
-# def get_medical_records():
-#     is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+@app.route('/get-medical-records', methods=['GET'])
+def get_medical_records():
+    is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
 
-#     if 'user_id' not in session:
-#         message = "Not logged in."
-#         if is_ajax:
-#             return jsonify({'success': False, 'message': message, 'redirect_url': url_for('login')}), 401
-#         else:
-#             flash(message)
-#             return redirect(url_for('login'))
+    if 'user_id' not in session:
+        message = "Not logged in."
+        if is_ajax:
+            return jsonify({'success': False, 'message': message, 'redirect_url': url_for('login')}), 401
+        else:
+            flash(message)
+            return redirect(url_for('login'))
 
-#     try:
-#         user = User.query.get(session['user_id'])
-#         if not user:
-#             return jsonify({'success': False, 'message': "User not found."}), 404
+    try:
+        user = User.query.get(session['user_id'])
+        if not user:
+            return jsonify({'success': False, 'message': "User not found."}), 404
 
-#         all_scans = Scan.query.filter_by(user_id=session['user_id']).order_by(Scan.scan_date.asc()).all()
+        all_scans = Scan.query.filter_by(user_id=session['user_id']).order_by(Scan.scan_date.asc()).all()
         
-#         if not all_scans:
-#             return jsonify({
-#                 'success': True,
-#                 'user': user_to_json(user),
-#                 'scans': [],
-#                 'chart_data': {},
-#                 'medical_summary': "No medical records found.",
-#                 'treatment_draft': "No scan data available to generate a draft.",
-#                 'patient_report': "No scan data available to generate a report."
-#             })
-
-#         chart_data = {
-#             'labels': [scan.scan_date.strftime('%Y-%m-%d') for scan in all_scans],
-#             'data': [scan_to_json(all_scans)['tumor_size']]
-#         }
-
-#         scan_history_summary = ollama_processor.generate_history_summary(all_scans)
-#         latest_scan_report = all_scans[-1].ai_diagnosis
-
-#         prompt1 = f"""
-#         As a medical AI assistant, generate a comprehensive, easy-to-understand health report for a patient based on their latest MRI scan analysis and medical history.
-#         The report should be encouraging and supportive. Do not provide a diagnosis, but explain the findings clearly.
+        if not all_scans:
+            return jsonify({
+                'success': True,
+                'user': user_to_json(user),
+                'scans': [],
+                'chart_data': {},
+                'medical_summary': "No medical records found.",
+                'treatment_draft': "No scan data available to generate a draft.",
+                'patient_report': "No scan data available to generate a report."
+            })
+
+        chart_data = {
+            'labels': [scan.scan_date.strftime('%Y-%m-%d') for scan in all_scans],
+            'data': [scan.tumor_size for scan in all_scans]
+        }
+
+        scan_history_summary, _ = patient_history_summary(user.id)
+        latest_scan_report = all_scans[-1].ai_diagnosis
+
+        prompt1 = f"""
+        As a medical AI assistant, generate a comprehensive, easy-to-understand health report for a patient based on their latest MRI scan analysis and medical history.
+        The report should be encouraging and supportive. Do not provide a diagnosis, but explain the findings clearly.
         
-#         Patient's Medical History:
-#         - Conditions: {user.medical_conditions or 'Not specified'}
-#         - Allergies: {user.allergies or 'Not specified'}
-#         - Current Medications: {user.current_medications or 'Not specified'}
+        Patient's Medical History:
+        - Conditions: {user.medical_conditions or 'Not specified'}
+        - Allergies: {user.allergies or 'Not specified'}
+        - Current Medications: {user.current_medications or 'Not specified'}
         
-#         Latest MRI Scan Report (AI Analysis):
-#         {latest_scan_report}
+        Latest MRI Scan Report (AI Analysis):
+        {latest_scan_report}
         
-#         Based on this, generate a report with these sections:
-#         1.  **Understanding Your Recent Scan:** A simple explanation of the AI's findings.
-#         2.  **General Health & Lifestyle Recommendations:** Suggest general wellness tips (e.g., balanced diet, hydration, stress management) that are beneficial for neurological health.
-#         3.  **Important Reminders:** Advise the patient to always consult their doctor for diagnosis and treatment, and to follow their doctor's advice.
-#         """
-
-#         prompt2 = f"""
-#         As an AI assistant for a neurologist, create a clinical draft based on a patient's full scan history and latest MRI results.
-#         This draft is for the doctor to review, edit, and finalize.
+        Based on this, generate a report with these sections:
+        1.  **Understanding Your Recent Scan:** A simple explanation of the AI's findings.
+        2.  **General Health & Lifestyle Recommendations:** Suggest general wellness tips (e.g., balanced diet, hydration, stress management) that are beneficial for neurological health.
+        3.  **Important Reminders:** Advise the patient to always consult their doctor for diagnosis and treatment, and to follow their doctor's advice.
+        """
+
+        prompt2 = f"""
+        As an AI assistant for a neurologist, create a clinical draft based on a patient's full scan history and latest MRI results.
+        This draft is for the doctor to review, edit, and finalize.
         
-#         Patient's Scan History Summary:
-#         {scan_history_summary}
+        Patient's Scan History Summary:
+        {scan_history_summary}
         
-#         Latest MRI Scan Report (AI Analysis):
-#         {latest_scan_report}
+        Latest MRI Scan Report (AI Analysis):
+        {latest_scan_report}
         
-#         Based on this, draft a note with the following structure:
-#         1.  **Clinical Assessment:** Briefly summarize the findings and compare them with previous scans (e.g., "The mass in the right frontal lobe appears stable in size compared to the scan from 3 months ago.").
-#         2.  **Treatment Suggestions for Consideration:** Propose potential next steps based on common clinical guidelines (e.g., "Continue watchful waiting with a follow-up MRI in 6 months," or "Consider referral for surgical consultation given the slight increase in size.").
-#         3.  **Medication Considerations:** Mention any relevant medications or contraindications based on the patient's profile (e.g., "Patient is currently on [medication], which should be considered in any treatment plan.").
-#         """
-
-#         prompt3 = f"""
-#         Based on the following patient details, generate a concise one-paragraph medical summary.
-#         - Conditions: {user.medical_conditions or 'Not specified'}
-#         - Allergies: {user.allergies or 'Not specified'}
-#         - Current Medications: {user.current_medications or 'Not specified'}
-#         - Summary of symptoms from all scans: {'. '.join([s.symptoms_notes for s in all_scans if s.symptoms_notes])}
-#         """
-
-#         patient_report = ollama_processor.generate_response(prompt=prompt1, images=[all_scans[-1].image_path])
-#         treatment_draft = ollama_processor.generate_response(prompt=prompt2, images=[all_scans[-1].image_path])
-#         medical_summary = ollama_processor.generate_response(prompt=prompt3)
-
-#         return jsonify({
-#             'success': True,
-#             'user': user_to_json(user),
-#             'scans': scan_to_json(all_scans),
-#             'chart_data': chart_data,
-#             'medical_summary': medical_summary,
-#             'treatment_draft': treatment_draft,
-#             'patient_report': patient_report
-#         })
-
-#     except Exception as e:
-#         message = 'Error: ' + str(e)
-#         if is_ajax:
-#             return jsonify({'success': False, 'message': message}), 500
-#         else:
-#             flash(message)
-#             return redirect(url_for('app_page'))  
+        Based on this, draft a note with the following structure:
+        1.  **Clinical Assessment:** Briefly summarize the findings and compare them with previous scans (e.g., "The mass in the right frontal lobe appears stable in size compared to the scan from 3 months ago.").
+        2.  **Treatment Suggestions for Consideration:** Propose potential next steps based on common clinical guidelines (e.g., "Continue watchful waiting with a follow-up MRI in 6 months," or "Consider referral for surgical consultation given the slight increase in size.").
+        3.  **Medication Considerations:** Mention any relevant medications or contraindications based on the patient's profile (e.g., "Patient is currently on [medication], which should be considered in any treatment plan.").
+        """
 
-if __name__ == '__main__':
+        prompt3 = f"""
+        Based on the following patient details, generate a concise one-paragraph medical summary.
+        - Conditions: {user.medical_conditions or 'Not specified'}
+        - Allergies: {user.allergies or 'Not specified'}
+        - Current Medications: {user.current_medications or 'Not specified'}
+        - Summary of symptoms from all scans: {'. '.join([s.symptoms_notes for s in all_scans if s.symptoms_notes])}
+        """
+
+        # The three texts do not depend on each other; the page waits for the slowest, not for the sum.
+        generated = ollama_processor.generate_many({
+            'patient_report': (prompt1, [all_scans[-1].image_path]),
+            'treatment_draft': (prompt2, [all_scans[-1].image_path]),
+            'medical_summary': prompt3
+        }, use_cache=not cache_bypass_requested())
+
+        return jsonify({
+            'success': True,
+            'user': user_to_json(user),
+            'scans': scan_to_json(all_scans),
+            'chart_data': chart_data,
+            'medical_summary': generated['medical_summary']['response'],
+            'treatment_draft': generated['treatment_draft']['response'],
+            'patient_report': generated['patient_report']['response'],
+            'generation_ms': {name: result['latency_ms'] for name, result in generated.items()}
+        })
+
+    except LLMOverloaded as e:
+        return llm_overloaded_response(e)
+    except Exception as e:
+        message = 'Error: ' + str(e)
+        if is_ajax:
+            return jsonify({'success': False, 'message': message}), 500
+        else:
+            flash(message)
+            return redirect(url_for('app_page'))
+
+def start_background_services():
+    """
+    Model warm-up and the scan job workers. Call from one process of a WSGI deployment, live job
+    progress is only visible in the process running the job; `python app.py` does it on its own.
+    """
+    if app.config['YOLO_WARMUP']:
+        model_registry.current.start_warm_up(runs=app.config['YOLO_WARMUP_RUNS'])
     with app.app_context():
-        db.create_all()
-    app.run(debug=True)
\ No newline at end of file
+        recover_scan_jobs()
+    scan_job_workers.start()
+
+def migrate_database():
+    """Brings the database schema up to date (see migrations.py)."""
+    with app.app_context():
+        return migrate(db.engine, db.metadata)
+
+@app.cli.command('migrate-db')
+def migrate_database_command():
+    """Applies the pending schema migrations; run it before starting a WSGI deployment."""
+    applied = migrate_database()
+    print(f"Schema up to date, {len(applied)} migration(s) applied.")
+
+if __name__ == '__main__':
+    debug = True
+    migrate_database()
+    # With the debug reloader only the child process (WERKZEUG_RUN_MAIN) serves requests.
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        start_background_services()
+    app.run(debug=debug)
\ No newline at end of file
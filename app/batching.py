@@ -0,0 +1,84 @@
+# Micro-batching scheduler for model inference.
+# Concurrent callers submit single items, a background thread groups them
+# for a few milliseconds and runs one batched call for the whole group.
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class BatchScheduler:
+    """
+    Collects concurrent requests into batches and runs them with one call.
+
+    :param run_batch: Callable that receives a list of items and returns a list
+                      of results in the same order.
+    :param max_batch_size: Maximum number of items processed in one call.
+    :param max_wait_ms: How long the first item of a batch waits for company.
+    """
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=10, name='batch-scheduler'):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item) -> Future:
+        """Queues one item and returns a Future for its result."""
+        if self._stopped.is_set():
+            raise RuntimeError('Batch scheduler is stopped.')
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def __call__(self, item, timeout=None):
+        """Submits one item and blocks until its own result is ready."""
+        return self.submit(item).result(timeout=timeout)
+
+    def stop(self):
+        self._stopped.set()
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                self._stopped.set()
+                break
+            batch.append(entry)
+        return batch
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            batch = self._collect()
+            if not batch:
+                continue
+            # Callers may have given up (cancelled) while waiting in the queue.
+            batch = [(item, future) for item, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            items = [item for item, _ in batch]
+            try:
+                results = self.run_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f'Batch returned {len(results)} results for {len(items)} items.')
+            except Exception as e:
+                print(f"Batch inference error ({len(items)} items): {str(e)}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
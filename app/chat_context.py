@@ -0,0 +1,91 @@
+# Token-budgeted history for chat turns.
+# A conversation is sent as a running summary of its older turns plus the most recent turns
+# verbatim, as many as fit the token budget. Turns that fall out of the budget are folded into
+# the summary by a background thread; until that has finished the turn is answered with the summary
+# it already has, so building the context never waits for the model.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def estimate_tokens(text):
+    """About four characters per token for English text, plus the per-message overhead."""
+    return len(text) // 4 + 4 if text else 0
+
+
+def turn_tokens(turn):
+    return estimate_tokens(turn.user_message) + estimate_tokens(turn.ai_response)
+
+
+class ChatContext:
+    """
+    :param summarize: Callable (previous summary or None, [(user message, ai response), ...]) -> summary text.
+    :param load_summary: Callable (conversation id) -> (summary or None, id of the last summarized turn or 0).
+    :param store_summary: Callable (conversation id, summary, id of the last summarized turn).
+    :param token_budget: Tokens of history sent with a turn, the summary included.
+    :param min_recent_turns: Turns kept verbatim even when they exceed the budget.
+    """
+    def __init__(self, summarize, load_summary, store_summary, token_budget=3000, min_recent_turns=2):
+        self.summarize = summarize
+        self.load_summary = load_summary
+        self.store_summary = store_summary
+        self.token_budget = token_budget
+        self.min_recent_turns = min_recent_turns
+        self.refreshes = 0
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='chat-summary')
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def build(self, conversation_id, turns, prompt, role):
+        """
+        Returns the messages of a turn. turns are the stored turns of the conversation, oldest first,
+        with id, user_message and ai_response.
+        """
+        summary, summarized_id = self.load_summary(conversation_id)
+        unsummarized = [turn for turn in turns if turn.id > summarized_id]
+        budget = self.token_budget - estimate_tokens(summary)
+        recent = []
+        used = 0
+        for turn in reversed(unsummarized):
+            cost = turn_tokens(turn)
+            if len(recent) >= self.min_recent_turns and used + cost > budget:
+                break
+            recent.insert(0, turn)
+            used += cost
+        older = unsummarized[:len(unsummarized) - len(recent)]
+        if older:
+            self.refresh(conversation_id, summary, older)
+
+        messages = []
+        if summary:
+            messages.append({"role": "system", "content": "Summary of the earlier conversation with the patient: " + summary})
+        for turn in recent:
+            if turn.user_message:
+                messages.append({"role": "user", "content": turn.user_message})
+            if turn.ai_response:
+                messages.append({"role": "assistant", "content": turn.ai_response})
+        messages.append({"role": role, "content": prompt})
+        return messages
+
+    def refresh(self, conversation_id, summary, turns):
+        """Folds turns into the summary in the background, once at a time per conversation."""
+        with self._lock:
+            if conversation_id in self._pending:
+                return
+            self._pending.add(conversation_id)
+        pairs = [(turn.user_message, turn.ai_response) for turn in turns]
+        self._executor.submit(self._refresh, conversation_id, summary, pairs, turns[-1].id)
+
+    def _refresh(self, conversation_id, summary, pairs, last_turn_id):
+        try:
+            self.store_summary(conversation_id, self.summarize(summary, pairs), last_turn_id)
+            self.refreshes += 1
+        except Exception as e:
+            print(f"Chat summary of conversation {conversation_id} could not be refreshed: {e}")
+        finally:
+            with self._lock:
+                self._pending.discard(conversation_id)
+
+    def stats(self):
+        with self._lock:
+            return {'refreshes': self.refreshes, 'pending': len(self._pending)}
@@ -0,0 +1,118 @@
+# Derived images of stored scans.
+# The browser gets every scan image re-encoded for display plus a thumbnail. They are made once,
+# right after the scan is stored, and kept under the scan id next to a record of the source file
+# they were made from; a source that was replaced or rewritten since is derived again.
+
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+
+def source_stamp(path):
+    """Identity of a source file as of now: path, size and modification time."""
+    try:
+        stat = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+
+class DerivativeCache:
+    """
+    :param root: Directory of the derived files, one subdirectory per scan.
+    :param full_format: Format of the display image, WEBP (lossless) or PNG.
+    :param thumb_size: Longest side of the thumbnail in pixels.
+    :param thumb_quality: WebP quality of the thumbnail.
+    """
+    def __init__(self, root, full_format='WEBP', thumb_size=256, thumb_quality=80, workers=1):
+        self.root = root
+        self.full_format = full_format.upper()
+        self.thumb_size = thumb_size
+        self.thumb_quality = thumb_quality
+        self.generated = 0
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='derivatives')
+        os.makedirs(root, exist_ok=True)
+
+    def _lock(self, scan_id, kind):
+        with self._locks_lock:
+            return self._locks.setdefault((scan_id, kind), threading.Lock())
+
+    def path(self, scan_id, kind, variant='full'):
+        extension = self.full_format.lower() if variant == 'full' else 'webp'
+        return os.path.join(self.root, str(scan_id), f"{kind}_{variant}.{extension}")
+
+    def mime_type(self, variant='full'):
+        return f"image/{self.full_format.lower() if variant == 'full' else 'webp'}"
+
+    def _manifest_path(self, scan_id, kind):
+        return os.path.join(self.root, str(scan_id), f"{kind}.json")
+
+    def _is_current(self, scan_id, kind, stamp):
+        try:
+            with open(self._manifest_path(scan_id, kind)) as f:
+                return json.load(f).get('source') == stamp
+        except (OSError, ValueError):
+            return False
+
+    def ensure(self, scan_id, kind, source_path):
+        """
+        Makes sure the derived files of a scan image match its source, deriving them when missing
+        or stale. Returns False when the source does not exist (yet).
+        """
+        stamp = source_stamp(source_path)
+        if stamp is None:
+            return False
+        if self._is_current(scan_id, kind, stamp):
+            return True
+        with self._lock(scan_id, kind):
+            if self._is_current(scan_id, kind, stamp):
+                return True
+            os.makedirs(os.path.join(self.root, str(scan_id)), exist_ok=True)
+            with Image.open(source_path) as img:
+                img = img.convert('RGBA' if img.mode in ('RGBA', 'LA', 'P') else 'RGB')
+            self._write(self.path(scan_id, kind, 'full'), img, self.full_format, lossless=True)
+            img.thumbnail((self.thumb_size, self.thumb_size))
+            self._write(self.path(scan_id, kind, 'thumb'), img, 'WEBP', quality=self.thumb_quality)
+            # The manifest is written last; a crash in between leaves the old one, which no longer matches.
+            tmp_path = self._manifest_path(scan_id, kind) + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'source': stamp}, f)
+            os.replace(tmp_path, self._manifest_path(scan_id, kind))
+            self.generated += 1
+            return True
+
+    def _write(self, path, img, image_format, **options):
+        tmp_path = path + '.tmp'
+        if image_format == 'PNG':
+            img.save(tmp_path, format='PNG')
+        else:
+            img.save(tmp_path, format=image_format, **options)
+        os.replace(tmp_path, path)
+
+    def read(self, scan_id, kind, source_path, variant='full'):
+        """Returns (bytes, MIME type) of a derived image, or (None, None) without a source."""
+        try:
+            if not self.ensure(scan_id, kind, source_path):
+                return None, None
+            with open(self.path(scan_id, kind, variant), 'rb') as f:
+                return f.read(), self.mime_type(variant)
+        except Exception as e:
+            print(f"Could not derive {kind} image of scan {scan_id}: {e}")
+            return None, None
+
+    def generate_async(self, scan_id, sources: dict):
+        """Derives the images of a new scan in the background. sources maps kind to source path."""
+        for kind, source_path in sources.items():
+            if source_path:
+                self._executor.submit(self._generate, scan_id, kind, source_path)
+
+    def _generate(self, scan_id, kind, source_path):
+        try:
+            self.ensure(scan_id, kind, source_path)
+        except Exception as e:
+            print(f"Could not derive {kind} image of scan {scan_id}: {e}")
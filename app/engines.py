@@ -0,0 +1,234 @@
+# CPU inference engines for the segmentation model.
+# The .pt weights are exported once to the selected format, the artifact is kept
+# next to the weights and reused until the weights change.
+# Run this file directly to check an engine against the PyTorch results.
+
+import argparse
+import os
+
+import numpy as np
+
+# engine name -> (ultralytics export format, suffix of the exported artifact)
+ENGINES = {
+    'torch': (None, '.pt'),
+    'torchscript': ('torchscript', '.torchscript'),
+    'onnx': ('onnx', '.onnx'),
+    'openvino': ('openvino', '_openvino_model'),
+    'openvino-int8': ('openvino', '_int8_openvino_model'),  # built and gated by quantization.py
+}
+
+# TorchScript is traced with a fixed input shape, the others are exported with a dynamic batch axis.
+STATIC_BATCH_ENGINES = {'torchscript'}
+
+
+def model_imgsz(model, default=640):
+    """Returns the input size the weights were trained with."""
+    return model.overrides.get('imgsz', default)
+
+
+def exported_path(weights_path, engine):
+    """Returns where the exported artifact of an engine lives for the given weights."""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown inference engine '{engine}', expected one of {', '.join(ENGINES)}.")
+    stem, _ = os.path.splitext(weights_path)
+    return stem + ENGINES[engine][1]
+
+
+def export_engine(weights_path, engine):
+    """
+    Exports the weights to the engine format unless an up to date artifact already exists.
+    Returns the path of the artifact to load.
+    """
+    artifact = exported_path(weights_path, engine)
+    if engine == 'torch':
+        return weights_path
+    if engine == 'openvino-int8':
+        # Quantization needs calibration data, so it is never done implicitly here.
+        from quantization import check_gate
+        check_gate(weights_path)
+        if not os.path.exists(artifact):
+            raise RuntimeError(f"{artifact} is missing, run quantization.py first.")
+        return artifact
+    if os.path.exists(artifact) and os.path.getmtime(artifact) >= os.path.getmtime(weights_path):
+        return artifact
+
+    from ultralytics import YOLO
+
+    export_format = ENGINES[engine][0]
+    model = YOLO(weights_path)
+    print(f"Exporting {os.path.basename(weights_path)} to {engine}, this only happens once per weights file...")
+    exported = model.export(
+        format=export_format,
+        imgsz=model_imgsz(model),
+        device='cpu',
+        half=False,
+        dynamic=engine not in STATIC_BATCH_ENGINES
+    )
+    if os.path.abspath(str(exported)) != os.path.abspath(artifact):
+        os.replace(str(exported), artifact)
+    return artifact
+
+
+def load_engine(weights_path, engine='torch', threads=None):
+    """
+    Loads the segmentation model through the selected engine.
+    threads limits the intra-op threads of the engine, for processes that share the CPU with others.
+    """
+    from ultralytics import YOLO
+
+    artifact = export_engine(weights_path, engine)
+    model = YOLO(artifact, task='segment')
+    if threads:
+        limit_threads(model, weights_path, engine, threads)
+    return model
+
+
+def limit_threads(model, weights_path, engine, threads):
+    """
+    Pins the thread count of every runtime the engine uses. ONNX Runtime and OpenVINO size their
+    pools by the cores of the machine and ultralytics does not expose the setting, so their session
+    is rebuilt with the limit once ultralytics has created it on a first prediction.
+    """
+    import torch
+    from ultralytics import YOLO
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # already fixed by an earlier parallel call
+    if engine not in ('onnx', 'openvino', 'openvino-int8'):
+        return
+
+    imgsz = model_imgsz(YOLO(weights_path))
+    model.predict(source=np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+    backend = model.predictor.model
+    if engine == 'onnx' and getattr(backend, 'session', None) is not None and getattr(backend, 'dynamic', False):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        backend.session = onnxruntime.InferenceSession(exported_path(weights_path, engine), options,
+                                                       providers=backend.session.get_providers())
+    elif engine != 'onnx' and getattr(backend, 'ov_compiled_model', None) is not None:
+        backend.ov_compiled_model = backend.core.compile_model(
+            backend.ov_model, device_name='CPU',
+            config={'PERFORMANCE_HINT': getattr(backend, 'inference_mode', 'LATENCY'), 'INFERENCE_NUM_THREADS': threads}
+        )
+    else:
+        print(f"Could not limit the threads of the {engine} engine, it uses all cores.")
+
+
+def _box_iou(a, b):
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def _mask_iou(a, b):
+    a = a.reshape(a.shape[0], -1).astype(bool)
+    b = b.reshape(b.shape[0], -1).astype(bool)
+    inter = a.astype(np.float32) @ b.astype(np.float32).T
+    union = a.sum(1)[:, None] + b.sum(1)[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1), 1.0)
+
+
+def compare_results(reference, candidate):
+    """
+    Compares two Results of the same image.
+    Returns the number of detections of each, and the worst box IoU, mask IoU and confidence delta
+    over the reference detections (each matched to the best candidate of the same class).
+    """
+    ref_boxes = reference.boxes.xyxy.cpu().numpy()
+    cand_boxes = candidate.boxes.xyxy.cpu().numpy()
+    report = {
+        'reference_detections': len(ref_boxes),
+        'candidate_detections': len(cand_boxes),
+        'min_box_iou': 1.0,
+        'min_mask_iou': 1.0,
+        'max_conf_delta': 0.0
+    }
+    if not len(ref_boxes) or not len(cand_boxes):
+        if len(ref_boxes) != len(cand_boxes):
+            report['min_box_iou'] = report['min_mask_iou'] = 0.0
+        return report
+
+    same_class = reference.boxes.cls.cpu().numpy()[:, None] == candidate.boxes.cls.cpu().numpy()[None, :]
+    box_iou = np.where(same_class, _box_iou(ref_boxes, cand_boxes), 0.0)
+    match = box_iou.argmax(1)
+    rows = np.arange(len(ref_boxes))
+    report['min_box_iou'] = float(box_iou[rows, match].min())
+
+    ref_conf = reference.boxes.conf.cpu().numpy()
+    cand_conf = candidate.boxes.conf.cpu().numpy()
+    report['max_conf_delta'] = float(np.abs(ref_conf - cand_conf[match]).max())
+
+    if reference.masks is not None and candidate.masks is not None:
+        mask_iou = _mask_iou(reference.masks.data.cpu().numpy(), candidate.masks.data.cpu().numpy())
+        report['min_mask_iou'] = float(mask_iou[rows, match].min())
+    elif reference.masks is not None or candidate.masks is not None:
+        report['min_mask_iou'] = 0.0
+    return report
+
+
+def check_parity(weights_path, engine, sources, conf=0.5, iou=0.7, min_box_iou=0.95, min_mask_iou=0.9, max_conf_delta=0.05):
+    """
+    Runs the PyTorch weights and the engine on the same images and checks that the outputs agree.
+    Returns a dict with one report per image and an overall 'passed' flag.
+    """
+    from ultralytics import YOLO
+
+    reference_model = YOLO(weights_path)
+    engine_model = load_engine(weights_path, engine)
+    imgsz = model_imgsz(reference_model)
+
+    reports = []
+    for source in sources:
+        reference = reference_model.predict(source=source, conf=conf, iou=iou, imgsz=imgsz, retina_masks=True, verbose=False)[0]
+        candidate = engine_model.predict(source=source, conf=conf, iou=iou, imgsz=imgsz, retina_masks=True, verbose=False)[0]
+        report = compare_results(reference, candidate)
+        report['source'] = str(source)
+        report['passed'] = (
+            report['reference_detections'] == report['candidate_detections']
+            and report['min_box_iou'] >= min_box_iou
+            and report['min_mask_iou'] >= min_mask_iou
+            and report['max_conf_delta'] <= max_conf_delta
+        )
+        reports.append(report)
+
+    return {
+        'engine': engine,
+        'images': len(reports),
+        'passed': all(r['passed'] for r in reports),
+        'reports': reports
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the segmentation model to a CPU engine and check it against PyTorch.')
+    parser.add_argument('--weights', default=os.path.join('models', 'yolov11-seg-brain.pt'))
+    parser.add_argument('--engine', default='onnx', choices=[e for e in ENGINES if e not in ('torch', 'openvino-int8')])
+    parser.add_argument('--source', default='uploads', help='Image file or directory of images to compare on.')
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        sources = sorted(os.path.join(args.source, f) for f in os.listdir(args.source) if not f.startswith('.'))
+    else:
+        sources = [args.source]
+
+    result = check_parity(args.weights, args.engine, sources)
+    for report in result['reports']:
+        status = 'OK  ' if report['passed'] else 'FAIL'
+        print(f"{status} {report['source']}: detections {report['reference_detections']}/{report['candidate_detections']}, "
+              f"box IoU {report['min_box_iou']:.3f}, mask IoU {report['min_mask_iou']:.3f}, conf delta {report['max_conf_delta']:.3f}")
+    print(f"\n{result['engine']} parity {'passed' if result['passed'] else 'FAILED'} on {result['images']} images.")
+
+
+if __name__ == "__main__":
+    main()
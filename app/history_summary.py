@@ -0,0 +1,68 @@
+# Rolling per-patient scan history used in the LLM prompts.
+# The state is updated one scan at a time: the most recent scans are kept as prompt lines,
+# older ones are folded into a single aggregate line, so the summary stays bounded however
+# long the patient's history gets.
+
+import json
+
+NO_HISTORY = "The patient has no prior medical scan history in the database."
+
+
+def new_history_state():
+    return {
+        'scan_count': 0,
+        'recent': [],
+        'earlier': {'count': 0, 'first_date': None, 'last_date': None, 'types': {}}
+    }
+
+
+def format_scan_line(scan_id, scan_date, scan_type, symptoms_notes, yolo_diagnosis):
+    """One prompt line per scan, same wording as OllamaProcessor.generate_history_summary."""
+    return (f"- Scan ID {scan_id} on {scan_date.strftime('%Y-%m-%d')}, type: {scan_type}. Notes: '{symptoms_notes}'. "
+            f"YOLOv11 segmentation custome brain tumor detection notes: {yolo_diagnosis}")
+
+
+def add_scan(state, scan_id, scan_date, scan_type, symptoms_notes, yolo_diagnosis, max_recent=10):
+    """Appends a scan to the state and folds the oldest listed scans into the aggregate."""
+    state['scan_count'] += 1
+    state['recent'].append({
+        'date': scan_date.strftime('%Y-%m-%d'),
+        'type': scan_type,
+        'line': format_scan_line(scan_id, scan_date, scan_type, symptoms_notes, yolo_diagnosis)
+    })
+    while len(state['recent']) > max(1, max_recent):
+        oldest = state['recent'].pop(0)
+        earlier = state['earlier']
+        earlier['count'] += 1
+        earlier['first_date'] = min(filter(None, [earlier['first_date'], oldest['date']]))
+        earlier['last_date'] = max(filter(None, [earlier['last_date'], oldest['date']]))
+        earlier['types'][oldest['type']] = earlier['types'].get(oldest['type'], 0) + 1
+    return state
+
+
+def render_summary(state):
+    """The whole history as prompt text."""
+    if not state['scan_count']:
+        return NO_HISTORY
+    lines = ["Patient's previous medical scan history:"]
+    earlier = state['earlier']
+    if earlier['count']:
+        types = ', '.join(f"{scan_type} x{count}" for scan_type, count in sorted(earlier['types'].items()))
+        lines.append(f"- {earlier['count']} earlier scans from {earlier['first_date']} to {earlier['last_date']} ({types}), not listed individually.")
+    lines += [scan['line'] for scan in state['recent']]
+    return "\n".join(lines)
+
+
+def render_latest(state):
+    """Only the most recent scan as prompt text."""
+    if not state['recent']:
+        return NO_HISTORY
+    return "Patient's previous medical scan history:\n" + state['recent'][-1]['line']
+
+
+def dump_state(state):
+    return json.dumps(state)
+
+
+def load_state(text):
+    return json.loads(text) if text else new_history_state()
@@ -0,0 +1,78 @@
+# Decode-once ingest of uploaded scans.
+# The upload is decoded a single time into a NumPy array; the model, the PNG/JPEG
+# encoders for the browser and the LLM, and the inference cache all read from it.
+
+import base64
+import hashlib
+import io
+import threading
+
+import numpy as np
+from PIL import Image
+
+from mask_metrics import pixel_spacing_from_image
+
+
+class IngestedImage:
+    """
+    An uploaded image decoded once.
+
+    :param data: Raw bytes of the uploaded file, as saved to disk.
+    :param path: Where the raw bytes are stored, if anywhere.
+    """
+    def __init__(self, data: bytes, path=None):
+        self.data = data
+        self.path = path
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            self.pixel_spacing = pixel_spacing_from_image(img)
+            self.rgb = np.asarray(img.convert('RGB'))
+        self._bgr = None
+        self._digest = None
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_path(cls, path):
+        with open(path, 'rb') as f:
+            return cls(f.read(), path)
+
+    @classmethod
+    def from_upload(cls, file_storage, path):
+        """Reads a werkzeug upload once, writes the bytes to path and decodes them."""
+        data = file_storage.read()
+        with open(path, 'wb') as f:
+            f.write(data)
+        return cls(data, path)
+
+    @property
+    def bgr(self):
+        """Channel order expected by OpenCV and ultralytics."""
+        if self._bgr is None:
+            self._bgr = np.ascontiguousarray(self.rgb[..., ::-1])
+        return self._bgr
+
+    @property
+    def digest(self):
+        """sha256 of the raw upload bytes."""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    def encode(self, target_format='PNG', max_size=None):
+        """Encodes the decoded pixels once per format/size and returns the bytes."""
+        key = (target_format.upper(), max_size)
+        with self._lock:
+            if key not in self._encoded:
+                img = Image.fromarray(self.rgb)
+                if max_size:
+                    img.thumbnail((max_size, max_size))
+                buffer = io.BytesIO()
+                img.save(buffer, format=key[0])
+                self._encoded[key] = buffer.getvalue()
+            return self._encoded[key]
+
+    def to_base64(self, target_format='PNG', max_size=None):
+        """Returns (base64 string, MIME type) of the encoded image."""
+        encoded = self.encode(target_format, max_size)
+        return base64.b64encode(encoded).decode('utf-8'), f"image/{target_format.lower()}"
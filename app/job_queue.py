@@ -0,0 +1,133 @@
+# Background workers for jobs stored in the database.
+# The database row is the queue: workers claim queued rows, so jobs outlive the process
+# and are picked up again after a restart. Live progress that is not worth a write
+# (the report text as it is generated) is kept in memory next to the workers, as are inputs
+# handed over by the request that queued a job (the decoded upload); a job run elsewhere or
+# after a restart finds none and reads its input from the row.
+
+import threading
+from collections import OrderedDict
+
+
+class JobWorkers:
+    """
+    :param claim: Callable () -> job id of a job it marked as started, or None when the queue is empty.
+    :param run: Callable (job id) -> None that runs one claimed job to completion.
+    :param workers: Number of worker threads.
+    :param poll_interval: Seconds between looks at the queue when nobody calls notify().
+    :param context: Optional callable returning a context manager every claim and run executes in.
+    :param heartbeat: Optional callable ([job ids]) -> None, called every heartbeat_interval seconds with
+                      the jobs running here so other processes can tell they are still alive.
+    :param max_attached: Jobs whose attached input is kept, the oldest is dropped beyond it.
+    """
+    def __init__(self, claim, run, workers=2, poll_interval=2.0, context=None, name='job-worker',
+                 heartbeat=None, heartbeat_interval=10.0, max_attached=16):
+        self.claim = claim
+        self.run = run
+        self.workers = max(1, int(workers))
+        self.poll_interval = poll_interval
+        self.context = context
+        self.name = name
+        self.heartbeat = heartbeat
+        self.heartbeat_interval = heartbeat_interval
+        self.threads = []
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self.max_attached = max_attached
+        self._progress = {}
+        self._attached = OrderedDict()
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.threads:
+            return self
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f'{self.name}-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        if self.heartbeat is not None:
+            thread = threading.Thread(target=self._heartbeat_loop, name=f'{self.name}-heartbeat', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        return self
+
+    def notify(self):
+        """Wakes an idle worker after a job was queued."""
+        self._wake.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        for thread in self.threads:
+            thread.join(timeout=5)
+
+    def _loop(self):
+        while not self._stopped.is_set():
+            try:
+                job_id = self._call(self.claim)
+            except Exception as e:
+                print(f"{self.name} could not claim a job: {e}")
+                job_id = None
+            if job_id is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            with self._lock:
+                self._running.add(job_id)
+            try:
+                self._call(self.run, job_id)
+            except Exception as e:
+                print(f"{self.name} failed on job {job_id}: {e}")
+            finally:
+                with self._lock:
+                    self._running.discard(job_id)
+                    self._attached.pop(job_id, None)
+                self.clear_progress(job_id)
+
+    def _heartbeat_loop(self):
+        while not self._stopped.wait(self.heartbeat_interval):
+            with self._lock:
+                running = list(self._running)
+            if not running:
+                continue
+            try:
+                self._call(self.heartbeat, running)
+            except Exception as e:
+                print(f"{self.name} could not record its heartbeat: {e}")
+
+    def _call(self, fn, *args):
+        if self.context is None:
+            return fn(*args)
+        with self.context():
+            return fn(*args)
+
+    def attach(self, job_id, value):
+        """Hands an in-memory input to a queued job, call it before the job can be claimed."""
+        with self._lock:
+            self._attached[job_id] = value
+            while len(self._attached) > self.max_attached:
+                self._attached.popitem(last=False)
+
+    def take(self, job_id):
+        """The input attached to a job, None when there is none in this process."""
+        with self._lock:
+            return self._attached.pop(job_id, None)
+
+    def set_progress(self, job_id, **values):
+        with self._lock:
+            self._progress.setdefault(job_id, {'tokens': []}).update(values)
+
+    def add_token(self, job_id, token):
+        with self._lock:
+            self._progress.setdefault(job_id, {'tokens': []})['tokens'].append(token)
+
+    def progress(self, job_id):
+        """Returns a copy of the live progress of a running job, empty when it is not running here."""
+        with self._lock:
+            progress = self._progress.get(job_id, {'tokens': []})
+            return dict(progress, tokens=list(progress['tokens']))
+
+    def clear_progress(self, job_id):
+        with self._lock:
+            self._progress.pop(job_id, None)
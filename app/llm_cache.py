@@ -0,0 +1,108 @@
+# Response cache for LLM calls.
+# A call is keyed on the model, the prompt (or chat messages) with whitespace normalized and
+# the digests of the attached images, so the same scan analyzed again is answered from disk.
+# Entries live in a local SQLite file with a time to live and a size bound, least recently
+# used entries are evicted first.
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+def normalize_text(text):
+    """Collapses whitespace, the indentation of the prompt templates is not part of the prompt."""
+    return ' '.join(str(text).split()) if text is not None else None
+
+
+def make_llm_cache_key(payload: dict) -> str:
+    """Builds the cache key of an Ollama /api/generate or /api/chat payload."""
+    def image_digests(images):
+        return [hashlib.sha256(image.encode('ascii') if isinstance(image, str) else image).hexdigest() for image in images or []]
+
+    normalized = {
+        'model': payload.get('model'),
+        'prompt': normalize_text(payload.get('prompt')),
+        'images': image_digests(payload.get('images')),
+        'messages': [
+            {'role': m.get('role'), 'content': normalize_text(m.get('content')), 'images': image_digests(m.get('images'))}
+            for m in payload.get('messages') or []
+        ],
+        # A continued conversation answers differently depending on the context it continues.
+        'context': hashlib.sha256(json.dumps(payload['context']).encode('utf-8')).hexdigest() if payload.get('context') else None,
+        'options': payload.get('options'),
+        'format': payload.get('format')
+    }
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    :param path: SQLite file of the cache.
+    :param ttl_seconds: Entries older than this are never returned.
+    :param max_bytes: Total size of the stored responses.
+    :param max_entries: Number of stored responses.
+    """
+    def __init__(self, path, ttl_seconds=7 * 24 * 3600, max_bytes=64 * 1024 * 1024, max_entries=10000):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, created REAL NOT NULL, used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_used ON responses (used)")
+        self._db.commit()
+
+    def get(self, key):
+        """Returns the cached response text or None."""
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] + self.ttl_seconds < now:
+                if row is not None:
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE responses SET used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        size = len(response.encode('utf-8'))
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, used) VALUES (?, ?, ?, ?, ?)",
+                (key, response, size, now, now)
+            )
+            self._evict(now)
+            self._db.commit()
+
+    def _evict(self, now):
+        self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+        count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY used").fetchall():
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+            count -= 1
+            total -= size
+
+    def stats(self):
+        with self._lock:
+            count, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {'entries': count, 'bytes': total, 'hits': self.hits, 'misses': self.misses}
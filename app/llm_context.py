@@ -0,0 +1,75 @@
+# Ollama context reuse for scan conversations.
+# /api/generate returns the token state of the conversation as `context`; sending it back with
+# the next prompt continues from there instead of prefilling the whole transcript again. The
+# state of a scan conversation starts with its diagnosis and is replaced after every turn. It is
+# only used while it is current: same model, and no turn was stored since it was taken.
+
+import threading
+from collections import OrderedDict
+
+
+class ConversationContexts:
+    """
+    In-memory LRU of conversation token states.
+
+    :param max_entries: Conversations kept.
+    :param max_tokens: Total tokens of all kept states.
+    :param max_context_tokens: Longer states are not kept, the model would truncate them anyway.
+    """
+    def __init__(self, max_entries=256, max_tokens=4 * 1024 * 1024, max_context_tokens=8192):
+        self.max_entries = max_entries
+        self.max_tokens = max_tokens
+        self.max_context_tokens = max_context_tokens
+        self.hits = 0
+        self.misses = 0
+        self._states = OrderedDict()  # conversation id -> (model, last turn id, context)
+        self._tokens = 0
+        self._lock = threading.Lock()
+
+    def get(self, conversation_id, model, last_turn_id):
+        """The context continuing the conversation after last_turn_id (None before the first turn), or None."""
+        with self._lock:
+            state = self._states.get(conversation_id)
+            if state is None or state[0] != model or state[1] != last_turn_id:
+                if state is not None:
+                    self._drop(conversation_id)
+                self.misses += 1
+                return None
+            self._states.move_to_end(conversation_id)
+            self.hits += 1
+            return state[2]
+
+    def put(self, conversation_id, model, last_turn_id, context):
+        with self._lock:
+            if conversation_id in self._states:
+                self._drop(conversation_id)
+            if not context or len(context) > self.max_context_tokens:
+                return
+            self._states[conversation_id] = (model, last_turn_id, list(context))
+            self._tokens += len(context)
+            while self._states and (len(self._states) > self.max_entries or self._tokens > self.max_tokens):
+                self._drop(next(iter(self._states)))
+
+    def advance(self, conversation_id, model, from_turn_id, to_turn_id):
+        """
+        Moves a current state taken after from_turn_id to to_turn_id, for a turn stored without a
+        generation of its own in the conversation, e.g. the first chat message of a scan.
+        """
+        with self._lock:
+            state = self._states.get(conversation_id)
+            if state is not None and state[0] == model and state[1] == from_turn_id:
+                self._states[conversation_id] = (model, to_turn_id, state[2])
+
+    def invalidate(self, conversation_id=None):
+        """Forgets one conversation, or all of them when the model changes."""
+        with self._lock:
+            for key in [conversation_id] if conversation_id is not None else list(self._states):
+                if key in self._states:
+                    self._drop(key)
+
+    def _drop(self, conversation_id):
+        self._tokens -= len(self._states.pop(conversation_id)[2])
+
+    def stats(self):
+        with self._lock:
+            return {'conversations': len(self._states), 'tokens': self._tokens, 'hits': self.hits, 'misses': self.misses}
@@ -0,0 +1,115 @@
+# Image preparation for multimodal LLM requests.
+# The vision encoder of the model works at a fixed resolution, anything larger is downscaled by
+# Ollama anyway after it was base64 encoded, sent and decoded. Images are resized to that
+# resolution here and encoded compactly (grayscale scans as single channel JPEG), and the
+# result is kept on disk under the digest of the source so retries and re-analyses of the same
+# scan reuse it.
+
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image
+
+
+def compact_image(data: bytes, size=896, target_format='JPEG', quality=90, gray_tolerance=8) -> bytes:
+    """Fits the image into size x size pixels and encodes it, single channel when it has no color."""
+    with Image.open(io.BytesIO(data)) as img:
+        img = img.convert('RGB')
+    if max(img.size) > size:
+        img.thumbnail((size, size), Image.LANCZOS)
+    pixels = np.asarray(img, dtype=np.int16)
+    # MRI slices are gray; a small tolerance absorbs the chroma noise of JPEG sources.
+    if np.abs(pixels - pixels.mean(axis=2, keepdims=True)).max() <= gray_tolerance:
+        img = img.convert('L')
+    buffer = io.BytesIO()
+    if target_format.upper() in ('JPEG', 'JPG'):
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    else:
+        img.save(buffer, format=target_format.upper())
+    return buffer.getvalue()
+
+
+class LLMImageCache:
+    """
+    Prepared LLM images, keyed on the source bytes and the preparation settings.
+
+    :param cache_dir: Directory of the prepared files.
+    :param size: Longest side in pixels, the vision encoder's input resolution.
+    :param target_format: JPEG or PNG.
+    :param quality: JPEG quality.
+    :param max_bytes: Size bound of the directory, oldest files are removed first.
+    :param memory_items: Prepared images also kept in memory.
+    """
+    def __init__(self, cache_dir, size=896, target_format='JPEG', quality=90, max_bytes=256 * 1024 * 1024, memory_items=64):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.target_format = target_format.upper()
+        self.quality = quality
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self.hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, data: bytes):
+        settings = f"{self.size}|{self.target_format}|{self.quality}"
+        return hashlib.sha256(hashlib.sha256(data).digest() + settings.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ('.jpg' if self.target_format in ('JPEG', 'JPG') else '.' + self.target_format.lower()))
+
+    def prepare(self, data: bytes) -> bytes:
+        """Returns the compact encoding of an image given as its file bytes."""
+        key = self.key(data)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return self._memory[key]
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                prepared = f.read()
+            self.hits += 1
+        except FileNotFoundError:
+            prepared = compact_image(data, self.size, self.target_format, self.quality)
+            self.misses += 1
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(prepared)
+            os.replace(tmp_path, path)
+            self._evict()
+        with self._lock:
+            self._memory[key] = prepared
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+        return prepared
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.tmp'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'memory_items': len(self._memory)}
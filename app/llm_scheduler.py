@@ -0,0 +1,134 @@
+# Admission control for LLM calls.
+# Every call runs in a slot of a traffic class (interactive chat, scan reports, background
+# jobs). Classes have their own concurrency limit inside a global one, waiting calls are
+# served by class priority, and a class whose queue is full rejects new calls with a
+# retry-after hint instead of letting them pile up behind the model. A class can reserve
+# global slots that no other class may take, so it is never starved by the others.
+
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class LLMOverloaded(Exception):
+    """
+    Raised when a call is not admitted, because the queue of its class is full or because it
+    waited longer than the class timeout (timed_out); retry_after is a hint in seconds.
+    """
+    def __init__(self, llm_class, retry_after, timed_out=False):
+        if timed_out:
+            message = f"LLM call of '{llm_class}' found no free slot in time, retry in {retry_after}s."
+        else:
+            message = f"LLM queue for '{llm_class}' is full, retry in {retry_after}s."
+        super().__init__(message)
+        self.llm_class = llm_class
+        self.retry_after = retry_after
+        self.timed_out = timed_out
+
+
+class LLMScheduler:
+    """
+    :param max_concurrency: Calls running at once over all classes.
+    :param classes: {name: {'priority': lower runs first, 'limit': running calls,
+                     'max_queue': waiting calls or None for unbounded, 'timeout': max seconds waiting or None,
+                     'reserved': global slots only this class may take, default 0}}
+    """
+    def __init__(self, max_concurrency, classes):
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.classes = classes
+        self.reserved = {name: int(config.get('reserved', 0)) for name, config in classes.items()}
+        for name, reserved in self.reserved.items():
+            if reserved > classes[name]['limit']:
+                raise ValueError(f"LLM class '{name}' reserves {reserved} slots but may only run {classes[name]['limit']}.")
+        if sum(self.reserved.values()) >= self.max_concurrency:
+            raise ValueError(f"LLM classes reserve {sum(self.reserved.values())} of {self.max_concurrency} slots, "
+                             "at least one must stay shared.")
+        self.running = {name: 0 for name in classes}
+        self.waiting = {name: 0 for name in classes}
+        self.rejected = {name: 0 for name in classes}
+        self.wait_ms = {name: deque(maxlen=500) for name in classes}
+        self.hold_s = {name: deque(maxlen=100) for name in classes}
+        self._queue = []  # heap of (priority, sequence, class)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+    def _retry_after(self, llm_class):
+        """Seconds until a queued call of the class would likely start."""
+        holds = self.hold_s[llm_class]
+        mean_hold = sum(holds) / len(holds) if holds else 10.0
+        limit = max(1, self.classes[llm_class]['limit'])
+        return max(1, math.ceil(mean_hold * (self.waiting[llm_class] + 1) / limit))
+
+    def admit(self, llm_class):
+        """Raises LLMOverloaded when the class's queue is full, so a request can be turned away before any work."""
+        with self._cond:
+            max_queue = self.classes[llm_class].get('max_queue')
+            if max_queue is not None and self.waiting[llm_class] >= max_queue:
+                self.rejected[llm_class] += 1
+                raise LLMOverloaded(llm_class, self._retry_after(llm_class))
+
+    def _has_room(self, llm_class):
+        if self.running[llm_class] >= self.classes[llm_class]['limit']:
+            return False
+        # Reserved slots other classes are not using are not free for this one.
+        held_back = sum(max(0, reserved - self.running[name]) for name, reserved in self.reserved.items() if name != llm_class)
+        return sum(self.running.values()) + held_back < self.max_concurrency
+
+    def _can_start(self, entry):
+        # The first waiter in priority order whose class has room goes first.
+        for queued in sorted(self._queue):
+            if self._has_room(queued[2]):
+                return queued == entry
+        return False
+
+    @contextmanager
+    def slot(self, llm_class):
+        """Waits for a slot of the class and holds it for the duration of the block."""
+        self.admit(llm_class)
+        config = self.classes[llm_class]
+        entry = (config['priority'], next(self._sequence), llm_class)
+        started = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._queue, entry)
+            self.waiting[llm_class] += 1
+            try:
+                while not self._can_start(entry):
+                    remaining = None if config.get('timeout') is None else config['timeout'] - (time.monotonic() - started)
+                    if remaining is not None and remaining <= 0:
+                        self.rejected[llm_class] += 1
+                        raise LLMOverloaded(llm_class, self._retry_after(llm_class), timed_out=True)
+                    self._cond.wait(remaining)
+            finally:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+                self.waiting[llm_class] -= 1
+                self._cond.notify_all()
+            self.running[llm_class] += 1
+            self.wait_ms[llm_class].append((time.monotonic() - started) * 1000)
+
+        acquired = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self.running[llm_class] -= 1
+                self.hold_s[llm_class].append(time.monotonic() - acquired)
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            stats = {}
+            for name in self.classes:
+                waits = sorted(self.wait_ms[name])
+                stats[name] = {
+                    'running': self.running[name],
+                    'waiting': self.waiting[name],
+                    'rejected': self.rejected[name],
+                    'wait_p50_ms': round(waits[len(waits) // 2], 1) if waits else None,
+                    'wait_p95_ms': round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 1) if waits else None
+                }
+            return stats
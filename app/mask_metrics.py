@@ -0,0 +1,116 @@
+# Geometry of the segmentation masks returned by the YOLO model.
+# All instances of a slice are measured together with array operations,
+# so this is cheap enough to run on every request.
+
+import numpy as np
+from PIL import Image
+
+# Used when the image carries no physical resolution: the old assumption of a
+# slice covering a 30 cm field of view, whatever its size in pixels.
+DEFAULT_FIELD_OF_VIEW_MM = 300.0
+
+# TIFF ResolutionUnit values
+_RESOLUTION_UNIT_MM = {2: 25.4, 3: 10.0}  # inch, centimeter
+# Image editors stamp these on everything, they do not describe the acquisition.
+_PLACEHOLDER_DPI = {72.0, 96.0}
+
+_TIFF_X_RESOLUTION = 282
+_TIFF_Y_RESOLUTION = 283
+_TIFF_RESOLUTION_UNIT = 296
+
+
+def default_pixel_spacing(height, width):
+    """(row_mm, col_mm) of a height x width px image spanning the default field of view."""
+    return DEFAULT_FIELD_OF_VIEW_MM / max(height, 1), DEFAULT_FIELD_OF_VIEW_MM / max(width, 1)
+
+
+def pixel_spacing_from_image(image):
+    """
+    Reads the pixel spacing (row_mm, col_mm) from TIFF resolution tags.
+    Accepts a path or an open PIL image. Returns None when the image carries no usable spacing.
+    """
+    try:
+        img = Image.open(image) if isinstance(image, str) else image
+        tags = getattr(img, 'tag_v2', None)
+        if not tags:
+            return None
+        x_res = float(tags.get(_TIFF_X_RESOLUTION, 0) or 0)
+        y_res = float(tags.get(_TIFF_Y_RESOLUTION, 0) or 0)
+        unit_mm = _RESOLUTION_UNIT_MM.get(tags.get(_TIFF_RESOLUTION_UNIT, 2))
+        if not x_res or not y_res or unit_mm is None:
+            return None
+        if unit_mm == 25.4 and x_res in _PLACEHOLDER_DPI and y_res in _PLACEHOLDER_DPI:
+            return None
+        return unit_mm / y_res, unit_mm / x_res
+    except Exception as e:
+        print(f"Could not read pixel spacing from image: {e}")
+        return None
+
+
+def compute_mask_metrics(masks, pixel_spacing=None):
+    """
+    Measures every instance mask of one image.
+
+    :param masks: (N, H, W) array of binary masks at image resolution.
+    :param pixel_spacing: (row_mm, col_mm), defaults to a 30 cm field of view over the mask size.
+    :return: dict with the union area of all instances and a list of per-instance stats
+             (area, centroid, bounding box, extent and perimeter).
+    """
+    m = np.asarray(masks).astype(bool, copy=False)
+    if m.ndim == 2:
+        m = m[None]
+    if m.ndim != 3:
+        m = np.zeros((0, 0, 0), dtype=bool)
+    count, height, width = m.shape
+    row_mm, col_mm = pixel_spacing or default_pixel_spacing(height, width)
+    pixel_mm2 = row_mm * col_mm
+
+    metrics = {
+        'count': int(count),
+        'image_shape': [int(height), int(width)],
+        'pixel_spacing_mm': [float(row_mm), float(col_mm)],
+        'total_area_px': 0,
+        'total_area_mm2': 0.0,
+        'total_area_cm2': 0.0,
+        'instances': []
+    }
+    if not count:
+        return metrics
+
+    row_counts = m.sum(axis=2)  # (N, H) pixels per row
+    col_counts = m.sum(axis=1)  # (N, W) pixels per column
+    area = row_counts.sum(axis=1)
+    safe_area = np.maximum(area, 1)
+    centroid_y = row_counts @ np.arange(height) / safe_area
+    centroid_x = col_counts @ np.arange(width) / safe_area
+
+    rows_any = row_counts > 0
+    cols_any = col_counts > 0
+    y1 = rows_any.argmax(axis=1)
+    y2 = height - 1 - rows_any[:, ::-1].argmax(axis=1)
+    x1 = cols_any.argmax(axis=1)
+    x2 = width - 1 - cols_any[:, ::-1].argmax(axis=1)
+
+    # Pixel-edge perimeter: every mask/background transition (image border included)
+    # contributes one pixel side of the corresponding length.
+    vertical_edges = (m[:, :, 1:] != m[:, :, :-1]).sum(axis=(1, 2)) + m[:, :, 0].sum(axis=1) + m[:, :, -1].sum(axis=1)
+    horizontal_edges = (m[:, 1:, :] != m[:, :-1, :]).sum(axis=(1, 2)) + m[:, 0, :].sum(axis=1) + m[:, -1, :].sum(axis=1)
+    perimeter_mm = vertical_edges * row_mm + horizontal_edges * col_mm
+
+    total_area_px = int(m.any(axis=0).sum())
+    metrics['total_area_px'] = total_area_px
+    metrics['total_area_mm2'] = total_area_px * pixel_mm2
+    metrics['total_area_cm2'] = total_area_px * pixel_mm2 / 100.0
+
+    for i in range(count):
+        empty = area[i] == 0
+        metrics['instances'].append({
+            'area_px': int(area[i]),
+            'area_mm2': float(area[i] * pixel_mm2),
+            'area_cm2': float(area[i] * pixel_mm2 / 100.0),
+            'centroid_px': [float(centroid_x[i]), float(centroid_y[i])],
+            'bbox_px': None if empty else [int(x1[i]), int(y1[i]), int(x2[i]), int(y2[i])],
+            'extent_mm': [0.0, 0.0] if empty else [float((x2[i] - x1[i] + 1) * col_mm), float((y2[i] - y1[i] + 1) * row_mm)],
+            'perimeter_mm': float(perimeter_mm[i])
+        })
+    return metrics
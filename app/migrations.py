@@ -0,0 +1,161 @@
+# Schema migrations of the database.
+# db.create_all() only creates missing tables; it never adds an index or a column to a table that
+# already exists, so databases created by an older version keep their old schema. Schema changes
+# are ordered steps here instead. Each is applied once and recorded in the schema_version table,
+# so every database, old or new, ends at the same schema.
+# Step 1 creates the tables from the current models, later steps therefore must be idempotent
+# (IF NOT EXISTS, checking for a column before adding it).
+# Run this file directly to time the history queries on a large generated database before and
+# after the migration.
+
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import MetaData, create_engine, text
+
+
+def create_tables(connection, metadata):
+    metadata.create_all(bind=connection)
+
+
+def create_history_indexes(connection, metadata):
+    # Dashboard and history pages list a user's scans and chat turns by time, a scan's chat is
+    # loaded by scan_id (see keyset_page and chat_turns in app.py).
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_scan_user_id_created_at ON scan (user_id, created_at)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_history_user_id_timestamp ON chat_history (user_id, timestamp)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_history_scan_id_timestamp ON chat_history (scan_id, timestamp)"))
+    connection.execute(text("ANALYZE"))
+
+
+def add_scan_job_owner(connection, metadata):
+    # Running jobs name the process that owns them and keep a heartbeat, so recovery at startup
+    # only requeues jobs whose process is gone (see recover_scan_jobs in app.py).
+    columns = {row[1] for row in connection.execute(text("PRAGMA table_info(scan_job)"))}
+    if not columns:
+        return
+    if 'owner' not in columns:
+        connection.execute(text("ALTER TABLE scan_job ADD COLUMN owner VARCHAR(64)"))
+    if 'heartbeat_at' not in columns:
+        connection.execute(text("ALTER TABLE scan_job ADD COLUMN heartbeat_at DATETIME"))
+
+
+# (version, description, step); append new steps, never change or reorder applied ones.
+MIGRATIONS = [
+    (1, 'Model tables', create_tables),
+    (2, 'Indexes of the scan and chat history queries', create_history_indexes),
+    (3, 'Owner and heartbeat of scan jobs', add_scan_job_owner),
+]
+
+
+def current_version(engine):
+    with engine.connect() as connection:
+        if not engine.dialect.has_table(connection, 'schema_version'):
+            return 0
+        return connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar() or 0
+
+
+def migrate(engine, metadata):
+    """Applies the steps the database has not seen yet, in order. Returns the versions applied."""
+    with engine.begin() as connection:
+        connection.execute(text(
+            "CREATE TABLE IF NOT EXISTS schema_version "
+            "(version INTEGER PRIMARY KEY, description TEXT NOT NULL, applied_at DATETIME NOT NULL)"))
+        done = {row[0] for row in connection.execute(text("SELECT version FROM schema_version"))}
+    applied = []
+    for version, description, step in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as connection:
+            step(connection, metadata)
+            # OR IGNORE: another process that migrated at the same time already recorded it.
+            connection.execute(text("INSERT OR IGNORE INTO schema_version (version, description, applied_at) VALUES (:v, :d, :t)"),
+                               {'v': version, 'd': description, 't': datetime.utcnow()})
+        print(f"Applied schema migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+
+# Tables as created by versions before the migrations, without secondary indexes.
+BENCHMARK_SCHEMA = [
+    "CREATE TABLE scan (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER NOT NULL, scan_date DATETIME NOT NULL, "
+    "scan_type VARCHAR(50) NOT NULL, image_path VARCHAR(255) NOT NULL, created_at DATETIME)",
+    "CREATE TABLE chat_history (id INTEGER NOT NULL PRIMARY KEY, user_id INTEGER NOT NULL, scan_id INTEGER, "
+    "user_message TEXT NOT NULL, ai_response TEXT NOT NULL, timestamp DATETIME)",
+]
+
+# The statements the app issues for these pages, with the user and scan as parameters.
+BENCHMARK_QUERIES = {
+    'recent scans': "SELECT * FROM scan WHERE user_id = :user_id ORDER BY created_at DESC, id DESC LIMIT 6",
+    'chat history page': "SELECT * FROM chat_history WHERE user_id = :user_id ORDER BY timestamp DESC, id DESC LIMIT 51",
+    'scan chat turns': "SELECT * FROM chat_history WHERE scan_id = :scan_id ORDER BY timestamp DESC, id DESC LIMIT 100",
+}
+
+
+def fill_benchmark_database(path, users, scans_per_user, chat_rows):
+    start = datetime(2024, 1, 1)
+    rng = random.Random(0)
+    scan_count = users * scans_per_user
+    with sqlite3.connect(path) as connection:
+        for statement in BENCHMARK_SCHEMA:
+            connection.execute(statement)
+        connection.executemany(
+            "INSERT INTO scan (id, user_id, scan_date, scan_type, image_path, created_at) VALUES (?, ?, ?, 'MRI', 'scan.png', ?)",
+            ((i, i % users + 1, start + timedelta(minutes=i), start + timedelta(minutes=i)) for i in range(1, scan_count + 1)))
+        # Turns arrive in time order, each on a random scan of the user of that scan.
+        rows = ((i, scan_id % users + 1, scan_id, 'How large is the tumor?', 'The segmented area is small.', start + timedelta(seconds=i))
+                for i, scan_id in ((i, rng.randint(1, scan_count)) for i in range(1, chat_rows + 1)))
+        connection.executemany(
+            "INSERT INTO chat_history (id, user_id, scan_id, user_message, ai_response, timestamp) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+
+def time_queries(engine, users, scan_count, runs):
+    """Median milliseconds and query plan of every benchmark query, over runs random users and scans."""
+    rng = random.Random(1)
+    results = {}
+    with engine.connect() as connection:
+        for name, sql in BENCHMARK_QUERIES.items():
+            params = [{'user_id': rng.randint(1, users), 'scan_id': rng.randint(1, scan_count)} for _ in range(runs)]
+            plan = ' / '.join(row[-1] for row in connection.execute(text("EXPLAIN QUERY PLAN " + sql), params[0]))
+            timings = []
+            for p in params:
+                started = time.perf_counter()
+                connection.execute(text(sql), p).fetchall()
+                timings.append((time.perf_counter() - started) * 1000)
+            results[name] = (statistics.median(timings), plan)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the scan and chat history queries before and after the migrations.')
+    parser.add_argument('--chat-rows', type=int, default=1_000_000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--scans-per-user', type=int, default=20)
+    parser.add_argument('--runs', type=int, default=50, help='Queries timed per statement.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'benchmark.db')
+        started = time.perf_counter()
+        fill_benchmark_database(path, args.users, args.scans_per_user, args.chat_rows)
+        print(f"Generated {args.chat_rows} chat rows and {args.users * args.scans_per_user} scans in {time.perf_counter() - started:.1f} s.")
+        engine = create_engine(f"sqlite:///{path}")
+        before = time_queries(engine, args.users, args.users * args.scans_per_user, args.runs)
+        started = time.perf_counter()
+        # No models here: step 1 has nothing to create, step 2 indexes the generated tables.
+        migrate(engine, MetaData())
+        print(f"Migrated to version {current_version(engine)} in {time.perf_counter() - started:.1f} s.\n")
+        after = time_queries(engine, args.users, args.users * args.scans_per_user, args.runs)
+        engine.dispose()
+
+    for name in BENCHMARK_QUERIES:
+        print(f"{name:18} {before[name][0]:9.3f} ms -> {after[name][0]:7.3f} ms   {after[name][1]}")
+
+
+if __name__ == "__main__":
+    main()
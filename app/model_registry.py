@@ -0,0 +1,195 @@
+# Registry of segmentation model versions.
+# New weights are loaded and smoke tested in the background, then swapped in atomically;
+# in-flight scans keep the processor they started with. Traffic can optionally be split
+# between the active version and a candidate, with latency tracked per version.
+
+import random
+import threading
+import time
+from collections import deque
+
+
+class VersionStats:
+    """Latency of the most recent requests served by one version."""
+    def __init__(self, window=500):
+        self.latencies_ms = deque(maxlen=window)
+        self.requests = 0
+        self.errors = 0
+
+    def record(self, latency_ms, ok=True):
+        self.requests += 1
+        if not ok:
+            self.errors += 1
+        self.latencies_ms.append(latency_ms)
+
+    def summary(self):
+        ordered = sorted(self.latencies_ms)
+
+        def percentile(p):
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1) if ordered else None
+
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'p50_ms': percentile(0.50),
+            'p95_ms': percentile(0.95),
+            'mean_ms': round(sum(ordered) / len(ordered), 1) if ordered else None
+        }
+
+
+class ModelRegistry:
+    """
+    :param factory: Callable (weights, engine) -> processor with the YOLOProcessor interface.
+    :param smoke_test: Callable (processor) -> None that raises when a freshly loaded version is unusable.
+    """
+    def __init__(self, factory, smoke_test=None):
+        self.factory = factory
+        self.smoke_test = smoke_test
+        self.versions = {}
+        self.stats = {}
+        self.loading = {}
+        self.active = None
+        self.candidate = None
+        self.candidate_fraction = 0.0
+        self._in_flight = {}  # version name -> requests running on it
+        self._closing = {}  # unloaded version name -> processor, closed when its last request finishes
+        self._lock = threading.Lock()
+
+    def register(self, name, processor, activate=False):
+        with self._lock:
+            self.versions[name] = processor
+            self.stats.setdefault(name, VersionStats())
+            if activate or self.active is None:
+                self.active = name
+
+    def load(self, name, weights, engine='torch', activate=False):
+        """Loads, warms and smoke tests a version. Raises if the version is unusable."""
+        with self._lock:
+            if name in self.versions or self.loading.get(name, {}).get('status') == 'loading':
+                raise ValueError(f"Model version '{name}' is already registered.")
+            self.loading[name] = {'weights': weights, 'engine': engine, 'status': 'loading', 'error': None}
+        try:
+            processor = self.factory(weights, engine)
+            processor.warm_up()
+            if not processor.ready:
+                raise RuntimeError(f"warm-up failed: {getattr(processor, 'warm_up_error', None) or 'unknown error'}")
+            if self.smoke_test is not None:
+                self.smoke_test(processor)
+        except Exception as e:
+            with self._lock:
+                self.loading[name].update(status='failed', error=str(e))
+            print(f"Model version '{name}' rejected: {e}")
+            raise
+        self.register(name, processor, activate=activate)
+        with self._lock:
+            self.loading.pop(name, None)
+        print(f"Model version '{name}' loaded from {weights} ({engine}){' and activated' if activate else ''}.")
+        return processor
+
+    def load_in_background(self, name, weights, engine='torch', activate=False):
+        def run():
+            try:
+                self.load(name, weights, engine, activate)
+            except Exception:
+                pass  # recorded in self.loading
+        thread = threading.Thread(target=run, name=f'model-load-{name}', daemon=True)
+        thread.start()
+        return thread
+
+    def activate(self, name):
+        """Swaps the active version. Requests already running finish on the old one."""
+        with self._lock:
+            if name not in self.versions:
+                raise KeyError(name)
+            self.active = name
+            if self.candidate == name:
+                self.candidate = None
+                self.candidate_fraction = 0.0
+
+    def split(self, candidate, fraction):
+        """Sends roughly `fraction` of requests to candidate; fraction 0 or candidate None stops the split."""
+        with self._lock:
+            if candidate is not None and candidate not in self.versions:
+                raise KeyError(candidate)
+            self.candidate = candidate if fraction > 0 else None
+            self.candidate_fraction = max(0.0, min(1.0, float(fraction))) if candidate else 0.0
+
+    def unload(self, name):
+        """
+        Drops a version that no longer takes traffic. Its model is released once the requests
+        already routed to it have finished.
+        """
+        with self._lock:
+            if name in (self.active, self.candidate):
+                raise ValueError(f"Model version '{name}' is serving traffic.")
+            processor = self.versions.pop(name, None)
+            if processor is not None and self._in_flight.get(name):
+                self._closing[name] = processor
+                return
+        self._close(processor)
+
+    @staticmethod
+    def _close(processor):
+        if processor is not None and hasattr(processor, 'close'):
+            processor.close()
+
+    def route(self):
+        """Returns (version name, processor) for the next request and counts it in flight until release(name)."""
+        with self._lock:
+            name = self.active
+            if self.candidate and random.random() < self.candidate_fraction:
+                name = self.candidate
+            self._in_flight[name] = self._in_flight.get(name, 0) + 1
+            return name, self.versions[name]
+
+    def release(self, name):
+        """Ends a request routed to name, closing the version if it was unloaded meanwhile."""
+        with self._lock:
+            self._in_flight[name] -= 1
+            if self._in_flight[name] > 0:
+                return
+            del self._in_flight[name]
+            processor = self._closing.pop(name, None)
+        self._close(processor)
+
+    @property
+    def current(self):
+        """Processor of the active version."""
+        with self._lock:
+            return self.versions[self.active]
+
+    def call(self, method, *args, **kwargs):
+        """Routes one request to a version, runs processor.<method> and records its latency."""
+        name, processor = self.route()
+        started = time.perf_counter()
+        result = None
+        try:
+            result = getattr(processor, method)(*args, **kwargs)
+            return result
+        finally:
+            self.stats[name].record((time.perf_counter() - started) * 1000, ok=result is not None)
+            self.release(name)
+
+    def process_image(self, *args, **kwargs):
+        return self.call('process_image', *args, **kwargs)
+
+    def process_volume(self, *args, **kwargs):
+        return self.call('process_volume', *args, **kwargs)
+
+    def status(self):
+        with self._lock:
+            return {
+                'active': self.active,
+                'candidate': self.candidate,
+                'candidate_fraction': self.candidate_fraction,
+                'versions': {
+                    name: dict(
+                        weights=getattr(processor, 'model_path', None),
+                        engine=getattr(processor, 'engine', None),
+                        ready=getattr(processor, 'ready', None),
+                        **self.stats[name].summary()
+                    )
+                    for name, processor in self.versions.items()
+                },
+                'loading': dict(self.loading)
+            }
@@ -0,0 +1,121 @@
+# Pooled HTTP client for one or more Ollama servers.
+# All calls share one keep-alive requests.Session. Every request goes to the backend with
+# the fewest calls in flight, and connection failures and overload answers are retried
+# on another backend with jittered exponential backoff.
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Answers that mean "try again elsewhere"; other errors (e.g. 500 for a bad prompt) are returned to the caller.
+RETRY_STATUSES = {429, 502, 503, 504}
+
+
+class OllamaBackend:
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.down_until = 0.0  # skipped while in cooldown after a failure, unless every backend is
+
+    def stats(self):
+        return {
+            'url': self.base_url,
+            'in_flight': self.in_flight,
+            'requests': self.requests,
+            'failures': self.failures,
+            'available': self.down_until <= time.monotonic()
+        }
+
+
+class OllamaClient:
+    """
+    :param base_urls: Ollama servers, e.g. ['http://localhost:11434'].
+    :param pool_size: Keep-alive connections kept per server.
+    :param connect_timeout: Seconds to establish a connection.
+    :param read_timeout: Seconds to wait for the next bytes of an answer.
+    :param retries: Extra attempts after the first one fails.
+    :param backoff: Base of the exponential backoff in seconds, the wait is drawn uniformly below it.
+    :param cooldown: Seconds a failed server is skipped.
+    """
+    def __init__(self, base_urls, pool_size=10, connect_timeout=3.05, read_timeout=300, retries=2, backoff=0.5, cooldown=10.0):
+        if isinstance(base_urls, str):
+            base_urls = [base_urls]
+        self.backends = [OllamaBackend(url) for url in base_urls]
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = max(0, int(retries))
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(self.backends), pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def _acquire(self, exclude=()):
+        """Picks the available backend with the fewest calls in flight and counts the call."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [b for b in self.backends if b not in exclude] or self.backends
+            available = [b for b in candidates if b.down_until <= now] or candidates
+            backend = min(available, key=lambda b: b.in_flight)
+            backend.in_flight += 1
+            backend.requests += 1
+            return backend
+
+    def _release(self, backend, failed=False):
+        with self._lock:
+            backend.in_flight -= 1
+            if failed:
+                backend.failures += 1
+                backend.down_until = time.monotonic() + self.cooldown
+
+    def _sleep_before_retry(self, attempt):
+        time.sleep(random.uniform(0, self.backoff * (2 ** attempt)))
+
+    @contextmanager
+    def post(self, path, payload, stream=False):
+        """
+        Posts payload to path (e.g. '/api/chat') and yields the response. The backend counts
+        as busy until the block exits, so streamed answers are read inside it.
+        Raises requests exceptions once every attempt failed.
+        """
+        tried = []
+        attempt = 0
+        while True:
+            backend = self._acquire(exclude=tried)
+            try:
+                response = self.session.post(backend.base_url + path, json=payload, stream=stream, timeout=self.timeout)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                self._release(backend, failed=True)
+                tried.append(backend)
+                if attempt >= self.retries:
+                    raise
+                self._sleep_before_retry(attempt)
+                attempt += 1
+                continue
+
+            if response.status_code in RETRY_STATUSES and attempt < self.retries:
+                response.close()
+                self._release(backend, failed=True)
+                tried.append(backend)
+                self._sleep_before_retry(attempt)
+                attempt += 1
+                continue
+
+            try:
+                yield response
+            finally:
+                response.close()
+                self._release(backend, failed=response.status_code in RETRY_STATUSES)
+            return
+
+    def stats(self):
+        with self._lock:
+            return [backend.stats() for backend in self.backends]
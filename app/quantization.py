@@ -0,0 +1,192 @@
+# INT8 quantized CPU engine for the segmentation model.
+# The weights are quantized with OpenVINO post-training quantization, calibrated on a sample
+# of kaggle_3m slices (the dataset train.ipynb builds the training set from). The quantized
+# engine can only be loaded once it has passed a mask IoU regression check against FP32 on
+# slices of other patients than the calibration ones; the result is stored next to the model.
+# Run this file directly to calibrate, quantize and gate.
+
+import argparse
+import json
+import os
+import random
+import shutil
+import time
+
+import numpy as np
+
+from engines import compare_results, exported_path, model_imgsz
+from result_cache import file_fingerprint
+
+INT8_ENGINE = 'openvino-int8'
+
+
+def gate_report_path(weights_path):
+    return os.path.splitext(weights_path)[0] + '_int8_gate.json'
+
+
+def read_gate_report(weights_path):
+    """Returns the stored regression check of the INT8 model of these weights, or None."""
+    try:
+        with open(gate_report_path(weights_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def check_gate(weights_path):
+    """Raises unless the INT8 model of the current weights exists and passed its regression check."""
+    report = read_gate_report(weights_path)
+    if report is None:
+        raise RuntimeError(f"{os.path.basename(weights_path)} has no INT8 regression check, run quantization.py first.")
+    if report.get('weights_sha256') != file_fingerprint(weights_path):
+        raise RuntimeError(f"The INT8 model is older than {os.path.basename(weights_path)}, run quantization.py again.")
+    if not report.get('passed'):
+        raise RuntimeError(f"The INT8 model of {os.path.basename(weights_path)} failed its regression check "
+                           f"(mean mask IoU {report.get('mean_mask_iou')}).")
+    return report
+
+
+def patient_slices(dataset_dir):
+    """Returns {patient folder: [slice paths]} of a kaggle_3m tree, masks excluded."""
+    patients = {}
+    for root, _, files in os.walk(dataset_dir):
+        slices = sorted(os.path.join(root, f) for f in files if f.endswith('.tif') and not f.endswith('_mask.tif'))
+        if slices:
+            patients[os.path.basename(root)] = slices
+    return patients
+
+
+def split_slices(dataset_dir, calibration_samples=300, evaluation_samples=200, seed=0):
+    """
+    Samples calibration and evaluation slices from disjoint patients, so the regression
+    check never runs on an image the quantizer has seen.
+    """
+    patients = patient_slices(dataset_dir)
+    if not patients:
+        raise FileNotFoundError(f"No kaggle_3m slices found in {dataset_dir}.")
+    if len(patients) < 2:
+        raise ValueError(f"{dataset_dir} has slices of one patient only, the regression check needs a held-out patient.")
+    names = sorted(patients)
+    rng = random.Random(seed)
+    rng.shuffle(names)
+    half = max(1, len(names) // 2)
+    calibration = [s for name in names[:half] for s in patients[name]]
+    evaluation = [s for name in names[half:] for s in patients[name]]
+    return (rng.sample(calibration, min(calibration_samples, len(calibration))),
+            rng.sample(evaluation, min(evaluation_samples, len(evaluation))))
+
+
+def write_calibration_dataset(slices, output_dir):
+    """Copies the calibration slices into a YOLO dataset layout and returns its dataset.yaml."""
+    images_dir = os.path.join(output_dir, 'images', 'val')
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(images_dir)
+    for path in slices:
+        shutil.copy(path, os.path.join(images_dir, os.path.basename(path)))
+    yaml_path = os.path.join(output_dir, 'dataset.yaml')
+    with open(yaml_path, 'w') as f:
+        f.write(f"path: {os.path.abspath(output_dir)}\n")
+        f.write("train: images/val\n")
+        f.write("val: images/val\n")
+        f.write("names:\n")
+        f.write("  0: tumor\n")
+    return yaml_path
+
+
+def quantize(weights_path, calibration_slices, work_dir='cache/int8_calibration'):
+    """Exports the weights as an INT8 OpenVINO model calibrated on the given slices. Returns the model path."""
+    from ultralytics import YOLO
+
+    model = YOLO(weights_path)
+    data = write_calibration_dataset(calibration_slices, work_dir)
+    artifact = exported_path(weights_path, INT8_ENGINE)
+    print(f"Quantizing {os.path.basename(weights_path)} to INT8 on {len(calibration_slices)} slices...")
+    exported = model.export(format='openvino', int8=True, data=data, fraction=1.0, imgsz=model_imgsz(model), device='cpu', dynamic=True)
+    if os.path.abspath(str(exported)).rstrip(os.sep) != os.path.abspath(artifact):
+        shutil.rmtree(artifact, ignore_errors=True)
+        os.replace(str(exported), artifact)
+    return artifact
+
+
+def regression_check(weights_path, sources, conf=0.5, iou=0.7, min_mean_mask_iou=0.9, max_detection_mismatch=0.05):
+    """
+    Runs FP32 and INT8 on the same slices and compares their masks. Passes when the mean
+    mask IoU stays above min_mean_mask_iou and at most max_detection_mismatch of the slices
+    have a different number of detections. Also reports the latency of both.
+    Slices where neither model finds a tumor agree trivially; they count towards the detection
+    mismatches but not towards the mask IoU, which needs at least one slice with a tumor.
+    """
+    from ultralytics import YOLO
+
+    fp32 = YOLO(weights_path)
+    int8 = YOLO(exported_path(weights_path, INT8_ENGINE), task='segment')
+    imgsz = model_imgsz(fp32)
+    predict = dict(conf=conf, iou=iou, imgsz=imgsz, retina_masks=True, verbose=False)
+    for model in (fp32, int8):
+        model.predict(source=np.zeros((imgsz, imgsz, 3), dtype=np.uint8), **predict)
+
+    mask_ious = []
+    mismatches = 0
+    empty_slices = 0
+    fp32_ms = []
+    int8_ms = []
+    for source in sources:
+        started = time.perf_counter()
+        reference = fp32.predict(source=source, **predict)[0]
+        fp32_ms.append((time.perf_counter() - started) * 1000)
+        started = time.perf_counter()
+        candidate = int8.predict(source=source, **predict)[0]
+        int8_ms.append((time.perf_counter() - started) * 1000)
+
+        report = compare_results(reference, candidate)
+        if report['reference_detections'] == report['candidate_detections'] == 0:
+            empty_slices += 1
+        else:
+            mask_ious.append(report['min_mask_iou'])
+        mismatches += report['reference_detections'] != report['candidate_detections']
+
+    mean_mask_iou = float(np.mean(mask_ious)) if mask_ious else 0.0
+    mismatch_rate = mismatches / max(1, len(sources))
+    return {
+        'weights_sha256': file_fingerprint(weights_path),
+        'images': len(sources),
+        'empty_images': empty_slices,
+        'mean_mask_iou': round(mean_mask_iou, 4),
+        'p05_mask_iou': round(float(np.percentile(mask_ious, 5)), 4) if mask_ious else 0.0,
+        'detection_mismatch_rate': round(mismatch_rate, 4),
+        'fp32_mean_ms': round(float(np.mean(fp32_ms)), 1) if fp32_ms else None,
+        'int8_mean_ms': round(float(np.mean(int8_ms)), 1) if int8_ms else None,
+        'speedup': round(float(np.mean(fp32_ms) / np.mean(int8_ms)), 2) if int8_ms else None,
+        'thresholds': {'min_mean_mask_iou': min_mean_mask_iou, 'max_detection_mismatch': max_detection_mismatch},
+        'passed': bool(mask_ious) and mean_mask_iou >= min_mean_mask_iou and mismatch_rate <= max_detection_mismatch
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Quantize the segmentation model to INT8 and check it against FP32.')
+    parser.add_argument('--weights', default=os.path.join('models', 'yolov11-seg-brain.pt'))
+    parser.add_argument('--dataset', default=os.path.join('dataset', 'kaggle_3m'), help='kaggle_3m directory with one folder per patient.')
+    parser.add_argument('--calibration-samples', type=int, default=300)
+    parser.add_argument('--evaluation-samples', type=int, default=200)
+    parser.add_argument('--min-mean-mask-iou', type=float, default=0.9)
+    parser.add_argument('--max-detection-mismatch', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    calibration, evaluation = split_slices(args.dataset, args.calibration_samples, args.evaluation_samples, args.seed)
+    quantize(args.weights, calibration)
+    report = regression_check(args.weights, evaluation,
+                              min_mean_mask_iou=args.min_mean_mask_iou, max_detection_mismatch=args.max_detection_mismatch)
+    report['calibration_images'] = len(calibration)
+    with open(gate_report_path(args.weights), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Mean mask IoU {report['mean_mask_iou']:.3f} (5th percentile {report['p05_mask_iou']:.3f}) over "
+          f"{report['images'] - report['empty_images']} slices with a tumor, {report['empty_images']} without; "
+          f"detection mismatches {report['detection_mismatch_rate']:.1%} over {report['images']} slices.")
+    print(f"Latency FP32 {report['fp32_mean_ms']} ms, INT8 {report['int8_mean_ms']} ms ({report['speedup']}x).")
+    print(f"INT8 regression check {'passed, set YOLO_ENGINE to ' + INT8_ENGINE if report['passed'] else 'FAILED, the INT8 engine stays disabled'}.")
+
+
+if __name__ == "__main__":
+    main()
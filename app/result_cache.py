@@ -0,0 +1,150 @@
+# Content-addressed cache for YOLO inference results.
+# Entries are keyed on the image bytes, the model identity and the predict settings,
+# and live in a small in-memory LRU backed by a size-bounded directory of .npz files.
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def file_fingerprint(path, chunk_size=1024 * 1024):
+    """Returns the sha256 hex digest of a file's content."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Bump when the layout of cached entries changes, older entries are then never looked up again.
+ENTRY_VERSION = 2
+
+
+def make_cache_key(image_bytes: bytes, model_id: str, conf: float, iou: float) -> str:
+    """Builds the cache key for one image under one model configuration."""
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    settings = f"v{ENTRY_VERSION}|{model_id}|conf={conf}|iou={iou}"
+    return hashlib.sha256(f"{digest}|{settings}".encode('utf-8')).hexdigest()
+
+
+class InferenceCache:
+    """
+    Two tier cache of inference results.
+
+    An entry is a dict with:
+        yolo_results_json (str), masks (np.ndarray or None), overlay (bytes, JPEG)
+        and any extra JSON serializable fields (tumor area, save dir, ...).
+    """
+    def __init__(self, cache_dir, memory_items=128, disk_max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.memory_items = max(0, int(memory_items))
+        self.disk_max_bytes = max(0, int(disk_max_bytes))
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._disk_bytes = sum(size for _, size, _ in self._disk_entries())
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.npz')
+
+    def _disk_entries(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.npz'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((name, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _remember(self, key, entry):
+        if not self.memory_items:
+            return
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        """Returns the cached entry or None."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                return entry
+
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                meta = json.loads(bytes(data['meta']).decode('utf-8'))
+                masks = data['masks'] if meta.pop('has_masks', False) else None
+                overlay = bytes(data['overlay'])
+            os.utime(path)  # keeps disk eviction least-recently-used
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"Inference cache: dropping unreadable entry {key}: {e}")
+            self.delete(key)
+            return None
+
+        entry = dict(meta, masks=masks, overlay=overlay)
+        with self._lock:
+            self._remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        """Stores an entry in memory and on disk."""
+        meta = {k: v for k, v in entry.items() if k not in ('masks', 'overlay')}
+        masks = entry.get('masks')
+        meta['has_masks'] = masks is not None
+        with self._lock:
+            self._remember(key, entry)
+
+        if not self.disk_max_bytes:
+            return
+        path = self._path(key)
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(
+                    f,
+                    meta=np.frombuffer(json.dumps(meta).encode('utf-8'), dtype=np.uint8),
+                    masks=masks if masks is not None else np.zeros(0, dtype=np.uint8),
+                    overlay=np.frombuffer(entry.get('overlay') or b'', dtype=np.uint8)
+                )
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            with self._lock:
+                self._disk_bytes += os.path.getsize(path) - old_size
+            self._evict_disk()
+        except Exception as e:
+            print(f"Inference cache: could not write entry {key}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def delete(self, key):
+        with self._lock:
+            self._memory.pop(key, None)
+            path = self._path(key)
+            if os.path.exists(path):
+                self._disk_bytes -= os.path.getsize(path)
+                os.remove(path)
+
+    def _evict_disk(self):
+        with self._lock:
+            if self._disk_bytes <= self.disk_max_bytes:
+                return
+            for name, size, _ in sorted(self._disk_entries(), key=lambda e: e[2]):
+                if self._disk_bytes <= self.disk_max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    self._disk_bytes -= size
+                except FileNotFoundError:
+                    pass
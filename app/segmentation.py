@@ -0,0 +1,30 @@
+# Conversion of ultralytics Results into the plain data the app stores and caches.
+# Kept free of Flask and database imports so inference worker processes can use it too.
+
+import json
+
+import cv2
+import numpy as np
+
+from mask_metrics import compute_mask_metrics
+
+
+def result_to_entry(result, pixel_spacing=None):
+    """
+    Turns one Results object into a cacheable entry: detections JSON, masks,
+    overlay JPEG rendered in memory and mask metrics.
+    """
+    detections_data_list = [json.loads(result.to_json())]
+    masks = result.masks.data.cpu().numpy().astype(np.uint8) if result.masks is not None else None
+    ok, overlay = cv2.imencode('.jpg', result.plot())
+    mask_metrics = compute_mask_metrics(
+        masks if masks is not None else np.zeros((0,) + tuple(result.orig_shape), dtype=np.uint8),
+        pixel_spacing
+    )
+    return {
+        "yolo_results_json": json.dumps(detections_data_list),
+        "masks": masks,
+        "overlay": overlay.tobytes() if ok else b'',
+        "mask_metrics": mask_metrics,
+        "tumor_area_cm2": mask_metrics['total_area_cm2']
+    }
@@ -223,6 +223,8 @@ document.addEventListener('DOMContentLoaded', async () => {
                     uploadBtn.innerHTML = '<i class="fas fa-spinner"></i>' + 'Processing...';
                     uploadBtn.disabled = true;
                     try {
+                        // /scan queues the analysis; its events arrive as the job advances: the images and
+                        // YOLO findings after segmentation, then the report token by token.
                         const response = await fetch('/scan', {
                         method: 'POST',
                         headers: {
@@ -230,57 +232,23 @@ document.addEventListener('DOMContentLoaded', async () => {
                         },
                         body: formData
                         });
-                        
-                        const result = await response.json();
 
-                        if (response.ok && result.success) {
-                            scan_id = result.scan_id;
-                            renderRecentScans();
-                            renderChatHistory();
-                            
-                            const selectedScan = document.querySelector('.selected-scan');
-                            const yoloResult = String(result.yolo_diagnosis).replace(/(?:\r\n|\r|\n)/g, '<br/>');
-                            const ai_diagnosis = String(result.ai_diagnosis).replace(/(?:\r\n|\r|\n)/g, '<br/>');
-
-                            const originalMediaHtml = createMediaTag(result.image_base64, result.image_mime_type, 'Original MRI Scan');
-                            const processedMediaHtml = createMediaTag(result.processed_image_base64, result.processed_image_mime_type, 'Segmented MRI Scan');
-
-                            const html = `
-                                    <div class="selected-scan-info">
-                                        <h4>Brain MRI (${result.scan_type}) - ${result.scan_date}</h4>
-                                    </div>
-                                    <div class="analysis-view">
-                                        <div class="original-scan">
-                                            <h5>Original Scan</h5>
-                                            ${originalMediaHtml}
-                                        </div>
-                                        <div class="segmented-scan">
-                                            <h5>AI Segmentation</h5>
-                                            ${processedMediaHtml}
-                                        </div>
-                                    </div>
-                                    
-                                    <div class="ai-report">
-                                        <h4>Yolo Diagnosis</h4>
-                                        <p>${yoloResult}</p>
-                                        <h4>AI-Generated Interpretation</h4>
-                                        <p>${ai_diagnosis}</p>
-                                        <div class="report-actions">
-                                            <button class="btn-small">
-                                                <i class="fas fa-download"></i> Download Report
-                                            </button>
-                                            <button class="btn-small">
-                                                <i class="fas fa-share-alt"></i> Share with Doctor
-                                            </button>
-                                        </div>
-                                    </div>                
-                            `;
-                            selectedScan.innerHTML = html;
-                            
-                        } else {
-                            errorMessage.textContent = 'Error while processing: ' + String(response.message);
-                            errorMessage.style.display = 'block';
+                        const result = await response.json();
+                        if (!response.ok || !result.success) {
+                            throw new Error(result.message);
                         }
+
+                        const stageLabels = {queued: 'Queued...', segmenting: 'Segmenting...', reporting: 'Writing report...'};
+                        await followEventSource(result.events_url, (event, data) => {
+                            if (event === 'status' && stageLabels[data.status]) {
+                                uploadBtn.innerHTML = '<i class="fas fa-spinner"></i>' + stageLabels[data.status];
+                            } else if (event === 'error') {
+                                errorMessage.textContent = 'Error while processing: ' + String(data.message);
+                                errorMessage.style.display = 'block';
+                            } else {
+                                renderScanEvent(event, data);
+                            }
+                        });
                     } catch (e) {
                         errorMessage.textContent = 'Error while connecting to server: ' + String(e);
                         errorMessage.style.display = 'block';
@@ -471,12 +439,12 @@ function renderUserProfile(data) {
         data = user;
     }
 
-    if (!data.profile_base64 && !data.profile_mime_type) {
+    if (!data.profile_url) {
         document.getElementById('user-profile-img').innerHTML = '<i class="fas fa-user profile-icon" style="display: block;"></i>';
         document.getElementById('profile-photo-large').innerHTML = '<img src="https://placehold.co/400x400?text=Media+Not+Available" alt="Profile photo">';
     } else{
-        document.getElementById('user-profile-img').innerHTML = `<img src="date:${data.profile_mime_type};base64,${data.profile_base64}" alt="Profile Image">`;
-        document.getElementById('profile-photo-large').innerHTML = `<img src="date:${data.profile_mime_type};base64,${data.profile_base64}" alt="Profile Image">`;
+        document.getElementById('user-profile-img').innerHTML = `<img src="${data.profile_url}" alt="Profile Image">`;
+        document.getElementById('profile-photo-large').innerHTML = `<img src="${data.profile_url}" alt="Profile Image">`;
     } 
     document.getElementById('user-first-name').value = data.first_name;
     document.getElementById('user-last-name').value = data.last_name;
@@ -523,8 +491,8 @@ function renderRecentScans(scans) {
         const diagnosisStatusClass = scan.ai_diagnosis && scan.ai_diagnosis.toLowerCase().includes('meningioma') ? 'needs-attention' : 'ok';
         const diagnosisStatusIcon = diagnosisStatusClass === 'needs-attention' ? '<i class="fas fa-exclamation-circle"></i>' : '<i class="fas fa-check-circle"></i>';
         
-        const originalMediaHtml = createMediaTag(scan.image_base64, scan.image_mime_type, 'Original MRI Scan');
-        const processedMediaHtml = createMediaTag(scan.processed_image_base64, scan.processed_image_mime_type, 'Segmented MRI Scan');
+        const originalMediaHtml = createMediaTag(scan.image_url, scan.image_mime_type, 'Original MRI Scan');
+        const processedMediaHtml = createMediaTag(scan.processed_image_url, scan.processed_image_mime_type, 'Segmented MRI Scan');
 
         const scanItem = document.createElement('div');
         scanItem.className = 'scan-history-item';
@@ -597,13 +565,14 @@ async function renderMedicalRecords() {
     scanResultsContainer.innerHTML = loadingHTML;
     notesContainer.innerHTML = loadingHTML;
 
+    medicalRecords = await updateMedicalRecords();
     if (medicalRecords) {
         renderPatientHistory(patientHistoryContainer, medicalRecords);
         renderScanResults(scanResultsContainer, medicalRecords);
         renderDoctorNotes(notesContainer, medicalRecords);
     } else {
         console.error('Error fetching or rendering medical records');
-        const errorHTML = `<div class="error-message"><i class="fa-solid fa-circle-exclamation"></i>Error: ${error.message}</div>`;
+        const errorHTML = `<div class="error-message"><i class="fa-solid fa-circle-exclamation"></i>Error: The medical records could not be loaded.</div>`;
         patientHistoryContainer.innerHTML = errorHTML;
         scanResultsContainer.innerHTML = '';
         notesContainer.innerHTML = '';
@@ -653,11 +622,11 @@ function renderScanResults(container, data) {
             <div class="scan-images">
                 <div class="image-container">
                     <h4>Original scan</h4>
-                    <img src="date:${latestScan.image_mime_type};base64,${latestScan.image_base64}" alt="Original Image" onerror="this.src="https://placehold.co/400x400?text=Media+Not+Available";">
+                    <img src="${latestScan.image_url}" alt="Original Image" onerror="this.src="https://placehold.co/400x400?text=Media+Not+Available";">
                 </div>
                 <div class="image-container">
                     <h4>AI Analysis</h4>
-                    <img src="date:${latestScan.processed_image_mime_type};base64,${latestScan.processed_image_base64}" alt="Original Image" onerror="this.src="https://placehold.co/400x400?text=Media+Not+Available";">
+                    <img src="${latestScan.processed_image_url}" alt="Original Image" onerror="this.src="https://placehold.co/400x400?text=Media+Not+Available";">
                 </div>
             </div>
             <div class="scan-ai-report">
@@ -768,7 +737,7 @@ function sendMessage(message) {
     addMessageToChat(message, 'user');
     setLoadingIcon(true);
 
-    fetch('/app_chat', {
+    fetch('/chat/stream', {
         method: 'POST',
         headers: {
             'Content-Type': 'application/json',
@@ -781,18 +750,37 @@ function sendMessage(message) {
     })
 
     .then(response => {
+        if (response.status === 429) {
+            // The AI service is busy; the server says when to try again.
+            setLoadingIcon(false);
+            const retryAfter = response.headers.get('Retry-After') || 'a few';
+            addMessageToChat(`The AI assistant is busy right now. Please try again in ${retryAfter} seconds.`, 'ai');
+            return;
+        }
         if (!response.ok) {
             throw new Error('Network response was not ok');
         }
-        return response.json();
-    })
-    .then(data => {
-        setLoadingIcon(false);
-        if (data.success) {
-            addMessageToChat(data.response, 'ai', data.timestamp);
-        } else {
-            addMessageToChat('An error occurred: ' + data.message, 'ai');
-        }
+        // The reply is shown as it is generated and completed by the 'done' event.
+        let reply = null;
+        let text = '';
+        return readEventStream(response, (event, data) => {
+            if (event === 'token') {
+                if (!reply) {
+                    setLoadingIcon(false);
+                    reply = addMessageToChat('', 'ai', Date.now());
+                }
+                text += data.text;
+                reply.textContent = text;
+            } else if (event === 'done') {
+                setLoadingIcon(false);
+                if (!reply) {
+                    addMessageToChat(data.response, 'ai', data.timestamp);
+                }
+            } else if (event === 'error') {
+                setLoadingIcon(false);
+                addMessageToChat('An error occurred: ' + data.message, 'ai');
+            }
+        });
     })
     .catch(error => {
         setLoadingIcon(false);
@@ -801,6 +789,108 @@ function sendMessage(message) {
     });
 }
 
+// Renders one event of a scan analysis into the selected scan panel.
+let aiDiagnosisText = '';
+function renderScanEvent(event, result) {
+    const selectedScan = document.querySelector('.selected-scan');
+    if (event === 'segmentation' || (event === 'done' && !document.getElementById('ai-diagnosis-text'))) {
+        const yoloResult = String(result.yolo_diagnosis).replace(/(?:\r\n|\r|\n)/g, '<br/>');
+        const originalMediaHtml = createMediaTag(result.image_url, result.image_mime_type, 'Original MRI Scan');
+        const processedMediaHtml = createMediaTag(result.processed_image_url, result.processed_image_mime_type, 'Segmented MRI Scan');
+
+        const html = `
+            <div class="selected-scan-info">
+                <h4>Brain MRI (${result.scan_type}) - ${result.scan_date}</h4>
+            </div>
+            <div class="analysis-view">
+                <div class="original-scan">
+                    <h5>Original Scan</h5>
+                    ${originalMediaHtml}
+                </div>
+                <div class="segmented-scan">
+                    <h5>AI Segmentation</h5>
+                    ${processedMediaHtml}
+                </div>
+            </div>
+            
+            <div class="ai-report">
+                <h4>Yolo Diagnosis</h4>
+                <p>${yoloResult}</p>
+                <h4>AI-Generated Interpretation</h4>
+                <p id="ai-diagnosis-text"></p>
+                <div class="report-actions">
+                    <button class="btn-small">
+                        <i class="fas fa-download"></i> Download Report
+                    </button>
+                    <button class="btn-small">
+                        <i class="fas fa-share-alt"></i> Share with Doctor
+                    </button>
+                </div>
+            </div>                
+        `;
+        selectedScan.innerHTML = html;
+        aiDiagnosisText = '';
+    }
+    if (event === 'token') {
+        aiDiagnosisText += result.text;
+        document.getElementById('ai-diagnosis-text').innerHTML = aiDiagnosisText.replace(/(?:\r\n|\r|\n)/g, '<br/>');
+    } else if (event === 'done') {
+        document.getElementById('ai-diagnosis-text').innerHTML = String(result.ai_diagnosis).replace(/(?:\r\n|\r|\n)/g, '<br/>');
+        scan_id = result.scan_id;
+        renderRecentScans();
+        renderChatHistory();
+    }
+}
+
+// Follows a GET Server-Sent Events feed until its 'done' or 'error' event.
+// EventSource reconnects on its own and resumes from the last event id it saw.
+function followEventSource(url, onEvent) {
+    return new Promise(resolve => {
+        const source = new EventSource(url);
+        ['status', 'segmentation', 'token', 'done', 'error'].forEach(name => {
+            source.addEventListener(name, e => {
+                if (e.data === undefined) {
+                    return;  // connection error, EventSource retries by itself
+                }
+                onEvent(name, JSON.parse(e.data));
+                if (name === 'done' || name === 'error') {
+                    source.close();
+                    resolve();
+                }
+            });
+        });
+    });
+}
+
+// Reads a Server-Sent Events response and calls onEvent(event, data) for every event.
+async function readEventStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) {
+            break;
+        }
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const block = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            let event = 'message';
+            let data = '';
+            block.split('\n').forEach(line => {
+                if (line.startsWith('event: ')) {
+                    event = line.slice(7);
+                } else if (line.startsWith('data: ')) {
+                    data += line.slice(6);
+                }
+            });
+            onEvent(event, data ? JSON.parse(data) : null);
+        }
+    }
+}
+
 function setLoadingIcon(set) {
     if (set) {
         document.getElementById('sending-loading-icon').classList.replace('fas fa-paper-plane', 'fas fa-spinner');
@@ -915,23 +1005,23 @@ function addMessageToChat(message, sender, timestamp) {
         </div>
     `;
     chatMessages.insertAdjacentHTML('afterbegin', html);
+    return chatMessages.querySelector('.message-content p');
 }
 
-function createMediaTag(base64Data, mimeType, altText) {
-    // If there's no data or MIME type, return a placeholder.
-    if (!base64Data || !mimeType) {
+function createMediaTag(src, mimeType, altText) {
+    // If there's no image URL or MIME type, return a placeholder.
+    if (!src || !mimeType) {
         return `<img src="https://placehold.co/400x400?text=Media+Not+Available" alt="${altText}">`;
     }
 
-    const dataSrc = `data:${mimeType};base64,${base64Data}`;
-
+    // Stored images are URLs the browser caches; a scan still being analyzed comes as a data: URL.
     // Check if the MIME type indicates a video file.
     if (mimeType.startsWith('video/')) {
         // Return a <video> tag if it's a video.
-        return `<video controls autoplay loop muted src="${dataSrc}" alt="${altText}"></video>`;
+        return `<video controls autoplay loop muted src="${src}" alt="${altText}"></video>`;
     } else {
         // Otherwise, return an <img> tag.
-        return `<img src="${dataSrc}" alt="${altText}">`;
+        return `<img src="${src}" alt="${altText}">`;
     }
 }
 
@@ -998,23 +1088,24 @@ async function updateUserChat() {
     }
 }
 
-async function updateUserChat() {
+async function updateMedicalRecords() {
     try {
         const response = await fetch('/get-medical-records', {
-            method: 'GET'
+            method: 'GET',
+            headers: { 'X-Requested-With': 'XMLHttpRequest' }
         });
         
         const result = await response.json();
 
         if (response.ok && result.success) {
-            console.log('Medical records loaded successfully:', result.user_chat);
-            return result.user_chat;
+            console.log('Medical records loaded successfully:', result.generation_ms);
+            return result;
         } else {
             console.error('Failed to fetch medical records:', result.message);
-            return [];
+            return null;
         }
     } catch (e) {
         console.error('Connection error:', e);
-        return [];
+        return null;
     }
 }
\ No newline at end of file
@@ -0,0 +1,5 @@
+# The app modules import each other as top level modules, run from the app directory.
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
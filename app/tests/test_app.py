@@ -0,0 +1,78 @@
+# Tests of app.py helpers. Importing the app needs the model dependencies (torch, ultralytics).
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip('torch')
+pytest.importorskip('ultralytics')
+
+import app as aide  # noqa: E402
+from llm_cache import LLMResponseCache  # noqa: E402
+
+
+class StubResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class StubClient:
+    def __init__(self, data):
+        self.data = data
+        self.posts = []
+
+    @contextmanager
+    def post(self, path, payload):
+        self.posts.append((path, payload))
+        yield StubResponse(self.data)
+
+
+@pytest.fixture
+def processor(tmp_path):
+    processor = aide.OllamaProcessor(model_name='model', response_cache=LLMResponseCache(str(tmp_path / 'llm.sqlite')))
+    processor.client = StubClient({'response': 'answer', 'done': True, 'context': [1, 2, 3]})
+    return processor
+
+
+def test_generate_hit_keeps_the_context(processor):
+    for _ in range(2):
+        result = {}
+        assert processor.generate_response('prompt', result=result) == 'answer'
+        assert result['context'] == [1, 2, 3]
+    assert len(processor.client.posts) == 1
+
+
+def test_stream_hit_keeps_the_context(processor):
+    processor.stream_lines = lambda path, payload: iter([{'response': 'ans'}, {'response': 'wer', 'done': True, 'context': [4, 5]}])
+    for _ in range(2):
+        result = {}
+        assert ''.join(processor.stream_generate('prompt', result=result)) == 'answer'
+        assert result['context'] == [4, 5]
+
+
+def test_cursor_round_trip():
+    created = datetime(2024, 5, 1, 12, 30, 15, 250)
+    assert aide.decode_cursor(aide.encode_cursor(created, 42)) == (created, 42)
+
+
+@pytest.mark.parametrize('cursor', ['not base64!', 'bm8gc2VwYXJhdG9y', 'MjAyNC0wNS0wMXx4', 'YWJjfDE='])
+def test_bad_cursors_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        aide.decode_cursor(cursor)
+
+
+def test_page_arguments():
+    cursor = aide.encode_cursor(datetime(2024, 5, 1), 7)
+    with aide.app.test_request_context(f'/history?limit=500&before={cursor}&since=3'):
+        assert aide.page_arguments(20) == (100, (datetime(2024, 5, 1), 7), 3)
+    with aide.app.test_request_context('/history?limit=0'):
+        assert aide.page_arguments(20) == (1, None, None)
+    with aide.app.test_request_context('/history?before=bad'):
+        with pytest.raises(ValueError):
+            aide.page_arguments(20)
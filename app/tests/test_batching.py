@@ -0,0 +1,88 @@
+import threading
+import time
+
+import pytest
+
+from batching import BatchScheduler
+
+
+class Recorder:
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+
+    def __call__(self, items):
+        if self.gate is not None:
+            self.gate.wait(2)
+        self.batches.append(list(items))
+        return [item * 10 for item in items]
+
+
+def test_full_batch_is_flushed_without_waiting():
+    recorder = Recorder()
+    scheduler = BatchScheduler(recorder, max_batch_size=4, max_wait_ms=10_000)
+    try:
+        started = time.monotonic()
+        futures = [scheduler.submit(i) for i in range(4)]
+        assert [f.result(timeout=2) for f in futures] == [0, 10, 20, 30]
+        assert time.monotonic() - started < 2
+        assert recorder.batches == [[0, 1, 2, 3]]
+    finally:
+        scheduler.stop()
+
+
+def test_partial_batch_is_flushed_after_max_wait():
+    recorder = Recorder()
+    scheduler = BatchScheduler(recorder, max_batch_size=8, max_wait_ms=50)
+    try:
+        futures = [scheduler.submit(i) for i in range(3)]
+        assert [f.result(timeout=2) for f in futures] == [0, 10, 20]
+        assert recorder.batches == [[0, 1, 2]]
+    finally:
+        scheduler.stop()
+
+
+def test_items_queued_while_a_batch_runs_form_the_next_batch():
+    gate = threading.Event()
+    recorder = Recorder(gate)
+    scheduler = BatchScheduler(recorder, max_batch_size=3, max_wait_ms=0)
+    try:
+        first = scheduler.submit(0)
+        time.sleep(0.05)
+        rest = [scheduler.submit(i) for i in range(1, 6)]
+        gate.set()
+        assert [f.result(timeout=2) for f in [first] + rest] == [0, 10, 20, 30, 40, 50]
+        assert recorder.batches == [[0], [1, 2, 3], [4, 5]]
+    finally:
+        scheduler.stop()
+
+
+def test_batch_errors_reach_every_caller():
+    def fail(items):
+        raise RuntimeError('model failed')
+
+    scheduler = BatchScheduler(fail, max_batch_size=2, max_wait_ms=10)
+    try:
+        futures = [scheduler.submit(i) for i in range(2)]
+        for future in futures:
+            with pytest.raises(RuntimeError, match='model failed'):
+                future.result(timeout=2)
+    finally:
+        scheduler.stop()
+
+
+def test_wrong_result_count_is_an_error():
+    scheduler = BatchScheduler(lambda items: items[:1], max_batch_size=2, max_wait_ms=1000)
+    try:
+        futures = [scheduler.submit(i) for i in range(2)]
+        with pytest.raises(RuntimeError, match='1 results for 2 items'):
+            futures[1].result(timeout=2)
+    finally:
+        scheduler.stop()
+
+
+def test_stopped_scheduler_rejects_items():
+    scheduler = BatchScheduler(lambda items: items)
+    scheduler.stop()
+    with pytest.raises(RuntimeError):
+        scheduler.submit(1)
@@ -0,0 +1,55 @@
+import threading
+from types import SimpleNamespace
+
+from chat_context import ChatContext
+
+
+def turn(id, text='x' * 400):
+    return SimpleNamespace(id=id, user_message=text, ai_response=text)
+
+
+class Summaries:
+    def __init__(self):
+        self.stored = {}
+        self.done = threading.Event()
+        self.calls = []
+
+    def summarize(self, summary, pairs):
+        self.calls.append(pairs)
+        return f'{len(pairs)} turns'
+
+    def load(self, conversation_id):
+        return self.stored.get(conversation_id, (None, 0))
+
+    def store(self, conversation_id, summary, last_turn_id):
+        self.stored[conversation_id] = (summary, last_turn_id)
+        self.done.set()
+
+
+def test_short_conversation_is_sent_verbatim():
+    summaries = Summaries()
+    context = ChatContext(summaries.summarize, summaries.load, summaries.store, token_budget=3000)
+    messages = context.build(1, [turn(1, 'hi'), turn(2, 'how large?')], 'and now?', 'user')
+    assert [m['content'] for m in messages] == ['hi', 'hi', 'how large?', 'how large?', 'and now?']
+    assert summaries.calls == []
+
+
+def test_older_turns_are_summarized_in_the_background():
+    summaries = Summaries()
+    # Each turn is about 208 tokens, two of them fit.
+    context = ChatContext(summaries.summarize, summaries.load, summaries.store, token_budget=450, min_recent_turns=1)
+    turns = [turn(i) for i in range(1, 6)]
+    messages = context.build(1, turns, 'next', 'user')
+    assert len(messages) == 2 * 2 + 1
+    assert summaries.done.wait(2)
+    assert summaries.stored[1] == ('3 turns', 3)
+
+    messages = context.build(1, turns, 'next', 'user')
+    assert messages[0] == {'role': 'system', 'content': 'Summary of the earlier conversation with the patient: 3 turns'}
+
+
+def test_min_recent_turns_are_kept_over_budget():
+    summaries = Summaries()
+    context = ChatContext(summaries.summarize, summaries.load, summaries.store, token_budget=10, min_recent_turns=2)
+    messages = context.build(1, [turn(1), turn(2)], 'next', 'user')
+    assert len(messages) == 5
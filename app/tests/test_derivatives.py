@@ -0,0 +1,53 @@
+import io
+import os
+import time
+
+from PIL import Image
+
+from derivatives import DerivativeCache, source_stamp
+
+
+def write_scan(path, size=(600, 300), color=(200, 10, 10)):
+    Image.new('RGB', size, color).save(path, format='PNG')
+    return str(path)
+
+
+def test_images_are_derived_once(tmp_path):
+    source = write_scan(tmp_path / 'scan.png')
+    cache = DerivativeCache(str(tmp_path / 'derived'))
+    full, mime = cache.read(1, 'original', source)
+    assert mime == 'image/webp'
+    assert Image.open(io.BytesIO(full)).size == (600, 300)
+    thumb, _ = cache.read(1, 'original', source, 'thumb')
+    assert max(Image.open(io.BytesIO(thumb)).size) == 256
+    assert cache.generated == 1
+
+
+def test_a_rewritten_source_is_derived_again(tmp_path):
+    source = write_scan(tmp_path / 'scan.png')
+    cache = DerivativeCache(str(tmp_path / 'derived'), full_format='PNG')
+    cache.ensure(1, 'processed', source)
+    stamp = source_stamp(source)
+    write_scan(tmp_path / 'scan.png', size=(100, 50))
+    os.utime(source, ns=(stamp[2] + 1, stamp[2] + 1))
+    full, mime = cache.read(1, 'processed', source)
+    assert mime == 'image/png'
+    assert Image.open(io.BytesIO(full)).size == (100, 50)
+    assert cache.generated == 2
+
+
+def test_missing_source(tmp_path):
+    cache = DerivativeCache(str(tmp_path / 'derived'))
+    assert cache.read(1, 'original', str(tmp_path / 'missing.png')) == (None, None)
+    assert source_stamp(None) is None
+
+
+def test_generate_async(tmp_path):
+    source = write_scan(tmp_path / 'scan.png')
+    cache = DerivativeCache(str(tmp_path / 'derived'))
+    cache.generate_async(7, {'original': source, 'processed': None})
+    deadline = time.monotonic() + 5
+    while cache.generated < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert os.path.exists(cache.path(7, 'original'))
+    assert not os.path.exists(cache.path(7, 'processed'))
@@ -0,0 +1,36 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from ingest import IngestedImage
+
+
+def png(color=(10, 20, 30), size=(6, 4)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def test_decoded_once_into_rgb_and_bgr():
+    image = IngestedImage(png())
+    assert image.rgb.shape == (4, 6, 3)
+    assert tuple(image.rgb[0, 0]) == (10, 20, 30)
+    assert tuple(image.bgr[0, 0]) == (30, 20, 10)
+    assert image.bgr.flags['C_CONTIGUOUS']
+
+
+def test_encodings_are_kept_per_format_and_size():
+    image = IngestedImage(png(size=(64, 32)))
+    assert image.encode('png') is image.encode('PNG')
+    thumbnail = Image.open(io.BytesIO(image.encode('JPEG', max_size=16)))
+    assert thumbnail.format == 'JPEG' and thumbnail.size == (16, 8)
+    assert image.to_base64('PNG')[1] == 'image/png'
+
+
+def test_digest_follows_the_uploaded_bytes(tmp_path):
+    path = tmp_path / 'scan.png'
+    path.write_bytes(png())
+    assert IngestedImage.from_path(str(path)).digest == IngestedImage(png()).digest
+    assert IngestedImage(png(color=(0, 0, 0))).digest != IngestedImage(png()).digest
+    assert np.array_equal(IngestedImage.from_path(str(path)).rgb, IngestedImage(png()).rgb)
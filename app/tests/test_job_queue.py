@@ -0,0 +1,49 @@
+import threading
+
+from job_queue import JobWorkers
+
+
+def test_queued_jobs_run_once_with_their_attached_input():
+    queue = ['a', 'b']
+    seen = {}
+    done = threading.Event()
+    lock = threading.Lock()
+
+    def claim():
+        with lock:
+            return queue.pop(0) if queue else None
+
+    def run(job_id):
+        seen[job_id] = workers.take(job_id)
+        if len(seen) == 2:
+            done.set()
+
+    workers = JobWorkers(claim, run, workers=2, poll_interval=0.01)
+    workers.attach('a', 'decoded a')
+    workers.start()
+    try:
+        assert done.wait(2)
+    finally:
+        workers.stop()
+    # b was queued without an input, it reads its own.
+    assert seen == {'a': 'decoded a', 'b': None}
+
+
+def test_attached_inputs_are_bounded():
+    workers = JobWorkers(lambda: None, lambda job_id: None, max_attached=2)
+    for job_id in 'abc':
+        workers.attach(job_id, job_id.upper())
+    assert workers.take('a') is None
+    assert workers.take('c') == 'C'
+    assert workers.take('c') is None
+
+
+def test_progress_is_copied():
+    workers = JobWorkers(lambda: None, lambda job_id: None)
+    workers.set_progress('a', segmentation={'tumor': True})
+    workers.add_token('a', 'Hello')
+    progress = workers.progress('a')
+    progress['tokens'].append('changed')
+    assert workers.progress('a') == {'tokens': ['Hello'], 'segmentation': {'tumor': True}}
+    workers.clear_progress('a')
+    assert workers.progress('a') == {'tokens': []}
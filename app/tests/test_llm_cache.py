@@ -0,0 +1,43 @@
+import json
+
+from llm_cache import LLMResponseCache, make_llm_cache_key
+
+
+def test_key_ignores_prompt_indentation():
+    assert make_llm_cache_key({'model': 'm', 'prompt': '  Hello\n      world '}) == make_llm_cache_key({'model': 'm', 'prompt': 'Hello world'})
+
+
+def test_key_covers_model_images_messages_and_context():
+    base = {'model': 'm', 'prompt': 'p', 'images': ['aW1hZ2U=']}
+    key = make_llm_cache_key(base)
+    assert key != make_llm_cache_key(dict(base, model='other'))
+    assert key != make_llm_cache_key(dict(base, images=['b3RoZXI=']))
+    assert key != make_llm_cache_key(dict(base, context=[1, 2, 3]))
+    assert make_llm_cache_key(dict(base, context=[1, 2, 3])) != make_llm_cache_key(dict(base, context=[1, 2, 4]))
+    chat = {'model': 'm', 'messages': [{'role': 'user', 'content': 'hi'}]}
+    assert make_llm_cache_key(chat) != make_llm_cache_key({'model': 'm', 'messages': [{'role': 'system', 'content': 'hi'}]})
+
+
+def test_generate_entry_keeps_its_context(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / 'llm.sqlite'))
+    cache.put('k', json.dumps({'response': 'answer', 'done': True, 'context': [1, 2, 3]}))
+    reopened = LLMResponseCache(str(tmp_path / 'llm.sqlite'))
+    assert json.loads(reopened.get('k'))['context'] == [1, 2, 3]
+    assert reopened.stats()['hits'] == 1
+
+
+def test_expired_entries_miss(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / 'llm.sqlite'), ttl_seconds=-1)
+    cache.put('k', 'answer')
+    assert cache.get('k') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = LLMResponseCache(str(tmp_path / 'llm.sqlite'), max_entries=2)
+    cache.put('a', 'A')
+    cache.put('b', 'B')
+    cache.get('a')
+    cache.put('c', 'C')
+    assert cache.get('b') is None
+    assert cache.get('a') == 'A' and cache.get('c') == 'C'
@@ -0,0 +1,41 @@
+from llm_context import ConversationContexts
+
+
+def test_follow_up_after_first_chat_reuses_the_diagnosis_context():
+    contexts = ConversationContexts()
+    # save_scan: the diagnosis starts the conversation before any turn is stored.
+    contexts.put(1, 'model', None, [1, 2, 3])
+    # save_first_chat stores turn 10 without a generation of its own.
+    contexts.advance(1, 'model', None, 10)
+    # The follow-up is looked up by the newest stored turn, as chat_request does.
+    assert contexts.get(1, 'model', 10) == [1, 2, 3]
+    contexts.put(1, 'model', 11, [1, 2, 3, 4])
+    assert contexts.get(1, 'model', 11) == [1, 2, 3, 4]
+    assert contexts.stats()['hits'] == 2
+
+
+def test_advance_leaves_stale_states_alone():
+    contexts = ConversationContexts()
+    contexts.put(1, 'model', 5, [1, 2])
+    contexts.advance(1, 'model', None, 10)
+    contexts.advance(1, 'other', 5, 10)
+    assert contexts.get(1, 'model', 10) is None
+
+
+def test_turn_stored_since_the_context_misses():
+    contexts = ConversationContexts()
+    contexts.put(1, 'model', None, [1, 2])
+    assert contexts.get(1, 'model', 10) is None
+    # The stale state is dropped.
+    assert contexts.stats()['conversations'] == 0
+
+
+def test_long_contexts_and_lru_bounds():
+    contexts = ConversationContexts(max_entries=2, max_context_tokens=3)
+    contexts.put(1, 'model', None, [1, 2, 3, 4])
+    assert contexts.stats()['conversations'] == 0
+    contexts.put(1, 'model', None, [1])
+    contexts.put(2, 'model', None, [2])
+    contexts.put(3, 'model', None, [3])
+    assert contexts.get(1, 'model', None) is None
+    assert contexts.get(3, 'model', None) == [3]
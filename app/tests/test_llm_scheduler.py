@@ -0,0 +1,97 @@
+import threading
+import time
+
+import pytest
+
+from llm_scheduler import LLMOverloaded, LLMScheduler
+
+CLASSES = {
+    'chat': {'priority': 0, 'limit': 4, 'max_queue': 32, 'timeout': 2, 'reserved': 1},
+    'report': {'priority': 1, 'limit': 2, 'max_queue': 8, 'timeout': 0.2},
+    'background': {'priority': 2, 'limit': 2, 'max_queue': None, 'timeout': 0.2},
+}
+
+
+class Holder:
+    """Keeps slots of the scheduler busy until released."""
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.release = threading.Event()
+        self.threads = []
+
+    def hold(self, llm_class):
+        started = threading.Event()
+
+        def run():
+            with self.scheduler.slot(llm_class):
+                started.set()
+                self.release.wait()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        assert started.wait(2)
+        self.threads.append(thread)
+
+    def stop(self):
+        self.release.set()
+        for thread in self.threads:
+            thread.join(2)
+
+
+def test_chat_keeps_its_reserved_slot_under_saturation():
+    scheduler = LLMScheduler(4, CLASSES)
+    holder = Holder(scheduler)
+    try:
+        holder.hold('report')
+        holder.hold('report')
+        holder.hold('background')
+        # One global slot is left, reserved for chat: another job has to wait and times out.
+        with pytest.raises(LLMOverloaded) as error:
+            with scheduler.slot('background'):
+                pass
+        assert error.value.timed_out
+        with scheduler.slot('chat'):
+            assert scheduler.stats()['chat']['running'] == 1
+    finally:
+        holder.stop()
+
+
+def test_waiters_are_served_by_priority():
+    scheduler = LLMScheduler(1, {
+        'chat': {'priority': 0, 'limit': 1, 'max_queue': None, 'timeout': None},
+        'background': {'priority': 2, 'limit': 1, 'max_queue': None, 'timeout': None},
+    })
+    holder = Holder(scheduler)
+    holder.hold('background')
+    order = []
+
+    def call(llm_class):
+        with scheduler.slot(llm_class):
+            order.append(llm_class)
+
+    threads = [threading.Thread(target=call, args=('background',))]
+    threads[0].start()
+    time.sleep(0.05)
+    threads.append(threading.Thread(target=call, args=('chat',)))
+    threads[1].start()
+    time.sleep(0.05)
+    holder.stop()
+    for thread in threads:
+        thread.join(2)
+    assert order == ['chat', 'background']
+
+
+def test_full_queue_rejects_with_retry_after():
+    scheduler = LLMScheduler(4, dict(CLASSES, report=dict(CLASSES['report'], max_queue=0)))
+    with pytest.raises(LLMOverloaded) as error:
+        scheduler.admit('report')
+    assert not error.value.timed_out
+    assert error.value.retry_after >= 1
+    assert 'full' in str(error.value)
+
+
+def test_configs_that_reserve_every_slot_are_rejected():
+    with pytest.raises(ValueError):
+        LLMScheduler(2, dict(CLASSES, chat=dict(CLASSES['chat'], reserved=2)))
+    with pytest.raises(ValueError):
+        LLMScheduler(4, dict(CLASSES, report=dict(CLASSES['report'], reserved=3)))
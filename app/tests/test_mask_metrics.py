@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+from mask_metrics import compute_mask_metrics, default_pixel_spacing, pixel_spacing_from_image
+
+
+def test_instances_are_measured_together():
+    masks = np.zeros((2, 10, 10), dtype=np.uint8)
+    masks[0, 2:4, 3:7] = 1  # 2 x 4 block
+    masks[1, 3:5, 5:9] = 1  # overlaps masks[0] in 1 x 2 pixels
+    metrics = compute_mask_metrics(masks, pixel_spacing=(1.0, 2.0))
+    first, second = metrics['instances']
+    assert first['area_px'] == 8
+    assert first['area_mm2'] == pytest.approx(16.0)
+    assert first['bbox_px'] == [3, 2, 6, 3]
+    assert first['centroid_px'] == pytest.approx([4.5, 2.5])
+    assert first['extent_mm'] == pytest.approx([8.0, 2.0])
+    # 2 rows x 2 vertical edges of 1 mm, 4 columns x 2 horizontal edges of 2 mm.
+    assert first['perimeter_mm'] == pytest.approx(4 * 1.0 + 8 * 2.0)
+    assert metrics['total_area_px'] == 8 + 8 - 2
+    assert metrics['total_area_cm2'] == pytest.approx(14 * 2.0 / 100)
+    assert second['area_px'] == 8
+
+
+def test_empty_and_missing_masks():
+    empty = compute_mask_metrics(np.zeros((1, 4, 4)))
+    assert empty['instances'][0]['bbox_px'] is None
+    assert empty['total_area_px'] == 0
+    assert compute_mask_metrics(np.zeros((0, 4, 4)))['instances'] == []
+    assert compute_mask_metrics(np.ones((4, 4)))['count'] == 1
+
+
+def test_default_spacing_spans_the_field_of_view():
+    assert default_pixel_spacing(300, 150) == (1.0, 2.0)
+    metrics = compute_mask_metrics(np.ones((1, 300, 150)))
+    assert metrics['total_area_mm2'] == pytest.approx(300 * 300)
+
+
+def test_spacing_from_tiff_resolution(tmp_path):
+    path = str(tmp_path / 'slice.tif')
+    Image.new('L', (4, 4)).save(path, dpi=(254, 127))
+    assert pixel_spacing_from_image(path) == pytest.approx((0.2, 0.1))
+
+    placeholder = str(tmp_path / 'placeholder.tif')
+    Image.new('L', (4, 4)).save(placeholder, dpi=(72, 72))
+    assert pixel_spacing_from_image(placeholder) is None
+
+    png = str(tmp_path / 'slice.png')
+    Image.new('L', (4, 4)).save(png)
+    assert pixel_spacing_from_image(png) is None
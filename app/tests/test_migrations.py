@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, inspect, text
+
+from migrations import MIGRATIONS, current_version, migrate
+
+
+def models():
+    metadata = MetaData()
+    Table('scan', metadata, Column('id', Integer, primary_key=True), Column('user_id', Integer), Column('created_at', String))
+    Table('chat_history', metadata, Column('id', Integer, primary_key=True), Column('user_id', Integer),
+          Column('scan_id', Integer), Column('timestamp', String))
+    Table('scan_job', metadata, Column('id', String(32), primary_key=True), Column('status', String(12)))
+    return metadata
+
+
+def test_steps_are_applied_once(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    assert current_version(engine) == 0
+    assert migrate(engine, models()) == [version for version, _, _ in MIGRATIONS] == [1, 2, 3]
+    assert migrate(engine, models()) == []
+    assert current_version(engine) == 3
+
+    schema = inspect(engine)
+    assert {'owner', 'heartbeat_at'} <= {column['name'] for column in schema.get_columns('scan_job')}
+    assert 'ix_chat_history_scan_id_timestamp' in {index['name'] for index in schema.get_indexes('chat_history')}
+
+
+def test_database_of_an_older_version_is_brought_up_to_date(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'app.db'}")
+    # As created before the migrations: tables without the later columns, no schema_version.
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE scan (id INTEGER PRIMARY KEY, user_id INTEGER, created_at DATETIME)"))
+        connection.execute(text("CREATE TABLE chat_history (id INTEGER PRIMARY KEY, user_id INTEGER, scan_id INTEGER, timestamp DATETIME)"))
+        connection.execute(text("CREATE TABLE scan_job (id VARCHAR(32) PRIMARY KEY, status VARCHAR(12))"))
+        connection.execute(text("INSERT INTO scan_job (id, status) VALUES ('a', 'queued')"))
+    assert migrate(engine, models()) == [1, 2, 3]
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT id, owner, heartbeat_at FROM scan_job")).all() == [('a', None, None)]
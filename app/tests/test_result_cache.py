@@ -0,0 +1,54 @@
+import os
+
+import numpy as np
+
+from result_cache import InferenceCache, file_fingerprint, make_cache_key
+
+
+def entry(size=0, area=1.5):
+    return {'yolo_results_json': '[]', 'masks': np.ones((1, 4, 4), dtype=np.uint8), 'overlay': b'\xff' * size, 'tumor_area_cm2': area}
+
+
+def test_key_covers_image_model_and_settings():
+    key = make_cache_key(b'image', 'model-a', 0.5, 0.7)
+    assert key == make_cache_key(b'image', 'model-a', 0.5, 0.7)
+    assert key != make_cache_key(b'other', 'model-a', 0.5, 0.7)
+    assert key != make_cache_key(b'image', 'model-b', 0.5, 0.7)
+    assert key != make_cache_key(b'image', 'model-a', 0.25, 0.7)
+
+
+def test_entries_survive_a_restart_from_disk(tmp_path):
+    InferenceCache(str(tmp_path)).put('k', entry(size=3))
+    cached = InferenceCache(str(tmp_path)).get('k')
+    assert cached['tumor_area_cm2'] == 1.5
+    assert cached['overlay'] == b'\xff' * 3
+    assert np.array_equal(cached['masks'], np.ones((1, 4, 4)))
+    assert 'has_masks' not in cached
+
+
+def test_memory_is_least_recently_used(tmp_path):
+    cache = InferenceCache(str(tmp_path), memory_items=2, disk_max_bytes=0)
+    for key in 'abc':
+        cache.put(key, entry())
+    assert cache.get('a') is None
+    assert cache.get('c') is not None
+
+
+def test_disk_is_bounded(tmp_path):
+    cache = InferenceCache(str(tmp_path), memory_items=0, disk_max_bytes=1)
+    cache.put('a', entry(size=100))
+    cache.put('b', entry(size=100))
+    assert len(os.listdir(tmp_path)) <= 1
+
+
+def test_unreadable_entries_are_dropped(tmp_path):
+    (tmp_path / 'bad.npz').write_bytes(b'not a zip')
+    cache = InferenceCache(str(tmp_path), memory_items=0)
+    assert cache.get('bad') is None
+    assert not (tmp_path / 'bad.npz').exists()
+
+
+def test_file_fingerprint(tmp_path):
+    path = tmp_path / 'scan.png'
+    path.write_bytes(b'abc' * 1000)
+    assert file_fingerprint(str(path), chunk_size=7) == file_fingerprint(str(path))
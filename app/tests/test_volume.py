@@ -0,0 +1,60 @@
+import os
+import zipfile
+
+import pytest
+from PIL import Image
+
+from volume import VolumeTooLarge, estimate_volume, extract_slices, is_volume_upload
+
+
+def write_archive(path, members):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, data in members.items():
+            archive.writestr(name, data)
+    return str(path)
+
+
+def png_bytes(tmp_path):
+    image_path = tmp_path / 'slice.png'
+    Image.new('L', (4, 4)).save(image_path)
+    return image_path.read_bytes()
+
+
+def test_archive_slices_are_ordered_by_number_without_masks(tmp_path):
+    data = png_bytes(tmp_path)
+    upload = write_archive(tmp_path / 'volume.zip', {
+        'p/TCGA_10.png': data, 'p/TCGA_2.png': data, 'p/TCGA_2_mask.png': data, 'p/.hidden.png': data, 'notes.txt': b'x'})
+    assert is_volume_upload(upload)
+    paths = extract_slices(upload, str(tmp_path / 'out'))
+    assert [os.path.basename(p) for p in paths] == ['0001_TCGA_2.png', '0002_TCGA_10.png']
+
+
+def test_archive_over_the_slice_limit_is_rejected(tmp_path):
+    upload = write_archive(tmp_path / 'volume.zip', {f'slice_{i}.png': b'x' for i in range(4)})
+    with pytest.raises(VolumeTooLarge):
+        extract_slices(upload, str(tmp_path / 'out'), max_slices=3)
+
+
+def test_archive_over_the_byte_limit_is_rejected(tmp_path):
+    upload = write_archive(tmp_path / 'volume.zip', {'slice_1.png': b'x' * 600, 'slice_2.png': b'x' * 600})
+    with pytest.raises(VolumeTooLarge):
+        extract_slices(upload, str(tmp_path / 'out'), max_bytes=1000)
+    assert len(extract_slices(upload, str(tmp_path / 'out'), max_bytes=1200)) == 2
+
+
+def test_multi_page_tiff(tmp_path):
+    upload = str(tmp_path / 'volume.tif')
+    pages = [Image.new('L', (4, 4), color) for color in (0, 128, 255)]
+    pages[0].save(upload, save_all=True, append_images=pages[1:])
+    assert is_volume_upload(upload)
+    assert len(extract_slices(upload, str(tmp_path / 'out'))) == 3
+    with pytest.raises(VolumeTooLarge):
+        extract_slices(upload, str(tmp_path / 'out'), max_slices=2)
+
+
+def test_estimate_volume():
+    volume = estimate_volume([0, 1.0, 2.0, None, 0], slice_thickness_mm=5)
+    assert volume['tumor_volume_cm3'] == pytest.approx(1.5)
+    assert volume['tumor_slice_count'] == 2
+    assert volume['largest_slice_index'] == 2
+    assert volume['tumor_extent_mm'] == 10
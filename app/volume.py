@@ -0,0 +1,97 @@
+# Whole-volume scan uploads.
+# A volume is either a multi-page TIFF or an archive of single slice images laid out
+# like the kaggle_3m dataset (<patient>_<N>.tif, with <patient>_<N>_mask.tif ground truth files).
+
+import os
+import re
+import zipfile
+
+from PIL import Image, ImageSequence
+
+SLICE_EXTENSIONS = ('.tif', '.tiff', '.png', '.jpg', '.jpeg')
+_SLICE_NUMBER = re.compile(r'_(\d+)$')
+_COPY_CHUNK = 1024 * 1024
+
+
+class VolumeTooLarge(ValueError):
+    """The upload has more slices or more uncompressed data than allowed."""
+
+
+def is_volume_upload(file_path):
+    """True when the file is an archive of slices or a TIFF with more than one page."""
+    if zipfile.is_zipfile(file_path):
+        return True
+    try:
+        with Image.open(file_path) as img:
+            return getattr(img, 'n_frames', 1) > 1
+    except Exception:
+        return False
+
+
+def _slice_sort_key(name):
+    stem = os.path.splitext(os.path.basename(name))[0]
+    match = _SLICE_NUMBER.search(stem)
+    return (int(match.group(1)) if match else float('inf'), stem)
+
+
+def extract_slices(file_path, output_dir, max_slices=1000, max_bytes=1024 * 1024 * 1024):
+    """
+    Writes every slice of a volume upload to output_dir as its own image file.
+    Returns the slice paths ordered by slice number.
+    Raises VolumeTooLarge beyond max_slices slices or max_bytes of extracted archive members.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    slice_paths = []
+
+    if zipfile.is_zipfile(file_path):
+        with zipfile.ZipFile(file_path) as archive:
+            names = [
+                n for n in archive.namelist()
+                if n.lower().endswith(SLICE_EXTENSIONS)
+                and not os.path.splitext(n)[0].endswith('_mask')  # kaggle_3m ground truth
+                and not os.path.basename(n).startswith('.')
+            ]
+            if len(names) > max_slices:
+                raise VolumeTooLarge(f"The archive has {len(names)} slices, at most {max_slices} are accepted.")
+            # Checked up front against the declared sizes and again while copying, the header can lie.
+            if sum(archive.getinfo(n).file_size for n in names) > max_bytes:
+                raise VolumeTooLarge(f"The archive unpacks to more than {max_bytes // (1024 * 1024)} MB.")
+            remaining = max_bytes
+            for index, name in enumerate(sorted(names, key=_slice_sort_key), start=1):
+                # Series exports repeat file names across folders; the index keeps every member.
+                target = os.path.join(output_dir, f"{index:04d}_{os.path.basename(name)}")
+                with archive.open(name) as src, open(target, 'wb') as dst:
+                    while chunk := src.read(_COPY_CHUNK):
+                        remaining -= len(chunk)
+                        if remaining < 0:
+                            raise VolumeTooLarge(f"The archive unpacks to more than {max_bytes // (1024 * 1024)} MB.")
+                        dst.write(chunk)
+                slice_paths.append(target)
+    else:
+        with Image.open(file_path) as img:
+            if getattr(img, 'n_frames', 1) > max_slices:
+                raise VolumeTooLarge(f"The TIFF has {img.n_frames} pages, at most {max_slices} are accepted.")
+            for index, frame in enumerate(ImageSequence.Iterator(img), start=1):
+                target = os.path.join(output_dir, f"{stem}_{index}.tif")
+                frame.copy().save(target, format='TIFF')
+                slice_paths.append(target)
+
+    return slice_paths
+
+
+def estimate_volume(slice_areas_cm2, slice_thickness_mm):
+    """
+    Estimates tumor volume by summing the segmented area of each slice times the slice thickness.
+    Returns a dict with the volume in cm3 and a short per-volume summary.
+    """
+    areas = [float(a or 0.0) for a in slice_areas_cm2]
+    tumor_slices = [i for i, a in enumerate(areas) if a > 0]
+    volume_cm3 = sum(areas) * slice_thickness_mm / 10.0
+    return {
+        'tumor_volume_cm3': volume_cm3,
+        'slice_count': len(areas),
+        'tumor_slice_count': len(tumor_slices),
+        'largest_slice_index': max(range(len(areas)), key=lambda i: areas[i]) if areas else None,
+        'tumor_extent_mm': (tumor_slices[-1] - tumor_slices[0] + 1) * slice_thickness_mm if tumor_slices else 0.0
+    }
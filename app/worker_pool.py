@@ -0,0 +1,232 @@
+# Multi-process inference service.
+# Every worker process loads the model once and pins the thread count of its engine.
+# Images are handed over as decoded arrays in shared memory, results come back
+# as the same entries the in-process path builds (see segmentation.py).
+
+import itertools
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+def _attach_shared_memory(name):
+    """Opens an existing block without making this process responsible for unlinking it."""
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+    except TypeError:
+        # Older versions register the block again, but spawned workers share the parent's
+        # resource tracker, so the parent's unlink still clears it.
+        return shared_memory.SharedMemory(name=name)
+
+
+def _worker_main(worker_id, model_path, engine, predict_kwargs, threads, tasks, results):
+    from ultralytics import YOLO
+    from engines import load_engine, model_imgsz
+    from segmentation import result_to_entry
+
+    model = load_engine(model_path, engine, threads=threads)
+    imgsz = model_imgsz(model if engine == 'torch' else YOLO(model_path))
+    results.put(('ready', worker_id, None, os.getpid()))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, kind, payload = task
+        if kind == 'ping':
+            results.put(('pong', worker_id, task_id, None))
+            continue
+        try:
+            shm_name, shape, dtype, pixel_spacing = payload
+            shm = _attach_shared_memory(shm_name)
+            try:
+                # ultralytics keeps references to its input, so take a private copy and release the block.
+                image = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf).copy()
+            finally:
+                shm.close()
+            result = model.predict(source=image, imgsz=imgsz, verbose=False, **predict_kwargs)[0]
+            results.put(('done', worker_id, task_id, result_to_entry(result, pixel_spacing)))
+        except Exception as e:
+            results.put(('error', worker_id, task_id, f"{type(e).__name__}: {e}"))
+
+
+class InferencePool:
+    """
+    Pool of model worker processes.
+
+    :param model_path: Weights file every worker loads.
+    :param engine: Inference engine (see engines.py).
+    :param workers: Number of worker processes.
+    :param threads_per_worker: Engine threads of each worker, defaults to an even split of the CPUs.
+    :param predict_kwargs: Extra arguments for model.predict (conf, iou, ...).
+    :param health_interval: Seconds between health checks.
+    :param health_timeout: A worker that does not answer a ping within this time is restarted.
+    """
+    def __init__(self, model_path, engine='torch', workers=2, threads_per_worker=None, predict_kwargs=None,
+                 health_interval=5.0, health_timeout=120.0):
+        self.model_path = model_path
+        self.engine = engine
+        self.workers = max(1, int(workers))
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // self.workers)
+        self.predict_kwargs = predict_kwargs or {}
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+
+        self._ctx = mp.get_context('spawn')
+        self._results = self._ctx.Queue()
+        self._workers = {}
+        self._pending = {}  # task id -> (worker id, future, shared memory block)
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        for worker_id in range(self.workers):
+            self._start_worker(worker_id)
+        threading.Thread(target=self._collect_loop, name='inference-pool-results', daemon=True).start()
+        threading.Thread(target=self._monitor_loop, name='inference-pool-monitor', daemon=True).start()
+
+    def _start_worker(self, worker_id, restarts=0):
+        tasks = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(worker_id, self.model_path, self.engine, self.predict_kwargs, self.threads_per_worker, tasks, self._results),
+            name=f'inference-worker-{worker_id}',
+            daemon=True
+        )
+        process.start()
+        self._workers[worker_id] = {
+            'process': process,
+            'tasks': tasks,
+            'ready': False,
+            'outstanding': 0,
+            'restarts': restarts,
+            'ping_id': None,
+            'ping_sent': None
+        }
+        print(f"Inference worker {worker_id} starting (pid {process.pid}, {self.threads_per_worker} threads).")
+
+    def submit(self, image: np.ndarray, pixel_spacing=None) -> Future:
+        """Queues one decoded image (H, W, C BGR array) and returns a Future of its result entry."""
+        if self._stopped.is_set():
+            raise RuntimeError('Inference pool is stopped.')
+        image = np.ascontiguousarray(image)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+        np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[...] = image
+
+        future = Future()
+        with self._lock:
+            worker_id = min(
+                (w for w in self._workers if self._workers[w]['process'].is_alive()),
+                key=lambda w: self._workers[w]['outstanding'],
+                default=None
+            )
+            if worker_id is None:
+                shm.close()
+                shm.unlink()
+                raise RuntimeError('No inference worker is alive.')
+            task_id = next(self._task_ids)
+            self._pending[task_id] = (worker_id, future, shm)
+            self._workers[worker_id]['outstanding'] += 1
+            self._workers[worker_id]['tasks'].put((task_id, 'predict', (shm.name, image.shape, image.dtype.str, pixel_spacing)))
+        return future
+
+    def __call__(self, image, pixel_spacing=None, timeout=None):
+        return self.submit(image, pixel_spacing).result(timeout=timeout)
+
+    def _finish(self, task_id, result=None, error=None):
+        with self._lock:
+            pending = self._pending.pop(task_id, None)
+            if pending is None:
+                return
+            worker_id, future, shm = pending
+            if worker_id in self._workers:
+                self._workers[worker_id]['outstanding'] -= 1
+        shm.close()
+        shm.unlink()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def _collect_loop(self):
+        while not self._stopped.is_set():
+            try:
+                kind, worker_id, task_id, payload = self._results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            if kind == 'ready':
+                with self._lock:
+                    if worker_id in self._workers:
+                        self._workers[worker_id]['ready'] = True
+                print(f"Inference worker {worker_id} ready (pid {payload}).")
+            elif kind == 'pong':
+                with self._lock:
+                    worker = self._workers.get(worker_id)
+                    if worker and worker['ping_id'] == task_id:
+                        worker['ping_id'] = worker['ping_sent'] = None
+            elif kind == 'done':
+                self._finish(task_id, result=payload)
+            elif kind == 'error':
+                self._finish(task_id, error=RuntimeError(f"Inference worker {worker_id} failed: {payload}"))
+
+    def _restart(self, worker_id, reason):
+        worker = self._workers[worker_id]
+        print(f"Inference worker {worker_id} {reason}, restarting.")
+        if worker['process'].is_alive():
+            worker['process'].terminate()
+        worker['process'].join(timeout=5)
+        failed = [task_id for task_id, (w, _, _) in self._pending.items() if w == worker_id]
+        self._start_worker(worker_id, restarts=worker['restarts'] + 1)
+        return [self._pending.pop(task_id) for task_id in failed]
+
+    def _monitor_loop(self):
+        while not self._stopped.wait(self.health_interval):
+            failed = []
+            with self._lock:
+                now = time.monotonic()
+                for worker_id, worker in list(self._workers.items()):
+                    if not worker['process'].is_alive():
+                        failed += self._restart(worker_id, f"exited with code {worker['process'].exitcode}")
+                    elif worker['ping_sent'] is not None and now - worker['ping_sent'] > self.health_timeout:
+                        failed += self._restart(worker_id, f"did not answer a health check in {self.health_timeout:.0f}s")
+                    elif worker['ready'] and worker['ping_id'] is None:
+                        worker['ping_id'] = next(self._task_ids)
+                        worker['ping_sent'] = now
+                        worker['tasks'].put((worker['ping_id'], 'ping', None))
+            for _, future, shm in failed:
+                shm.close()
+                shm.unlink()
+                future.set_exception(RuntimeError('Inference worker crashed while processing the image.'))
+
+    def health(self):
+        """Returns the state of every worker."""
+        with self._lock:
+            return [{
+                'worker_id': worker_id,
+                'pid': worker['process'].pid,
+                'alive': worker['process'].is_alive(),
+                'ready': worker['ready'],
+                'outstanding': worker['outstanding'],
+                'restarts': worker['restarts']
+            } for worker_id, worker in self._workers.items()]
+
+    def shutdown(self):
+        self._stopped.set()
+        with self._lock:
+            for worker in self._workers.values():
+                worker['tasks'].put(None)
+            for worker in self._workers.values():
+                worker['process'].join(timeout=5)
+                if worker['process'].is_alive():
+                    worker['process'].terminate()
+            pending = list(self._pending)
+        for task_id in pending:
+            self._finish(task_id, error=RuntimeError('Inference pool was shut down.'))